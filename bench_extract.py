@@ -0,0 +1,107 @@
+"""Parity check and throughput benchmark for scraper.extraction backends.
+
+    python bench_extract.py                      # built-in sample page
+    python bench_extract.py page1.html page2.html
+    python bench_extract.py https://sheerluxe.com/fashion
+
+Each page is extracted with every backend (including ``stream``, the
+incremental parser fed in chunks) and compared against the bs4
+reference. Any difference is printed and the script exits non-zero. Then
+each backend parses every page repeatedly and reports pages/s and MB/s.
+"""
+import sys
+import time
+
+from scraper.extraction import BACKENDS, etree
+
+BASE_URL = "https://sheerluxe.com/fashion"
+REFERENCE = "bs4"
+
+SAMPLE_ARTICLE = """
+<article class="card">
+  <a href="/fashion/2025/{i:02d}/look-{n}"><h2>Look {n}</h2></a>
+  <figure>
+    <img src="https://images.sheerluxe.com/look-{n}.jpg" alt="Look {n} &amp; friends"
+         srcset="https://images.sheerluxe.com/look-{n}-640.jpg 640w, https://images.sheerluxe.com/look-{n}-1280.jpg 1280w">
+    <figcaption>Spring edit <b>#{n}</b><script>track({n})</script></figcaption>
+  </figure>
+  <p>Shop the <a href="https://sheerluxe.com/fashion?page={n}">next page</a> of trends.</p>
+  <img data-src="lazy.jpg"><img srcset="/img/only-srcset-{n}.webp 2x">
+</article>
+"""
+
+
+def sample_page(articles=200):
+    body = "".join(SAMPLE_ARTICLE.format(i=n % 12 + 1, n=n) for n in range(articles))
+    return f"<html><head><title> Fashion | SheerLuxe </title></head><body><nav><a href='#'>Top</a></nav>{body}</body></html>"
+
+
+def load_pages(args):
+    if not args:
+        return [(BASE_URL, sample_page())]
+    pages = []
+    for arg in args:
+        if arg.startswith(("http://", "https://")):
+            from scraper.http_client import fetch
+            pages.append((arg, fetch(arg).text))
+        else:
+            with open(arg, encoding="utf-8", errors="replace") as f:
+                pages.append((BASE_URL, f.read()))
+    return pages
+
+
+def diff(reference, candidate):
+    problems = []
+    for key in ("title", "links"):
+        if reference[key] != candidate[key]:
+            problems.append(f"{key}: {reference[key]!r:.200} != {candidate[key]!r:.200}")
+    if len(reference["images"]) != len(candidate["images"]):
+        problems.append(f"images: {len(reference['images'])} != {len(candidate['images'])}")
+    for i, (ref_img, img) in enumerate(zip(reference["images"], candidate["images"])):
+        if ref_img != img:
+            problems.append(f"image {i}: {ref_img} != {img}")
+            break
+    return problems
+
+
+def check_parity(pages, backends):
+    ok = True
+    for base_url, html in pages:
+        reference = BACKENDS[REFERENCE](html, base_url)
+        for name in backends:
+            if name == REFERENCE:
+                continue
+            problems = diff(reference, BACKENDS[name](html, base_url))
+            status = "OK" if not problems else "MISMATCH"
+            print(f"[PARITY] {name} vs {REFERENCE} on {base_url} ({len(html)} chars): {status}")
+            for problem in problems:
+                print(f"    {problem}")
+            ok = ok and not problems
+    return ok
+
+
+def benchmark(pages, backends, min_seconds=2.0):
+    total_bytes = sum(len(html.encode("utf-8")) for _, html in pages)
+    for name in backends:
+        extract = BACKENDS[name]
+        runs = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < min_seconds:
+            for base_url, html in pages:
+                extract(html, base_url)
+            runs += 1
+        elapsed = time.perf_counter() - start
+        pages_per_sec = runs * len(pages) / elapsed
+        mb_per_sec = runs * total_bytes / elapsed / 1e6
+        print(f"[BENCH] {name:5s} {pages_per_sec:8.1f} pages/s  {mb_per_sec:7.2f} MB/s")
+
+
+if __name__ == "__main__":
+    backends = [name for name in BACKENDS if name == REFERENCE or etree is not None]
+    if len(backends) == 1:
+        print("[BENCH] lxml is not installed; only the bs4 reference will run")
+
+    pages = load_pages(sys.argv[1:])
+    parity_ok = check_parity(pages, backends)
+    benchmark(pages, backends)
+    sys.exit(0 if parity_ok else 1)
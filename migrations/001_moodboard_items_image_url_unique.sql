@@ -0,0 +1,15 @@
+-- moodboard_items is written with upsert(..., on_conflict="image_url")
+-- (scraper/bulk_writer.py), which PostgREST turns into
+-- INSERT ... ON CONFLICT (image_url). Postgres rejects that unless image_url
+-- carries a unique constraint or index.
+--
+-- Keep the newest row for any image_url stored more than once, then add the
+-- constraint. Run once in the Supabase SQL editor before deploying.
+
+DELETE FROM moodboard_items a
+USING moodboard_items b
+WHERE a.image_url = b.image_url
+  AND a.id < b.id;
+
+ALTER TABLE moodboard_items
+    ADD CONSTRAINT moodboard_items_image_url_key UNIQUE (image_url);
@@ -0,0 +1,157 @@
+"""Local stand-in for the OpenAI Files + Batch API.
+
+Run it and point the scraper at it to exercise METADATA_MODE=batch offline:
+
+    python3 openai_batch_stub.py
+    OPENAI_BASE_URL=http://localhost:5001/v1 OPENAI_API_KEY=stub METADATA_MODE=batch ...
+
+Every submitted batch completes immediately with a canned metadata
+response per request line, except lines whose ``custom_id`` is in
+``FAIL_CUSTOM_IDS``: those land in the batch's error file, as the real API
+reports requests it could not run. Lines in ``TEXT_CUSTOM_IDS`` get a plain
+text reply instead of JSON. Like the real API, an input file that repeats a
+``custom_id`` is rejected outright.
+"""
+import json
+import time
+import uuid
+from flask import Flask, request, jsonify, Response
+
+app = Flask(__name__)
+
+FILES = {}
+BATCHES = {}
+FAIL_CUSTOM_IDS = set()
+TEXT_CUSTOM_IDS = set()
+
+CANNED_METADATA = {
+    "product_info": {"brand": "Stub Brand", "brand_tier": "", "price_range": "", "availability": "", "shopping_url": ""},
+    "fashion_attributes": {
+        "item_category": "dress", "clothing_subtype": ["midi dress"], "fabric_material": ["linen"],
+        "texture": [], "fit": [], "silhouette": [], "pattern": [], "length": [], "sleeve_type": []
+    },
+    "style_context": {"celebrity_inspo": [], "style_archetype": [], "vibe_emotion": ["relaxed"]},
+    "occasion_context": {"event_type": ["brunch"], "seasonality": [], "climate": []},
+    "body_fit": {"body_shape_suitability": [], "body_feature_focus": []}
+}
+
+
+def _file_object(file_id):
+    f = FILES[file_id]
+    return {
+        "id": file_id,
+        "object": "file",
+        "bytes": len(f["content"]),
+        "created_at": f["created_at"],
+        "filename": f["filename"],
+        "purpose": f["purpose"],
+        "status": "processed"
+    }
+
+
+def _completion_for(request_line):
+    return {
+        "id": f"batch_req_{uuid.uuid4().hex[:12]}",
+        "custom_id": request_line["custom_id"],
+        "response": {
+            "status_code": 200,
+            "request_id": uuid.uuid4().hex,
+            "body": {
+                "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request_line["body"]["model"],
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": (
+                        "Sorry, I can't tell from this image." if request_line["custom_id"] in TEXT_CUSTOM_IDS
+                        else json.dumps(CANNED_METADATA)
+                    )},
+                    "finish_reason": "stop"
+                }]
+            }
+        },
+        "error": None
+    }
+
+
+def _error_for(request_line):
+    return {
+        "id": f"batch_req_{uuid.uuid4().hex[:12]}",
+        "custom_id": request_line["custom_id"],
+        "response": None,
+        "error": {"code": "invalid_request", "message": "Stub failure"}
+    }
+
+
+@app.route("/v1/files", methods=["POST"])
+def create_file():
+    upload = request.files["file"]
+    file_id = f"file-{uuid.uuid4().hex[:24]}"
+    FILES[file_id] = {
+        "content": upload.read(),
+        "filename": upload.filename,
+        "purpose": request.form.get("purpose", "batch"),
+        "created_at": int(time.time())
+    }
+    return jsonify(_file_object(file_id))
+
+
+@app.route("/v1/files/<file_id>/content", methods=["GET"])
+def file_content(file_id):
+    return Response(FILES[file_id]["content"], mimetype="application/jsonl")
+
+
+@app.route("/v1/batches", methods=["POST"])
+def create_batch():
+    body = request.get_json()
+    lines = [json.loads(l) for l in FILES[body["input_file_id"]]["content"].decode().splitlines() if l.strip()]
+    custom_ids = [l["custom_id"] for l in lines]
+    if len(set(custom_ids)) != len(custom_ids):
+        return jsonify({"error": {"message": "Duplicate custom_id in input file", "type": "invalid_request_error"}}), 400
+
+    succeeded = [l for l in lines if l["custom_id"] not in FAIL_CUSTOM_IDS]
+    failed = [l for l in lines if l["custom_id"] in FAIL_CUSTOM_IDS]
+
+    output_id = f"file-{uuid.uuid4().hex[:24]}"
+    FILES[output_id] = {
+        "content": "\n".join(json.dumps(_completion_for(l)) for l in succeeded).encode(),
+        "filename": "batch_output.jsonl",
+        "purpose": "batch_output",
+        "created_at": int(time.time())
+    }
+    error_id = None
+    if failed:
+        error_id = f"file-{uuid.uuid4().hex[:24]}"
+        FILES[error_id] = {
+            "content": "\n".join(json.dumps(_error_for(l)) for l in failed).encode(),
+            "filename": "batch_errors.jsonl",
+            "purpose": "batch_output",
+            "created_at": int(time.time())
+        }
+
+    batch_id = f"batch_{uuid.uuid4().hex[:24]}"
+    now = int(time.time())
+    BATCHES[batch_id] = {
+        "id": batch_id,
+        "object": "batch",
+        "endpoint": body["endpoint"],
+        "input_file_id": body["input_file_id"],
+        "completion_window": body["completion_window"],
+        "status": "completed",
+        "output_file_id": output_id,
+        "error_file_id": error_id,
+        "created_at": now,
+        "completed_at": now,
+        "request_counts": {"total": len(lines), "completed": len(succeeded), "failed": len(failed)}
+    }
+    return jsonify(BATCHES[batch_id])
+
+
+@app.route("/v1/batches/<batch_id>", methods=["GET"])
+def retrieve_batch(batch_id):
+    return jsonify(BATCHES[batch_id])
+
+
+if __name__ == "__main__":
+    app.run(host="0.0.0.0", port=5001)
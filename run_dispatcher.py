@@ -1,7 +1,8 @@
 import os
 import time
 import redis
-from scraper.tasks import scrape_page
+from scraper.tasks import scrape_page, discover_articles
+from scraper.discovery import is_sitemap_mode
 
 # Redis setup
 redis_client = redis.Redis(
@@ -40,6 +41,12 @@ def main():
     print("[DISPATCHER] 🚀 Starting dispatcher script")
     wait_for_celery()
 
+    if is_sitemap_mode():
+        # Sitemaps first; sections without one are link-crawled by the task
+        print(f"[SEED] Dispatching sitemap discovery for {len(SEED_URLS)} sections")
+        discover_articles.delay(SEED_URLS)
+        return
+
     for url in SEED_URLS:
         print(f"[SEED] Dispatching URL: {url}")
 
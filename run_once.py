@@ -1,4 +1,4 @@
-from scraper.celery_app import app
+from scraper.celery_app import app, worker_argv, WORKER_POOLS
 import scraper.tasks  # ✅ Required for registration
 from scraper.tasks import scrape_page
 import time
@@ -8,4 +8,4 @@ if __name__ == '__main__':
     scrape_page.delay(seed_url)  # Dispatch the scraping task
     print(f"[DISPATCHED] {seed_url}")
     time.sleep(2)  # Allow time for the task to be registered
-    app.worker_main(argv=["worker", "--loglevel=info", "--concurrency=4"])
\ No newline at end of file
+    app.worker_main(argv=worker_argv(WORKER_POOLS))  # one worker on every queue
\ No newline at end of file
@@ -1,4 +1,5 @@
-from scraper.celery_app import app
+from scraper.celery_app import app, worker_argv, WORKER_POOLS
+import sys
 import uuid
 import socket
 import time
@@ -30,14 +31,14 @@ def monitor_and_shutdown():
 threading.Thread(target=monitor_and_shutdown, daemon=True).start()
 
 if __name__ == '__main__':
+    # Usage: python run_worker.py [crawl|llm|storage ...] [--beat]
+    # With no queue names, one worker consumes every queue.
+    args = [arg for arg in sys.argv[1:] if arg != "--beat"]
+    queues = args or os.environ.get("WORKER_QUEUES", ",".join(WORKER_POOLS)).split(",")
+
     # Generate unique worker name using UUID and hostname
     unique_id = str(uuid.uuid4())[:8]
     hostname = socket.gethostname()
-    worker_name = f"celery@worker-{unique_id}-{hostname}"
-
-    app.worker_main(argv=[
-        "worker",
-        f"-n={worker_name}",
-        "--loglevel=info",
-        "--concurrency=4"
-    ])
\ No newline at end of file
+    worker_name = f"celery@worker-{'-'.join(queues)}-{unique_id}-{hostname}"
+
+    app.worker_main(argv=worker_argv(queues, hostname=worker_name, beat="--beat" in sys.argv))
\ No newline at end of file
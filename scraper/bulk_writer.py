@@ -0,0 +1,205 @@
+"""Buffered, idempotent bulk writes to ``moodboard_items``.
+
+Records from every task in a process are collected by one ``BulkWriter``
+and flushed as a single upsert keyed on ``image_url`` once
+``DB_WRITE_BATCH_SIZE`` records are waiting or ``DB_WRITE_FLUSH_INTERVAL``
+seconds have passed. Upserting makes retried and re-run tasks harmless.
+
+When a batch is rejected as bad input (a 4xx response, or a Postgres data,
+constraint or schema error) it is split in half and each half retried, so a
+single bad row costs O(log n) extra round trips instead of one per record.
+Any other failure (5xx, timeouts, connection errors) says nothing about the
+rows, so the whole group is retried up to ``DB_WRITE_RETRIES`` times with
+backoff and then reported as failed, rather than turned into ~2n requests
+against a database that is already struggling.
+
+Only the columns a record carries are written: records are upserted in
+groups that share a column set, so a partial record never nulls out
+columns already stored on the row.
+
+``add`` returns a future that resolves to whether the record was written.
+A task that must not report success before its row is durable calls
+``write``, which flushes right away; concurrent callers still share one
+upsert. That sharing only happens where several tasks run in one process
+(the threads pool, or ``process_image_batch``'s asyncio loop, which uses
+``add``). A prefork child runs one task at a time, so its synchronous
+writes go out one row per upsert: use ``process_image_batch`` where write
+volume matters. The upsert needs a unique constraint on ``image_url`` (see
+``migrations/001_moodboard_items_image_url_unique.sql``).
+"""
+import os
+import time
+import atexit
+import logging
+import threading
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+DB_WRITE_BATCH_SIZE = int(os.environ.get("DB_WRITE_BATCH_SIZE", "200"))
+DB_WRITE_FLUSH_INTERVAL = float(os.environ.get("DB_WRITE_FLUSH_INTERVAL", "2"))
+DB_WRITE_RETRIES = int(os.environ.get("DB_WRITE_RETRIES", "2"))
+DB_WRITE_RETRY_DELAY = float(os.environ.get("DB_WRITE_RETRY_DELAY", "1"))
+
+# HTTP statuses that are about the request itself rather than the rows in it.
+_TRANSIENT_STATUSES = {408, 429}
+# SQLSTATE classes 22 (data), 23 (constraint) and 42 (schema), and PostgREST's
+# request (PGRST1xx) and schema cache (PGRST2xx) errors all point at the rows.
+_INPUT_ERROR_CODES = ("22", "23", "42", "PGRST1", "PGRST2")
+
+
+def _group_by_columns(records):
+    # PostgREST bulk writes need every object to carry the same keys; padding
+    # with None would overwrite stored columns, so batch by column set instead.
+    groups = {}
+    for record in records:
+        groups.setdefault(frozenset(record), []).append(record)
+    return list(groups.values())
+
+
+def _dedupe(records, key):
+    # Postgres rejects an upsert that touches the same row twice.
+    merged = {}
+    for record in records:
+        merged[record[key]] = {**merged.get(record[key], {}), **record}
+    return list(merged.values())
+
+
+def upsert_with_bisect(supabase_client, table, records, on_conflict="image_url"):
+    """Upsert ``records``, bisecting failed batches down to the bad rows.
+
+    Returns the list of records that could not be written.
+    """
+    failed = []
+    for group in _group_by_columns(_dedupe(records, on_conflict)):
+        failed += _upsert_group(supabase_client, table, group, on_conflict)
+    return failed
+
+
+def _is_input_error(error):
+    """True when ``error`` blames the rows sent, so bisecting can isolate them."""
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    if status:
+        return 400 <= status < 500 and status not in _TRANSIENT_STATUSES
+    return str(getattr(error, "code", "") or "").startswith(_INPUT_ERROR_CODES)
+
+
+def _upsert_group(supabase_client, table, records, on_conflict):
+    if not records:
+        return []
+
+    for attempt in range(DB_WRITE_RETRIES + 1):
+        try:
+            supabase_client.table(table).upsert(records, on_conflict=on_conflict).execute()
+            return []
+        except Exception as e:
+            if _is_input_error(e):
+                error = e
+                break
+            if attempt == DB_WRITE_RETRIES:
+                logger.error(f"[DB] Batch of {len(records)} failed after {attempt + 1} attempts: {e}")
+                return records
+            logger.warning(f"[DB] Batch of {len(records)} failed, retrying: {e}")
+            time.sleep(DB_WRITE_RETRY_DELAY * 2 ** attempt)
+
+    if len(records) == 1:
+        logger.error(f"[DB] Failed to write {records[0].get(on_conflict)}: {error}")
+        return records
+    logger.warning(f"[DB] Batch of {len(records)} rejected, bisecting: {error}")
+
+    middle = len(records) // 2
+    return (_upsert_group(supabase_client, table, records[:middle], on_conflict)
+            + _upsert_group(supabase_client, table, records[middle:], on_conflict))
+
+
+class BulkWriter:
+    def __init__(self, supabase_client, table, on_conflict="image_url",
+                 max_batch=DB_WRITE_BATCH_SIZE, max_delay=DB_WRITE_FLUSH_INTERVAL):
+        self.supabase_client = supabase_client
+        self.table = table
+        self.on_conflict = on_conflict
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._buffer = []
+        self._oldest = None
+        self._thread = None
+        self._pid = None
+
+    def _ensure_flusher(self):
+        # A thread started before fork() does not exist in the child.
+        pid = os.getpid()
+        if self._thread is None or self._pid != pid:
+            self._buffer = []
+            self._oldest = None
+            self._pid = pid
+            self._thread = threading.Thread(target=self._run, name=f"bulk-writer-{self.table}", daemon=True)
+            self._thread.start()
+
+    def add(self, record):
+        """Buffer ``record``. Returns a future resolving to True once written, False if rejected."""
+        future = Future()
+        with self._lock:
+            self._ensure_flusher()
+            if not self._buffer:
+                self._oldest = time.monotonic()
+            self._buffer.append((record, future))
+            full = len(self._buffer) >= self.max_batch
+        if full:
+            self.flush()
+        return future
+
+    def write(self, record):
+        """Add ``record`` and flush now. Returns whether it was written."""
+        future = self.add(record)
+        self.flush()
+        return future.result()
+
+    def flush(self):
+        """Write everything buffered so far. Returns the records that failed."""
+        with self._flush_lock:
+            with self._lock:
+                entries, self._buffer, self._oldest = self._buffer, [], None
+            if not entries:
+                return []
+            records = [record for record, _ in entries]
+            try:
+                failed = upsert_with_bisect(self.supabase_client, self.table, records, self.on_conflict)
+            except Exception as e:
+                for _, future in entries:
+                    future.set_exception(e)
+                raise
+            failed_keys = {record.get(self.on_conflict) for record in failed}
+            for record, future in entries:
+                future.set_result(record.get(self.on_conflict) not in failed_keys)
+            logger.info(f"[DB] Flushed {len(records) - len(failed)}/{len(records)} records to {self.table}")
+            return failed
+
+    def _run(self):
+        while True:
+            time.sleep(self.max_delay / 2)
+            with self._lock:
+                due = self._oldest is not None and time.monotonic() - self._oldest >= self.max_delay
+            if due:
+                try:
+                    self.flush()
+                except Exception as e:
+                    logger.error(f"[DB] Background flush failed: {e}")
+
+
+_writers = []
+
+
+def create_writer(supabase_client, table, **kwargs):
+    writer = BulkWriter(supabase_client, table, **kwargs)
+    _writers.append(writer)
+    return writer
+
+
+def flush_all():
+    for writer in _writers:
+        writer.flush()
+
+
+atexit.register(flush_all)
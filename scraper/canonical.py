@@ -0,0 +1,195 @@
+"""Canonical URL forms, used as dedup keys for pages and images.
+
+Links come out of ``urljoin`` exactly as written in the page, so
+``#comments``, ``?utm_source=...``, a trailing slash, ``http://`` or ``www.``
+all make the same page look new to the dedup filters and the frontier.
+``canonicalize`` maps every variant of a URL to one key:
+
+* drop the fragment and tracking parameters (``utm_*``, ``fbclid``, ...);
+* sort the remaining query parameters, keeping their original encoding;
+* lowercase the scheme and host and drop default ports;
+* then apply the host's rule from ``HOST_RULES``: force https, strip
+  ``www.``, drop the trailing slash, and drop extra parameters such as CDN
+  resize options (``drop_params``).
+
+The canonical form is only ever a key: pages and images are fetched,
+leased, cached and stored under the URL as found. Hosts without a rule get
+the conservative default, which keeps the trailing slash.
+
+Rules are matched on the host and then its parent domains. Override or add
+rules with ``CANONICAL_RULES``, a JSON object of host to options.
+
+Results are memoised (``CANONICAL_CACHE_SIZE``). Every distinct URL that
+collapsed is counted by reason in ``collapse_report()`` and in the Redis
+``metrics`` hash as ``canonical_*``.
+"""
+import os
+import json
+import logging
+import threading
+from collections import Counter
+from functools import lru_cache
+from urllib.parse import urlsplit, urlunsplit, unquote_plus
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+CANONICAL_CACHE_SIZE = int(os.environ.get("CANONICAL_CACHE_SIZE", "200000"))
+CANONICAL_METRICS_FLUSH = 500
+
+TRACKING_PARAMS = {
+    "fbclid", "gclid", "dclid", "msclkid", "mc_cid", "mc_eid", "_ga", "_gl",
+    "igshid", "ref_src", "cmpid", "spm"
+}
+TRACKING_PREFIXES = ("utm_",)
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+DEFAULT_RULE = {
+    "https": False,
+    "strip_www": False,
+    "trailing_slash": True,  # keep a trailing slash on non-root paths?
+    "drop_params": [],
+}
+
+HOST_RULES = {
+    "sheerluxe.com": {"https": True, "strip_www": True, "trailing_slash": False},
+    "slman.com": {"https": True, "strip_www": True, "trailing_slash": False},
+}
+
+
+def _load_rules():
+    rules = {host: {**DEFAULT_RULE, **rule} for host, rule in HOST_RULES.items()}
+    raw = os.environ.get("CANONICAL_RULES")
+    if raw:
+        try:
+            for host, rule in json.loads(raw).items():
+                rules[host.lower()] = {**rules.get(host.lower(), DEFAULT_RULE), **rule}
+        except (ValueError, AttributeError) as e:
+            logger.warning(f"[CANONICAL] Ignoring invalid CANONICAL_RULES: {e}")
+    for rule in rules.values():
+        rule["drop_params"] = set(rule["drop_params"])
+    return rules
+
+
+_rules = _load_rules()
+_default_rule = {**DEFAULT_RULE, "drop_params": set()}
+
+_lock = threading.Lock()
+_collapses = Counter()
+_unflushed = Counter()
+
+
+def rule_for(host):
+    labels = host.split(".")
+    for i in range(len(labels) - 1):
+        rule = _rules.get(".".join(labels[i:]))
+        if rule is not None:
+            return rule
+    return _default_rule
+
+
+def _is_tracking(name):
+    return name in TRACKING_PARAMS or name.startswith(TRACKING_PREFIXES)
+
+
+def _record(reasons):
+    with _lock:
+        _collapses["collapsed"] += 1
+        _unflushed["collapsed"] += 1
+        for reason in reasons:
+            _collapses[reason] += 1
+            _unflushed[reason] += 1
+        if _unflushed["collapsed"] >= CANONICAL_METRICS_FLUSH:
+            _flush_locked()
+
+
+def _flush_locked():
+    if _unflushed:
+        metrics.incr_many({f"canonical_{reason}": n for reason, n in _unflushed.items()})
+        _unflushed.clear()
+
+
+def flush_metrics():
+    with _lock:
+        _flush_locked()
+
+
+def collapse_report():
+    """Collapses by reason, plus the memo cache's hit/miss counters."""
+    with _lock:
+        report = dict(_collapses)
+    info = canonicalize.cache_info()
+    report.update(cache_hits=info.hits, cache_misses=info.misses, cache_size=info.currsize)
+    return report
+
+
+def _param_name(pair):
+    return unquote_plus(pair.partition("=")[0])
+
+
+@lru_cache(maxsize=CANONICAL_CACHE_SIZE)
+def canonicalize(url):
+    """Return the canonical form of ``url`` (non-http(s) URLs are returned unchanged)."""
+    if not url:
+        return url
+    try:
+        parts = urlsplit(url.strip())
+        port = parts.port
+    except ValueError:
+        return url
+    scheme = parts.scheme.lower()
+    host = parts.hostname
+    if scheme not in DEFAULT_PORTS or not host:
+        return url
+
+    rule = rule_for(host)
+    reasons = []
+
+    if rule["https"] and scheme == "http":
+        scheme = "https"
+        reasons.append("scheme")
+    if rule["strip_www"] and host.startswith("www."):
+        host = host[4:]
+        reasons.append("www")
+    if ":" in host:
+        host = f"[{host}]"  # IPv6 literal
+    netloc = host if port in (None, DEFAULT_PORTS[scheme]) else f"{host}:{port}"
+    userinfo = parts.netloc.rpartition("@")[0]
+    if userinfo:
+        netloc = f"{userinfo}@{netloc}"
+
+    path = parts.path or "/"
+    if not rule["trailing_slash"] and len(path) > 1 and path.endswith("/"):
+        path = path.rstrip("/") or "/"
+        reasons.append("trailing_slash")
+
+    query = parts.query
+    if query:
+        # Work on the raw pairs so percent-encoding is never rewritten
+        pairs = [pair for pair in query.split("&") if pair]
+        kept = [pair for pair in pairs
+                if not _is_tracking(_param_name(pair)) and _param_name(pair) not in rule["drop_params"]]
+        if len(kept) != len(pairs):
+            if any(_is_tracking(_param_name(pair)) for pair in pairs):
+                reasons.append("tracking")
+            if any(_param_name(pair) in rule["drop_params"] for pair in pairs):
+                reasons.append("params")
+        query = "&".join(sorted(kept))
+
+    if parts.fragment or url.rstrip().endswith("#"):
+        reasons.append("fragment")
+
+    canonical = urlunsplit((scheme, netloc, path, query, ""))
+    if canonical != url:
+        _record(reasons or ["normalised"])
+    return canonical
+
+
+def unique_by_canonical(urls):
+    """The first URL of each canonical form in ``urls``, in order."""
+    first = {}
+    for url in urls:
+        first.setdefault(canonicalize(url), url)
+    return list(first.values())
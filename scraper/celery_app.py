@@ -1,5 +1,6 @@
 
 from celery import Celery
+from kombu import Queue
 import os
 
 redis_url = f"rediss://:{os.environ['REDIS_PASSWORD']}@{os.environ['REDIS_HOST']}:{os.environ['REDIS_PORT']}/0?ssl_cert_reqs=none"
@@ -18,8 +19,6 @@ app.conf.update(
     timezone='UTC',
     enable_utc=True,
     task_acks_late=True,
-    worker_concurrency=8,
-    worker_prefetch_multiplier=4,
     broker_connection_retry_on_startup=True,
     task_time_limit=600,
     task_soft_time_limit=300,
@@ -27,3 +26,126 @@ app.conf.update(
     broker_heartbeat=60,
     broker_heartbeat_checkrate=2
 )
+
+# Each pipeline stage has its own queue so 60s GPT calls never sit in front
+# of page fetches. Run one worker per queue (see run_worker.py) so each
+# gets the pool, concurrency and prefetch in WORKER_POOLS.
+CRAWL_QUEUE = 'crawl'
+LLM_QUEUE = 'llm'
+STORAGE_QUEUE = 'storage'
+
+TASK_ROUTES = {
+    'scraper.tasks.scrape_page': {'queue': CRAWL_QUEUE},
+    'scraper.tasks.scrape_page_batch': {'queue': CRAWL_QUEUE},
+    'scraper.tasks.discover_articles': {'queue': CRAWL_QUEUE},
+    'scraper.tasks.reap_image_leases': {'queue': CRAWL_QUEUE},
+    'scraper.tasks.process_image': {'queue': LLM_QUEUE},
+    'scraper.tasks.process_image_batch': {'queue': LLM_QUEUE},
+    'scraper.tasks.submit_metadata_batch': {'queue': LLM_QUEUE},
+    'scraper.tasks.poll_metadata_batches': {'queue': LLM_QUEUE},
+    'scraper.tasks.store_batched_image': {'queue': STORAGE_QUEUE},
+}
+
+# Delivery guarantees per queue. All ack late, so a worker that dies
+# mid-task leaves the message to be redelivered. reject_on_worker_lost
+# additionally requeues a task whose prefork child was killed:
+# - crawl and storage tasks are idempotent (dedup filters, upserts), so
+#   they are requeued;
+# - an LLM task that takes its child down (OOM on a huge image) would be
+#   requeued forever, and its images are leased anyway, so the lease
+#   reaper hands them out again instead.
+QUEUE_DELIVERY = {
+    CRAWL_QUEUE: {'acks_late': True, 'reject_on_worker_lost': True},
+    LLM_QUEUE: {'acks_late': True, 'reject_on_worker_lost': False},
+    STORAGE_QUEUE: {'acks_late': True, 'reject_on_worker_lost': True},
+}
+# Periodic tasks just run again on the next beat, never redeliver them.
+PERIODIC_TASKS = {
+    'scraper.tasks.reap_image_leases',
+    'scraper.tasks.submit_metadata_batch',
+    'scraper.tasks.poll_metadata_batches',
+}
+
+TASK_ANNOTATIONS = {
+    name: {'acks_late': False} if name in PERIODIC_TASKS else dict(QUEUE_DELIVERY[route['queue']])
+    for name, route in TASK_ROUTES.items()
+}
+# A whole image batch of GPT calls can outlive the default limits
+TASK_ANNOTATIONS['scraper.tasks.process_image_batch'].update(soft_time_limit=900, time_limit=1200)
+# So can a full sitemap/archive walk, which is rate limited per host
+TASK_ANNOTATIONS['scraper.tasks.discover_articles'].update(soft_time_limit=3600, time_limit=3900)
+
+app.conf.update(
+    task_queues=(Queue(CRAWL_QUEUE), Queue(LLM_QUEUE), Queue(STORAGE_QUEUE)),
+    task_default_queue=CRAWL_QUEUE,
+    task_routes=TASK_ROUTES,
+    task_annotations=TASK_ANNOTATIONS,
+)
+
+WORKER_POOLS = {
+    # Fetch/parse is I/O bound and short: many threads, a little prefetch.
+    CRAWL_QUEUE: {
+        'pool': os.environ.get('CRAWL_POOL', 'threads'),
+        'concurrency': int(os.environ.get('CRAWL_CONCURRENCY', '32')),
+        'prefetch_multiplier': int(os.environ.get('CRAWL_PREFETCH', '4')),
+    },
+    # Long GPT/embedding tasks: few processes, and never reserve work a busy child can't start.
+    LLM_QUEUE: {
+        'pool': os.environ.get('LLM_POOL', 'prefork'),
+        'concurrency': int(os.environ.get('LLM_CONCURRENCY', '4')),
+        'prefetch_multiplier': int(os.environ.get('LLM_PREFETCH', '1')),
+    },
+    # Uploads and inserts of Batch API results. The synchronous image path
+    # still uploads and inserts from its LLM task.
+    STORAGE_QUEUE: {
+        'pool': os.environ.get('STORAGE_POOL', 'threads'),
+        'concurrency': int(os.environ.get('STORAGE_CONCURRENCY', '8')),
+        'prefetch_multiplier': int(os.environ.get('STORAGE_PREFETCH', '2')),
+    },
+}
+
+
+def worker_argv(queues, hostname=None, beat=False, loglevel='info'):
+    """``worker_main`` argv for a worker consuming ``queues``.
+
+    A single queue gets that stage's pool settings; several queues share
+    one prefork worker as before the split.
+    """
+    queues = list(queues)
+    if len(queues) == 1 and queues[0] in WORKER_POOLS:
+        settings = WORKER_POOLS[queues[0]]
+    else:
+        settings = {'pool': 'prefork', 'concurrency': 4, 'prefetch_multiplier': 4}
+
+    argv = [
+        'worker',
+        f'--loglevel={loglevel}',
+        f'--queues={",".join(queues)}',
+        f'--pool={settings["pool"]}',
+        f'--concurrency={settings["concurrency"]}',
+        f'--prefetch-multiplier={settings["prefetch_multiplier"]}',
+    ]
+    if hostname:
+        argv.append(f'--hostname={hostname}')
+    if beat:
+        argv.append('--beat')
+    return argv
+
+app.conf.beat_schedule = {
+    'submit-metadata-batch': {
+        'task': 'scraper.tasks.submit_metadata_batch',
+        'schedule': 300.0,
+    },
+    'poll-metadata-batches': {
+        'task': 'scraper.tasks.poll_metadata_batches',
+        'schedule': 60.0,
+    },
+    'reap-image-leases': {
+        'task': 'scraper.tasks.reap_image_leases',
+        'schedule': 60.0,
+    },
+    'discover-articles': {
+        'task': 'scraper.tasks.discover_articles',
+        'schedule': 6 * 3600.0,
+    },
+}
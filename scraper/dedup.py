@@ -0,0 +1,304 @@
+"""Bounded-memory "have we seen this?" filters shared by all workers.
+
+``SeenFilter`` replaces the ever-growing ``processed_urls`` /
+``processed_images`` Redis sets with a Bloom filter of fixed size:
+
+* on servers with RedisBloom it uses a native ``BF`` filter and
+  ``BF.MADD`` for batched check-and-add;
+* otherwise it falls back to a plain Redis bitmap driven by a Lua script,
+  sized from ``capacity`` and ``error_rate``.
+
+Both backends check a whole batch in one round trip, and
+``add_many_batched`` checks batches for several filters in one pipeline. A
+per-process L1 of recently seen items answers repeats without touching the
+network.
+
+Like any Bloom filter, a false positive means a genuinely new item is
+reported as seen with probability ``error_rate``; nothing is ever processed
+twice.
+
+The page and image filters are keyed on ``canonicalize(url)``; callers
+pass URLs as found. Filters written before canonical keys hold raw URLs,
+so with ``CANONICAL_LEGACY_LOOKUP`` (on by default) a URL whose canonical
+form differs is also looked up raw, in the same round trip, and counts as
+seen if either is present. Turn it off once the old entries no longer
+matter.
+
+The filters start empty, so the sets they replace are migrated into them:
+``migrate_legacy_sets`` ``SSCAN``s ``processed_urls`` / ``processed_images``
+into the matching filter and then marks it migrated (workers run it once at
+startup, under a lock). Until a filter is marked, items it has not seen are
+also checked with ``SMISMEMBER`` against its legacy set, in the same round
+trip, so nothing processed before the switch is reported as new.
+"""
+import os
+import math
+import time
+import logging
+import threading
+from hashlib import blake2b
+from collections import OrderedDict
+
+from redis.exceptions import ResponseError
+
+from .redis_client import redis_client
+from .canonical import canonicalize
+
+logger = logging.getLogger(__name__)
+
+DEDUP_CAPACITY = int(os.environ.get("DEDUP_CAPACITY", "20000000"))
+DEDUP_ERROR_RATE = float(os.environ.get("DEDUP_ERROR_RATE", "0.001"))
+DEDUP_L1_SIZE = int(os.environ.get("DEDUP_L1_SIZE", "100000"))
+CANONICAL_LEGACY_LOOKUP = os.environ.get("CANONICAL_LEGACY_LOOKUP", "1") == "1"
+LEGACY_MIGRATION_BATCH = int(os.environ.get("LEGACY_MIGRATION_BATCH", "5000"))
+LEGACY_MIGRATION_LOCK_SECONDS = int(os.environ.get("LEGACY_MIGRATION_LOCK_SECONDS", "3600"))
+# How often a process re-checks whether its filters' legacy sets have been migrated.
+LEGACY_CHECK_SECONDS = 60
+
+# KEYS[1] = bitmap, ARGV[1] = hashes per item, ARGV[2..] = bit offsets.
+# Returns 1 per item that was new (at least one bit unset), 0 otherwise.
+_BITMAP_ADD_SCRIPT = """
+local k = tonumber(ARGV[1])
+local result = {}
+local n = (#ARGV - 1) / k
+for i = 0, n - 1 do
+    local is_new = 0
+    for j = 1, k do
+        local offset = ARGV[1 + i * k + j]
+        if redis.call('SETBIT', KEYS[1], offset, 1) == 0 then
+            is_new = 1
+        end
+    end
+    result[#result + 1] = is_new
+end
+return result
+"""
+
+# KEYS[1] = bitmap, ARGV[1] = hashes per item, ARGV[2..] = bit offsets.
+# Returns 1 per item whose bits are all set, 0 otherwise.
+_BITMAP_EXISTS_SCRIPT = """
+local k = tonumber(ARGV[1])
+local result = {}
+local n = (#ARGV - 1) / k
+for i = 0, n - 1 do
+    local exists = 1
+    for j = 1, k do
+        if redis.call('GETBIT', KEYS[1], ARGV[1 + i * k + j]) == 0 then
+            exists = 0
+        end
+    end
+    result[#result + 1] = exists
+end
+return result
+"""
+
+
+def _digest(item):
+    return blake2b(item.encode("utf-8"), digest_size=16).digest()
+
+
+class SeenFilter:
+    def __init__(self, name, capacity=DEDUP_CAPACITY, error_rate=DEDUP_ERROR_RATE, l1_size=DEDUP_L1_SIZE,
+                 key_func=None, legacy_lookup=False, legacy_set=None):
+        self.key = f"seen:{name}"
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.l1_size = l1_size
+        self.key_func = key_func
+        self.legacy_lookup = legacy_lookup
+        self.legacy_set = legacy_set
+        self._legacy_migrated = legacy_set is None
+        self._legacy_checked_at = 0.0
+
+        # Bitmap fallback sizing: m = -n ln p / (ln 2)^2, k = (m / n) ln 2.
+        self.num_bits = min(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 2 ** 32)
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+
+        self._backend = None
+        self._script = None
+        self._exists_script = None
+        self._l1 = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _detect_backend(self):
+        try:
+            redis_client.execute_command("BF.RESERVE", self.key, self.error_rate, self.capacity)
+            return "bloom"
+        except ResponseError as e:
+            message = str(e).lower()
+            if "exists" in message:
+                return "bloom"
+            if "unknown command" in message:
+                logger.info(f"[DEDUP] RedisBloom unavailable, using bitmap for {self.key}")
+                self._script = redis_client.register_script(_BITMAP_ADD_SCRIPT)
+                self._exists_script = redis_client.register_script(_BITMAP_EXISTS_SCRIPT)
+                return "bitmap"
+            raise
+
+    def _offsets(self, item):
+        digest = _digest(item)
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def _ensure_backend(self):
+        if self._backend is None:
+            self._backend = self._detect_backend()
+
+    def _queue_remote_add(self, pipe, items):
+        """Queue the remote check-and-add of ``items`` on ``pipe``."""
+        if self._backend == "bloom":
+            pipe.execute_command("BF.MADD", self.key, *items)
+            return
+        args = [self.num_hashes]
+        for item in items:
+            args.extend(self._offsets(item))
+        self._script(keys=[f"{self.key}:bitmap"], args=args, client=pipe)
+
+    def _queue_remote_exists(self, pipe, items):
+        """Queue a read-only membership check of ``items`` on ``pipe``."""
+        if self._backend == "bloom":
+            pipe.execute_command("BF.MEXISTS", self.key, *items)
+            return
+        args = [self.num_hashes]
+        for item in items:
+            args.extend(self._offsets(item))
+        self._exists_script(keys=[f"{self.key}:bitmap"], args=args, client=pipe)
+
+    @property
+    def migrated_key(self):
+        return f"{self.key}:legacy_migrated"
+
+    def needs_legacy_set(self):
+        """True until ``migrate_legacy_sets`` has copied ``legacy_set`` into this filter."""
+        if self._legacy_migrated:
+            return False
+        now = time.monotonic()
+        if now - self._legacy_checked_at >= LEGACY_CHECK_SECONDS:
+            self._legacy_checked_at = now
+            self._legacy_migrated = bool(redis_client.exists(self.migrated_key))
+        return not self._legacy_migrated
+
+    def key_of(self, item):
+        return self.key_func(item) if self.key_func else item
+
+    def _remember(self, digest):
+        self._l1[digest] = True
+        self._l1.move_to_end(digest)
+        if len(self._l1) > self.l1_size:
+            self._l1.popitem(last=False)
+
+    def _local_pass(self, items):
+        """Answer repeats from the L1. Returns (results, {digest: index} still to check)."""
+        results = [False] * len(items)
+        pending = {}
+        with self._lock:
+            for i, item in enumerate(items):
+                digest = _digest(item)
+                if digest in self._l1:
+                    self._l1.move_to_end(digest)
+                elif digest not in pending:
+                    pending[digest] = i
+        return results, pending
+
+    def _apply_remote(self, results, pending, remote):
+        for i, is_new in zip(pending.values(), remote):
+            results[i] = bool(is_new)
+        with self._lock:
+            for digest in pending:
+                self._remember(digest)
+        return results
+
+    def add_many(self, items):
+        """Mark ``items`` as seen. Returns, per item, True if it was new."""
+        return add_many_batched([(self, items)])[0]
+
+    def add(self, item):
+        return self.add_many([item])[0]
+
+
+seen_urls = SeenFilter("urls", key_func=canonicalize, legacy_lookup=CANONICAL_LEGACY_LOOKUP,
+                       legacy_set="processed_urls")
+seen_images = SeenFilter("images", key_func=canonicalize, legacy_lookup=CANONICAL_LEGACY_LOOKUP,
+                         legacy_set="processed_images")
+
+
+def add_many_batched(requests):
+    """``SeenFilter.add_many`` for several filters in a single round trip.
+
+    ``requests`` is a list of ``(filter, items)``; returns one result list
+    per request, in order.
+    """
+    prepared = []
+    pipe = None
+    for seen_filter, items in requests:
+        items = list(items)
+        keys = [seen_filter.key_of(item) for item in items]
+        results, pending = seen_filter._local_pass(keys)
+        legacy, in_legacy_set = [], []
+        if pending:
+            seen_filter._ensure_backend()
+            if pipe is None:
+                pipe = redis_client.pipeline(transaction=False)
+            seen_filter._queue_remote_add(pipe, [keys[i] for i in pending.values()])
+            if seen_filter.legacy_lookup:
+                legacy = [i for i in pending.values() if items[i] != keys[i]]
+                if legacy:
+                    seen_filter._queue_remote_exists(pipe, [items[i] for i in legacy])
+            if seen_filter.needs_legacy_set():
+                # The old sets hold URLs as found; check the canonical key too
+                in_legacy_set = list(pending.values())
+                pipe.smismember(seen_filter.legacy_set,
+                                [items[i] for i in in_legacy_set] + [keys[i] for i in in_legacy_set])
+        prepared.append((seen_filter, results, pending, legacy, in_legacy_set))
+
+    replies = iter(pipe.execute() if pipe is not None else ())
+    answers = []
+    for seen_filter, results, pending, legacy, in_legacy_set in prepared:
+        if pending:
+            results = seen_filter._apply_remote(results, pending, next(replies))
+        if legacy:
+            # Seen before canonical keys existed, under its raw URL
+            for i, exists in zip(legacy, next(replies)):
+                if exists:
+                    results[i] = False
+        if in_legacy_set:
+            # Processed before the filters replaced the sets and not migrated yet
+            found = next(replies)
+            raw, canonical = found[:len(in_legacy_set)], found[len(in_legacy_set):]
+            for i, raw_found, canonical_found in zip(in_legacy_set, raw, canonical):
+                if raw_found or canonical_found:
+                    results[i] = False
+        answers.append(results)
+    return answers
+
+
+def migrate_legacy_sets(filters=(seen_urls, seen_images)):
+    """Copy each filter's legacy Redis set into it, then mark it migrated.
+
+    Safe to call from every worker: one takes the lock and the rest return.
+    Adds are idempotent, so a migration cut short is simply run again.
+    """
+    lock_key = "seen:legacy_migration:lock"
+    if not redis_client.set(lock_key, os.getpid(), nx=True, ex=LEGACY_MIGRATION_LOCK_SECONDS):
+        return
+    try:
+        for seen_filter in filters:
+            if not seen_filter.legacy_set or redis_client.exists(seen_filter.migrated_key):
+                continue
+            migrated = 0
+            batch = []
+            for member in redis_client.sscan_iter(seen_filter.legacy_set, count=LEGACY_MIGRATION_BATCH):
+                batch.append(member.decode() if isinstance(member, bytes) else member)
+                if len(batch) >= LEGACY_MIGRATION_BATCH:
+                    add_many_batched([(seen_filter, batch)])
+                    migrated += len(batch)
+                    batch = []
+            if batch:
+                add_many_batched([(seen_filter, batch)])
+                migrated += len(batch)
+            redis_client.set(seen_filter.migrated_key, 1)
+            logger.info(f"[DEDUP] Migrated {migrated} entries from {seen_filter.legacy_set} into {seen_filter.key}; "
+                        f"the set is no longer read and can be deleted")
+    finally:
+        redis_client.delete(lock_key)
@@ -0,0 +1,302 @@
+"""Sitemap- and archive-driven article discovery.
+
+Link crawling spends most of its fetches on listing and pagination pages
+that only lead to articles we already know. In sitemap mode
+(``DISCOVERY_MODE=sitemap``, the default) article URLs come from:
+
+* each host's sitemaps: found through ``robots.txt`` or at ``/sitemap.xml``,
+  with indexes followed recursively and ``.gz`` sitemaps decompressed on the
+  fly, and
+* the ``/fashion/archive/{year}`` pages (``DISCOVERY_ARCHIVE_SECTIONS``),
+  including their ``?page=`` pagination.
+
+``discover`` streams ``(section, url, lastmod)`` as it parses, reading each
+host's sitemaps once whatever the number of sections. Sections it finds
+nothing for are returned to the caller to be link-crawled as before.
+
+``discover_shared`` is for crawlers that each discover for themselves: the
+first to take the lock reads the sitemaps and records what it found in
+Redis, and the rest replay that record instead of downloading every sitemap
+again.
+"""
+import io
+import os
+import gzip
+import json
+import time
+import hashlib
+import logging
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlsplit, urljoin
+from xml.etree import ElementTree
+
+from .http_client import fetch
+from .extraction import extract_page
+from .redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+DISCOVERY_MODE = os.environ.get("DISCOVERY_MODE", "sitemap")
+DISCOVERY_MAX_SITEMAPS = int(os.environ.get("DISCOVERY_MAX_SITEMAPS", "500"))
+DISCOVERY_MAX_AGE_YEARS = int(os.environ.get("DISCOVERY_MAX_AGE_YEARS", "3"))
+DISCOVERY_ARCHIVE_SECTIONS = [
+    s for s in os.environ.get("DISCOVERY_ARCHIVE_SECTIONS", "https://sheerluxe.com/fashion").split(",") if s
+]
+ARCHIVE_MAX_PAGES = int(os.environ.get("ARCHIVE_MAX_PAGES", "50"))
+# How long one worker's discovery is reused by the others, and how long they wait for it
+DISCOVERY_SHARED_TTL = int(os.environ.get("DISCOVERY_SHARED_TTL", str(6 * 3600)))
+DISCOVERY_SHARED_WAIT_SECONDS = int(os.environ.get("DISCOVERY_SHARED_WAIT_SECONDS", "1800"))
+DISCOVERY_SHARED_PREFIX = "discovery:shared:"
+DISCOVERY_SHARED_CHUNK = 1000
+
+DEFAULT_SITEMAP_PATHS = ("/sitemap.xml", "/sitemap_index.xml")
+GZIP_MAGIC = b"\x1f\x8b"
+
+SITEMAP_NS = "{http://www.sitemaps.org/schemas/sitemap/0.9}"
+ENTRY_TAGS = {f"{SITEMAP_NS}url": "url", f"{SITEMAP_NS}sitemap": "sitemap"}
+LOC_TAG = f"{SITEMAP_NS}loc"
+LASTMOD_TAG = f"{SITEMAP_NS}lastmod"
+
+
+def is_sitemap_mode():
+    return DISCOVERY_MODE == "sitemap"
+
+
+def parse_lastmod(value):
+    """Parse a W3C datetime (``2024-05-01`` or ``2024-05-01T10:00:00+01:00``) to naive UTC."""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def open_body(stream):
+    """Wrap a binary stream, transparently gunzipping it if it is gzip data."""
+    reader = io.BufferedReader(stream) if not hasattr(stream, "peek") else stream
+    if reader.peek(2)[:2] == GZIP_MAGIC:
+        return gzip.GzipFile(fileobj=reader)
+    return reader
+
+
+def parse_sitemap(stream):
+    """Yield ``("sitemap" | "url", loc, lastmod)`` from a sitemap or sitemap index.
+
+    Only ``<loc>``/``<lastmod>`` that are direct children of a ``<url>`` or
+    ``<sitemap>`` in the sitemap namespace count, so extension elements such
+    as ``<image:loc>`` never replace the page URL. Parses incrementally and
+    discards each entry once read, so memory stays flat on 50k-entry sitemaps.
+    """
+    root = None
+    depth = 0
+    kind = loc = lastmod = None
+    for event, element in ElementTree.iterparse(open_body(stream), events=("start", "end")):
+        if event == "start":
+            depth += 1
+            if root is None:
+                root = element
+            elif depth == 2:
+                kind = ENTRY_TAGS.get(element.tag)
+            continue
+        depth -= 1
+        if depth == 2:
+            if kind is None:
+                continue
+            if element.tag == LOC_TAG:
+                loc = (element.text or "").strip()
+            elif element.tag == LASTMOD_TAG:
+                lastmod = parse_lastmod(element.text)
+        elif depth == 1:
+            if kind and loc:
+                yield kind, loc, lastmod
+            kind = loc = lastmod = None
+            root.clear()
+
+
+def sitemap_roots(origin):
+    """Sitemaps advertised in ``robots.txt``, or the conventional locations."""
+    try:
+        response = fetch(urljoin(origin, "/robots.txt"))
+        if response.ok:
+            listed = [
+                line.split(":", 1)[1].strip()
+                for line in response.text.splitlines()
+                if line.lower().startswith("sitemap:")
+            ]
+            if listed:
+                return listed
+    except Exception as e:
+        logger.warning(f"[DISCOVERY] Could not read robots.txt for {origin}: {e}")
+    return [urljoin(origin, path) for path in DEFAULT_SITEMAP_PATHS]
+
+
+def iter_sitemap_urls(roots, max_sitemaps=DISCOVERY_MAX_SITEMAPS):
+    """Walk sitemap indexes breadth-first and yield ``(url, lastmod)`` for every page."""
+    queue, seen = list(roots), set(roots)
+    fetched = 0
+    while queue and fetched < max_sitemaps:
+        sitemap_url = queue.pop(0)
+        fetched += 1
+        try:
+            response = fetch(sitemap_url, stream=True)
+            if not response.ok:
+                response.close()
+                continue
+            response.raw.decode_content = True
+            with response:
+                for kind, loc, lastmod in parse_sitemap(response.raw):
+                    if kind == "url":
+                        yield loc, lastmod
+                    elif loc not in seen:
+                        seen.add(loc)
+                        queue.append(loc)
+        except (ElementTree.ParseError, OSError, EOFError) as e:
+            logger.warning(f"[DISCOVERY] Skipping unreadable sitemap {sitemap_url}: {e}")
+        except Exception as e:
+            logger.warning(f"[DISCOVERY] Failed to fetch sitemap {sitemap_url}: {e}")
+
+
+def iter_archive_urls(section, years):
+    """Article links on ``{section}/archive/{year}`` and its ``?page=`` pages."""
+    for year in years:
+        seen = set()
+        for page_number in range(1, ARCHIVE_MAX_PAGES + 1):
+            archive_url = f"{section}/archive/{year}"
+            if page_number > 1:
+                archive_url += f"?page={page_number}"
+            try:
+                response = fetch(archive_url)
+                if not response.ok:
+                    break
+                links = extract_page(response.text, archive_url)["links"]
+            except Exception as e:
+                logger.warning(f"[DISCOVERY] Failed to read archive {archive_url}: {e}")
+                break
+            new = [u for u in dict.fromkeys(links)
+                   if u.startswith(f"{section}/") and "/archive/" not in u and u not in seen]
+            if not new:
+                break
+            seen.update(new)
+            for url in new:
+                yield url, None
+
+
+def discover(sections, max_age_years=DISCOVERY_MAX_AGE_YEARS, covered=None):
+    """Yield ``(section, url, lastmod)`` for article URLs under ``sections``.
+
+    Pass a set as ``covered`` to collect the sections that yielded anything;
+    the rest have no sitemap or archive and still need link crawling.
+    """
+    covered = set() if covered is None else covered
+    cutoff = datetime.utcnow() - timedelta(days=365 * max_age_years)
+    sections = sorted(sections, key=len, reverse=True)  # most specific prefix wins
+
+    origins = {}
+    for section in sections:
+        parts = urlsplit(section)
+        origins.setdefault(f"{parts.scheme}://{parts.netloc}", []).append(section)
+
+    for origin, origin_sections in origins.items():
+        for url, lastmod in iter_sitemap_urls(sitemap_roots(origin)):
+            if lastmod is not None and lastmod < cutoff:
+                continue
+            section = next((s for s in origin_sections if url.startswith(s)), None)
+            if section is not None:
+                covered.add(section)
+                yield section, url, lastmod
+
+    current_year = datetime.utcnow().year
+    years = range(current_year, current_year - max_age_years - 1, -1)
+    for section in sections:
+        if section not in DISCOVERY_ARCHIVE_SECTIONS:
+            continue
+        for url, lastmod in iter_archive_urls(section, years):
+            covered.add(section)
+            yield section, url, lastmod
+
+
+def _shared_keys(sections, max_age_years):
+    digest = hashlib.sha1(json.dumps([sorted(sections), max_age_years]).encode()).hexdigest()[:16]
+    base = f"{DISCOVERY_SHARED_PREFIX}{digest}"
+    return f"{base}:lock", f"{base}:done", f"{base}:urls", f"{base}:covered"
+
+
+def _record_discovery(sections, max_age_years, covered, keys):
+    """Run ``discover`` and append each result to the shared list as it is yielded."""
+    lock_key, done_key, urls_key, covered_key = keys
+    redis_client.delete(urls_key, covered_key)
+    chunk = []
+    try:
+        for section, url, lastmod in discover(sections, max_age_years, covered=covered):
+            chunk.append(json.dumps([section, url, lastmod.isoformat() if lastmod else None]))
+            if len(chunk) >= DISCOVERY_SHARED_CHUNK:
+                redis_client.rpush(urls_key, *chunk)
+                chunk = []
+            yield section, url, lastmod
+        pipe = redis_client.pipeline()
+        if chunk:
+            pipe.rpush(urls_key, *chunk)
+        if covered:
+            pipe.sadd(covered_key, *covered)
+        pipe.expire(urls_key, DISCOVERY_SHARED_TTL)
+        pipe.expire(covered_key, DISCOVERY_SHARED_TTL)
+        pipe.set(done_key, int(time.time()), ex=DISCOVERY_SHARED_TTL)
+        pipe.execute()
+    except BaseException:
+        # Incomplete: let the next worker to ask do it
+        redis_client.delete(lock_key)
+        raise
+
+
+def _replay_discovery(covered, keys):
+    _, _, urls_key, covered_key = keys
+    covered.update(redis_client.smembers(covered_key))
+    start = 0
+    while True:
+        chunk = redis_client.lrange(urls_key, start, start + DISCOVERY_SHARED_CHUNK - 1)
+        for item in chunk:
+            section, url, lastmod = json.loads(item)
+            yield section, url, parse_lastmod(lastmod)
+        if len(chunk) < DISCOVERY_SHARED_CHUNK:
+            return
+        start += DISCOVERY_SHARED_CHUNK
+
+
+def discover_shared(sections, max_age_years=DISCOVERY_MAX_AGE_YEARS, covered=None):
+    """``discover``, with the sitemaps read once per ``DISCOVERY_SHARED_TTL`` across workers.
+
+    Waits up to ``DISCOVERY_SHARED_WAIT_SECONDS`` for another worker's
+    discovery to finish, taking over if it dies, and discovers locally if
+    Redis is unavailable.
+    """
+    covered = set() if covered is None else covered
+    keys = _shared_keys(sections, max_age_years)
+    lock_key, done_key, _, _ = keys
+    deadline = time.monotonic() + DISCOVERY_SHARED_WAIT_SECONDS
+    try:
+        while True:
+            if redis_client.exists(done_key):
+                mode = "replay"
+                break
+            if redis_client.set(lock_key, int(time.time()), nx=True, ex=DISCOVERY_SHARED_TTL):
+                mode = "record"
+                break
+            if time.monotonic() >= deadline:
+                logger.warning("[DISCOVERY] Timed out waiting for shared discovery, discovering locally")
+                mode = "local"
+                break
+            time.sleep(5)
+    except Exception as e:
+        logger.warning(f"[DISCOVERY] Shared discovery unavailable, discovering locally: {e}")
+        mode = "local"
+
+    if mode == "replay":
+        yield from _replay_discovery(covered, keys)
+    elif mode == "record":
+        yield from _record_discovery(sections, max_age_years, covered, keys)
+    else:
+        yield from discover(sections, max_age_years, covered=covered)
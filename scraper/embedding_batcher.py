@@ -0,0 +1,147 @@
+"""Micro-batching for OpenAI embedding requests.
+
+The embeddings endpoint takes an array of inputs, so instead of one HTTPS
+round trip per image, callers in the same process hand their text to a
+shared ``EmbeddingBatcher``. A background thread sends everything that has
+queued up as a single request once ``EMBEDDING_BATCH_SIZE`` inputs are
+waiting or ``EMBEDDING_BATCH_DELAY`` seconds have passed since the first
+one. Each caller gets a ``concurrent.futures.Future`` that resolves to its
+own vector.
+
+If the API rejects a batch as a bad request, the batch is split in half
+and each half retried, so one bad input only fails its own caller. Other
+errors (throttling, outages) fail the whole batch as they would a single
+request, as does a response with a vector missing. Nothing a batch raises
+stops the background thread; a thread that died anyway is restarted by the
+next ``submit``.
+"""
+import os
+import time
+import logging
+import threading
+from concurrent.futures import Future
+
+from .exceptions import EmbeddingGenerationError
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", "256"))
+EMBEDDING_BATCH_DELAY = float(os.environ.get("EMBEDDING_BATCH_DELAY", "0.05"))
+# How long ``embed`` waits for its vector, queueing included.
+EMBEDDING_TIMEOUT = float(os.environ.get("EMBEDDING_TIMEOUT", "120"))
+
+# Statuses that blame the inputs rather than the service: worth bisecting.
+_INPUT_ERROR_STATUSES = {400, 413, 422}
+
+
+def _is_input_error(error):
+    return getattr(error, "status_code", None) in _INPUT_ERROR_STATUSES
+
+
+class EmbeddingBatcher:
+    def __init__(self, client, model, max_batch=EMBEDDING_BATCH_SIZE, max_delay=EMBEDDING_BATCH_DELAY):
+        self.client = client
+        self.model = model
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._cond = threading.Condition()
+        self._queue = []
+        self._thread = None
+        self._pid = None
+
+    def _ensure_worker(self):
+        # A thread started before fork() does not exist in the child.
+        pid = os.getpid()
+        if self._pid != pid:
+            self._queue = []
+            self._pid = pid
+            self._thread = None
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name=f"embedding-batcher-{self.model}", daemon=True)
+            self._thread.start()
+
+    def submit(self, text) -> Future:
+        future = Future()
+        with self._cond:
+            self._ensure_worker()
+            self._queue.append((text, future))
+            self._cond.notify()
+        return future
+
+    def embed(self, text, timeout=EMBEDDING_TIMEOUT):
+        """Blocking helper: submit ``text`` and wait up to ``timeout`` seconds for its vector."""
+        future = self.submit(text)
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            future.cancel()  # Dropped from its batch if it hasn't been sent yet
+            raise
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._queue:
+                self._cond.wait()
+            deadline = time.monotonic() + self.max_delay
+            while len(self._queue) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = self._queue[:self.max_batch]
+            del self._queue[:self.max_batch]
+        return [(text, f) for text, f in batch if f.set_running_or_notify_cancel()]
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                continue
+            try:
+                self._flush(batch)
+            except Exception as e:
+                logger.exception(f"[❌ EMBEDDING ERROR] Batch of {len(batch)} failed unexpectedly: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _flush(self, batch):
+        try:
+            response = self.client.embeddings.create(
+                input=[text for text, _ in batch],
+                model=self.model
+            )
+        except Exception as e:
+            if len(batch) > 1 and _is_input_error(e):
+                logger.warning(f"[EMBED BATCH] Batch of {len(batch)} rejected, bisecting: {e}")
+                middle = len(batch) // 2
+                self._flush(batch[:middle])
+                self._flush(batch[middle:])
+                return
+            logger.error(f"[❌ EMBEDDING ERROR] Batch of {len(batch)} failed: {e}")
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        vectors = {item.index: item.embedding for item in response.data}
+        if len(response.data) != len(batch):
+            logger.error(f"[❌ EMBEDDING ERROR] Got {len(response.data)} vectors for {len(batch)} inputs")
+        for i, (_, future) in enumerate(batch):
+            if i in vectors:
+                future.set_result(vectors[i])
+            else:
+                future.set_exception(EmbeddingGenerationError(f"No vector returned for input {i} of {len(batch)}"))
+        logger.info(f"[EMBED BATCH] {len(batch)} inputs in one request")
+
+
+_batchers = {}
+_batchers_lock = threading.Lock()
+
+
+def get_embedding_batcher(client, model):
+    """Return the process-wide batcher for ``(client, model)``."""
+    key = (id(client), model)
+    with _batchers_lock:
+        batcher = _batchers.get(key)
+        if batcher is None:
+            batcher = _batchers[key] = EmbeddingBatcher(client, model)
+        return batcher
@@ -12,3 +12,7 @@ class MetadataGenerationError(Exception):
 class EmbeddingGenerationError(Exception):
     """Raised when embedding generation fails"""
     pass
+
+class StorageError(Exception):
+    """Raised when a result could not be written to Supabase"""
+    pass
@@ -0,0 +1,158 @@
+"""Crash-resumable persistence for ``URLFrontier``.
+
+Every frontier operation is appended to ``journal.log`` as one line:
+
+    A <depth> <score> <url>    queued (or re-prioritised)
+    P <url>                    popped for crawling
+    V <url>                    visited
+
+Now and then the whole frontier is written out as a compacted snapshot and
+the journal starts over. The snapshot is ``queue.jsonl`` (one
+``[url, depth, score]`` per queued URL) plus ``visited.bin`` (a
+``UrlHashSet``, 8 bytes per URL). A checkpoint is only taken once the
+journal has grown as large as the frontier itself, so snapshot cost stays
+amortised O(1) per operation however many millions of URLs there are.
+
+When the frontier runs dry the crawl is complete and the state is cleared,
+so the next run starts from its seeds instead of finding them all visited.
+
+On startup the snapshot is loaded and the journal replayed on top of it.
+URLs that were popped but never marked visited were in flight when the
+process died, so they go back on the queue. Replaying a journal over a
+newer snapshot is harmless, because every operation is idempotent against
+the visited set.
+"""
+import os
+import json
+import logging
+
+from utils.url_hash_set import UrlHashSet
+
+logger = logging.getLogger(__name__)
+
+# Resolved once at import so workers started from any directory resume the same state.
+# An empty FRONTIER_STATE_DIR turns persistence off.
+FRONTIER_STATE_DIR = os.environ.get(
+    "FRONTIER_STATE_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "frontier")
+)
+if FRONTIER_STATE_DIR:
+    FRONTIER_STATE_DIR = os.path.abspath(os.path.expanduser(FRONTIER_STATE_DIR))
+FRONTIER_CHECKPOINT_OPS = int(os.environ.get("FRONTIER_CHECKPOINT_OPS", "50000"))
+
+
+class FrontierJournal:
+    def __init__(self, state_dir=FRONTIER_STATE_DIR, checkpoint_ops=FRONTIER_CHECKPOINT_OPS):
+        self.state_dir = state_dir
+        self.checkpoint_ops = checkpoint_ops
+        self.journal_path = os.path.join(state_dir, "journal.log")
+        self.queue_path = os.path.join(state_dir, "queue.jsonl")
+        self.visited_path = os.path.join(state_dir, "visited.bin")
+        self.ops = 0
+        self._file = None
+
+    def _append(self, line):
+        if "\n" in line:
+            return
+        if self._file is None:
+            os.makedirs(self.state_dir, exist_ok=True)
+            self._file = open(self.journal_path, "a", buffering=1, encoding="utf-8")
+        self._file.write(line + "\n")
+        self.ops += 1
+
+    def record_add(self, url, depth, score):
+        self._append(f"A\t{depth}\t{score!r}\t{url}")
+
+    def record_pop(self, url):
+        self._append(f"P\t{url}")
+
+    def record_visit(self, url):
+        self._append(f"V\t{url}")
+
+    def restore(self, frontier):
+        """Load the last snapshot into ``frontier`` and replay the journal."""
+        visited = UrlHashSet()
+        if os.path.exists(self.visited_path):
+            try:
+                visited = UrlHashSet.load(self.visited_path)
+            except Exception as e:
+                logger.warning(f"[FRONTIER] Ignoring unreadable visited snapshot: {e}")
+        frontier.visited = visited
+
+        queued = 0
+        if os.path.exists(self.queue_path):
+            with open(self.queue_path, encoding="utf-8") as f:
+                for line in f:
+                    url, depth, score = json.loads(line)
+                    if frontier.restore_url(url, depth, score):
+                        queued += 1
+
+        replayed = 0
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, encoding="utf-8") as f:
+                for line in f:
+                    if not line.endswith("\n"):
+                        break  # torn final write
+                    op, *fields = line.rstrip("\n").split("\t")
+                    try:
+                        if op == "A":
+                            depth, score, url = fields
+                            frontier.restore_url(url, int(depth), float(score))
+                        elif op == "P":
+                            frontier.claim_url(fields[0])
+                        elif op == "V":
+                            frontier.mark_visited(fields[0])
+                    except ValueError:
+                        logger.warning(f"[FRONTIER] Skipping bad journal line: {line.strip()}")
+                        continue
+                    replayed += 1
+
+        in_flight = list(frontier.in_flight.items())
+        for url, (depth, score) in in_flight:
+            frontier.restore_url(url, depth, score)
+
+        if queued or replayed:
+            logger.info(f"[FRONTIER] Restored {frontier.url_count} queued and {len(frontier.visited)} visited URLs "
+                        f"({replayed} journal entries, {len(in_flight)} in-flight re-queued)")
+        self.ops = replayed
+
+    def maybe_checkpoint(self, frontier):
+        if self.ops >= max(self.checkpoint_ops, frontier.url_count + len(frontier.visited)):
+            self.checkpoint(frontier)
+
+    def checkpoint(self, frontier):
+        """Write a compacted snapshot atomically and truncate the journal."""
+        os.makedirs(self.state_dir, exist_ok=True)
+        tmp_path = f"{self.queue_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for neg_score, _, url, depth in frontier.queue:
+                if url is not None:
+                    f.write(json.dumps([url, depth, -neg_score]) + "\n")
+            # Popped but not yet visited: keep them so a crash re-queues them
+            for url, (depth, score) in frontier.in_flight.items():
+                f.write(json.dumps([url, depth, score]) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.queue_path)
+
+        frontier.visited.save(self.visited_path)
+
+        if self._file is not None:
+            self._file.close()
+        self._file = open(self.journal_path, "w", buffering=1, encoding="utf-8")
+        self.ops = 0
+        logger.info(f"[FRONTIER] Checkpoint: {frontier.url_count} queued, {len(frontier.visited)} visited")
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def clear(self):
+        """Delete the journal and snapshot, e.g. once the crawl they describe has finished."""
+        self.close()
+        for path in (self.journal_path, self.queue_path, self.visited_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self.ops = 0
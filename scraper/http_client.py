@@ -0,0 +1,201 @@
+"""Shared, per-process HTTP clients for page and image downloads.
+
+Every fetch against sheerluxe.com / slman.com goes through one pooled
+``requests.Session`` per process, so TCP+TLS connections are kept alive and
+reused instead of re-handshaking on every page and image. The session's
+connection pools look hosts up through their own bounded cache
+(``HTTP_DNS_CACHE_SIZE`` hosts for ``HTTP_DNS_CACHE_TTL`` seconds; aiohttp
+sessions use the connector's ``ttl_dns_cache``), nothing else in the process
+is affected, and each host is capped at ``HTTP_MAX_CONNECTIONS_PER_HOST``
+connections.
+
+Clients are created lazily and rebuilt after ``fork()``, so a session created
+in the Celery parent is never shared with prefork children.
+
+``fetch`` also waits for the host's shared rate limit (see ``rate_limiter``)
+and reports 429/503 responses back to it.
+"""
+import os
+import socket
+import threading
+import time
+import logging
+from collections import OrderedDict
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from . import rate_limiter
+
+logger = logging.getLogger(__name__)
+
+HTTP_POOL_HOSTS = int(os.environ.get("HTTP_POOL_HOSTS", "16"))
+HTTP_MAX_CONNECTIONS_PER_HOST = int(os.environ.get("HTTP_MAX_CONNECTIONS_PER_HOST", "16"))
+HTTP_DNS_CACHE_TTL = int(os.environ.get("HTTP_DNS_CACHE_TTL", "300"))
+HTTP_DNS_CACHE_SIZE = int(os.environ.get("HTTP_DNS_CACHE_SIZE", "256"))
+HTTP_TIMEOUT = int(os.environ.get("HTTP_TIMEOUT", "10"))
+
+import brotli  # noqa: F401  (lets urllib3/aiohttp decode "br" responses)
+ACCEPT_ENCODING = "gzip, deflate, br"
+
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
+    "Accept-Encoding": ACCEPT_ENCODING,
+    "Connection": "keep-alive",
+}
+
+_lock = threading.Lock()
+_session = None
+_session_pid = None
+
+
+class DNSCache:
+    """LRU of ``host -> addresses`` lookups, each kept for ``ttl`` seconds.
+
+    The whole ``getaddrinfo`` list is kept, in its order, so a connection
+    can fall back from one address (say IPv6) to the next.
+    """
+
+    def __init__(self, ttl=HTTP_DNS_CACHE_TTL, max_size=HTTP_DNS_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def resolve(self, host, port):
+        key = (host, port)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached and cached[0] > now:
+                self._entries.move_to_end(key)
+                return cached[1]
+        # Resolve outside the lock
+        addresses = list(dict.fromkeys(
+            info[4][0] for info in socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        ))
+        with self._lock:
+            self._entries[key] = (now + self.ttl, addresses)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return addresses
+
+    def forget(self, host, port):
+        with self._lock:
+            self._entries.pop((host, port), None)
+
+
+def _cached_dns_pool(pool_cls, dns_cache):
+    """``pool_cls`` whose connections connect to ``dns_cache``'s addresses for their host.
+
+    The addresses are tried in order, as ``create_connection`` would. Only
+    the TCP connect uses them; the Host header and TLS SNI/certificate
+    checks still use the host name.
+    """
+    class CachedDNSConnection(pool_cls.ConnectionCls):
+        def _new_conn(self):
+            host = self._dns_host
+            error = None
+            try:
+                for address in dns_cache.resolve(host, self.port):
+                    self._dns_host = address
+                    try:
+                        return super()._new_conn()
+                    except Exception as e:
+                        error = e
+            finally:
+                self._dns_host = host
+            dns_cache.forget(host, self.port)  # Maybe stale: look it up again next time
+            raise error
+
+    return type(f"CachedDNS{pool_cls.__name__}", (pool_cls,), {"ConnectionCls": CachedDNSConnection})
+
+
+class CachedDNSAdapter(HTTPAdapter):
+    """``HTTPAdapter`` whose pools share one ``DNSCache``, scoped to this adapter."""
+
+    def __init__(self, dns_cache=None, **kwargs):
+        self.dns_cache = dns_cache or DNSCache()
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        if self.dns_cache.ttl > 0:
+            self.poolmanager.pool_classes_by_scheme = {
+                "http": _cached_dns_pool(HTTPConnectionPool, self.dns_cache),
+                "https": _cached_dns_pool(HTTPSConnectionPool, self.dns_cache),
+            }
+
+
+def _build_session():
+    session = requests.Session()
+    adapter = CachedDNSAdapter(
+        pool_connections=HTTP_POOL_HOSTS,
+        pool_maxsize=HTTP_MAX_CONNECTIONS_PER_HOST,
+        pool_block=True,
+        max_retries=0
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update(DEFAULT_HEADERS)
+    return session
+
+
+def _reset_after_fork():
+    global _session, _session_pid
+    _session = None
+    _session_pid = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_session():
+    """Return this process's pooled session, creating it on first use."""
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _lock:
+            if _session is None or _session_pid != pid:
+                _session = _build_session()
+                _session_pid = pid
+    return _session
+
+
+def is_permanent_failure(status):
+    """4xx answers other than 408/429: retrying won't change them."""
+    return 400 <= status < 500 and status not in (408, 429)
+
+
+def fetch(url, timeout=HTTP_TIMEOUT, **kwargs):
+    """GET ``url`` through the shared session, within the host's rate limit.
+
+    ``response.throttled`` tells whether the host throttled the request.
+    """
+    rate_limiter.acquire(url)
+    response = get_session().get(url, timeout=timeout, **kwargs)
+    response.throttled = rate_limiter.observe(url, response.status_code, response.headers)
+    return response
+
+
+def create_async_session(limit=100, timeout=HTTP_TIMEOUT, headers=None):
+    """Build a pooled aiohttp session with the same per-host caps and DNS TTL.
+
+    aiohttp sessions are bound to an event loop, so callers own the returned
+    session and must close it.
+    """
+    connector = aiohttp.TCPConnector(
+        limit=limit,
+        limit_per_host=HTTP_MAX_CONNECTIONS_PER_HOST,
+        ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+        keepalive_timeout=30
+    )
+    return aiohttp.ClientSession(
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(total=timeout),
+        headers={**DEFAULT_HEADERS, **(headers or {})}
+    )
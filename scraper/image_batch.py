@@ -0,0 +1,207 @@
+"""Concurrent image pipeline behind the ``process_image_batch`` task.
+
+Every stage of ``process_image`` is I/O bound, so a batch of images is run
+inside one asyncio loop: downloads share a pooled aiohttp connector, GPT
+calls go through an async OpenAI client created (and closed) for that loop,
+embeddings go through the shared embedding batcher, and the blocking Supabase
+calls are pushed onto a thread pool sized to the in-flight limit.
+"""
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from . import rate_limiter
+from .http_client import create_async_session, is_permanent_failure
+from .image_hash import compute_dhash, find_similar, remember
+from .metadata_batch import is_batch_mode, queue_for_batch
+from .openai_client import (
+    create_async_client,
+    generate_gpt_structured_metadata_async,
+    generate_embedding_from_text_async,
+    get_cached_metadata,
+    is_meaningful_metadata,
+    OpenAIBusy,
+    summarize_metadata_for_embedding
+)
+from .supabase_client import (
+    upload_image_to_supabase, download_uploaded_image, delete_uploaded_image, store_analysis_result, moodboard_writer
+)
+from .exceptions import StorageError
+from .utils import is_supported_image_url
+
+logger = logging.getLogger(__name__)
+
+IMAGE_BATCH_CONCURRENCY = int(os.environ.get("IMAGE_BATCH_CONCURRENCY", "64"))
+
+# Returned by process_one when the image was handed to the Batch API.
+DEFERRED = "deferred"
+
+
+def build_image_context(item):
+    """Normalise a batch item (a bare URL or a dict) into an image context."""
+    if isinstance(item, str):
+        item = {"image_url": item}
+    return {
+        "image_url": item["image_url"],
+        "alt_text": item.get("alt_text", ""),
+        "title": item.get("title", ""),
+        "surrounding_text": item.get("surrounding_text", ""),
+        "source_url": item.get("source_url") or "https://sheerluxe.com/fashion",
+        "lease_token": item.get("lease_token"),
+        "stored_image_url": item.get("stored_image_url")
+    }
+
+
+async def download_image_async(session, image_url):
+    """Async ``download_image_file``: None only when the image is gone for good."""
+    await rate_limiter.acquire_async(image_url)
+    async with session.get(image_url) as response:
+        await rate_limiter.observe_async(image_url, response.status, response.headers)
+        if is_permanent_failure(response.status):
+            logger.info(f"[SKIP] {image_url} returned {response.status}")
+            return None
+        response.raise_for_status()
+        return await response.read()
+
+
+async def _read_back(image_context):
+    """Bytes of an image uploaded when an earlier attempt was deferred, or None."""
+    try:
+        return await asyncio.to_thread(download_uploaded_image, image_context["stored_image_url"])
+    except Exception as e:
+        logger.warning(f"[DEFER] Could not read back {image_context['stored_image_url']}: {e}")
+        return None
+
+
+async def _drop_upload(stored_image_url):
+    if stored_image_url:
+        await asyncio.to_thread(delete_uploaded_image, stored_image_url)
+
+
+async def process_one(session, openai, image_context):
+    """Run a single image through download → dedup → GPT → embedding → upload → store.
+
+    Returns the image URL when the record was stored, ``DEFERRED`` when it
+    was queued for the Batch API, and None when there is nothing to store
+    (unsupported, gone, or no meaningful metadata). Transient failures are
+    raised so ``run_image_batch`` reports them as failed and the lease is
+    retried rather than committed.
+
+    When the governor has no slot the image is uploaded before
+    ``OpenAIBusy`` propagates, and its ``stored_image_url`` goes into the
+    context, so the deferred retry reads it back from storage instead of
+    downloading it from the site again.
+    """
+    image_url = image_context["image_url"]
+
+    if not is_supported_image_url(image_url):
+        logger.info(f"[SKIP] Unsupported image format: {image_url}")
+        return None
+
+    uploaded = image_context.get("stored_image_url")
+    image_bytes = await _read_back(image_context) if uploaded else None
+    if not image_bytes:
+        uploaded = None
+        image_bytes = await download_image_async(session, image_url)
+    if not image_bytes:
+        logger.info(f"[SKIP] Image gone: {image_url}")
+        return None
+
+    image_hash = await asyncio.to_thread(compute_dhash, image_bytes)
+    match = await asyncio.to_thread(find_similar, image_hash) if image_hash is not None else None
+
+    if match:
+        logger.info(f"[DEDUP] {image_url} matches {match['image_url']} (distance {match['distance']})")
+        metadata = match["metadata"]
+        embedding = await generate_embedding_from_text_async(summarize_metadata_for_embedding(metadata))
+        stored_image_url = match["stored_image_url"]
+        await _drop_upload(uploaded)
+    elif is_batch_mode() and await asyncio.to_thread(get_cached_metadata, image_bytes) is None:
+        await _drop_upload(uploaded)
+        await asyncio.to_thread(queue_for_batch, image_context, image_bytes, image_hash)
+        logger.info(f"[BATCH API] Queued for metadata batch: {image_url}")
+        return DEFERRED
+    else:
+        try:
+            metadata = await generate_gpt_structured_metadata_async(openai, image_context, image_bytes)
+        except OpenAIBusy:
+            if not uploaded:
+                image_context["stored_image_url"] = await asyncio.to_thread(
+                    upload_image_to_supabase, image_url, image_bytes
+                )
+            raise
+        if not metadata or not is_meaningful_metadata(metadata):
+            logger.info(f"[SKIP] No meaningful metadata for: {image_url}")
+            await _drop_upload(uploaded)
+            return None
+
+        summary = summarize_metadata_for_embedding(metadata)
+        embedding = await generate_embedding_from_text_async(summary)
+
+        stored_image_url = uploaded or await asyncio.to_thread(upload_image_to_supabase, image_url, image_bytes)
+        if not stored_image_url:
+            raise StorageError(f"Upload to Supabase failed for: {image_url}")
+
+    written = await asyncio.to_thread(
+        store_analysis_result,
+        image_url=image_url,
+        metadata=metadata,
+        embedding=embedding,
+        stored_image_url=stored_image_url,
+        source_url=image_context["source_url"],
+        title=image_context["title"],
+        description=image_context["surrounding_text"],
+        wait=False
+    )
+    # Resolved by the writer's next flush; the lease is only committed once the row is durable
+    if not await asyncio.wrap_future(written):
+        raise StorageError(f"DB write failed for: {image_url}")
+
+    # Only index rows that made it to the table
+    if not match and image_hash is not None:
+        await asyncio.to_thread(remember, image_hash, image_url, metadata, stored_image_url)
+    return image_url
+
+
+async def run_image_batch(items, concurrency=IMAGE_BATCH_CONCURRENCY):
+    """Process ``items`` with at most ``concurrency`` images in flight.
+
+    Returns ``(stored, failed, deferred, throttled)``: lists of image URLs,
+    except ``throttled``, which maps each image the OpenAI governor had no
+    slot for to ``(countdown, stored_image_url)``: the countdown it asked for
+    and where its bytes were kept for the retry (None if the upload failed).
+    """
+    contexts = [build_image_context(item) for item in items]
+    if not contexts:
+        return [], [], [], {}
+
+    concurrency = max(1, min(concurrency, len(contexts)))
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=concurrency))
+
+    sem = asyncio.Semaphore(concurrency)
+    async with create_async_session(limit=concurrency) as session, create_async_client() as openai:
+        async def bounded(image_context):
+            async with sem:
+                return await process_one(session, openai, image_context)
+
+        results = await asyncio.gather(
+            *(bounded(c) for c in contexts),
+            return_exceptions=True
+        )
+
+    await asyncio.to_thread(moodboard_writer.flush)
+
+    stored, failed, deferred, throttled = [], [], [], {}
+    for image_context, result in zip(contexts, results):
+        if isinstance(result, OpenAIBusy):
+            throttled[image_context["image_url"]] = (result.countdown, image_context.get("stored_image_url"))
+        elif isinstance(result, Exception):
+            logger.error(f"[ERROR] Batch item failed on {image_context['image_url']}: {result}")
+            failed.append(image_context["image_url"])
+        elif result == DEFERRED:
+            deferred.append(image_context["image_url"])
+        elif result:
+            stored.append(result)
+    return stored, failed, deferred, throttled
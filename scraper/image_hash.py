@@ -0,0 +1,144 @@
+"""Perceptual-hash dedup for downloaded images.
+
+The same photo is often served at several CDN sizes or reused across
+articles under a different URL. Before an image is sent to GPT we compute a
+64-bit difference hash (dHash) of its pixels and look it up in a Hamming
+index shared through Redis. On a match, the stored metadata and upload are
+reused instead of paying for another vision call; the embedding is rebuilt
+from the metadata, which is cheap, rather than kept in Redis.
+
+The index splits each hash into ``PHASH_BANDS`` bands and files the hash under
+every band value. Two hashes within ``PHASH_BANDS - 1`` bits must agree
+exactly on at least one band, so a lookup only has to compare the few
+candidates that share a band. ``PHASH_MAX_DISTANCE`` must therefore be below
+``PHASH_BANDS``; anything else is rejected at import.
+
+Near-uniform images (blank placeholders, solid swatches) all hash to 0, so
+they are not hashed at all. Entries expire after ``PHASH_TTL_SECONDS``.
+"""
+import io
+import os
+import json
+import logging
+
+from PIL import Image
+
+from .redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+PHASH_BANDS = int(os.environ.get("PHASH_BANDS", "4"))
+PHASH_MAX_DISTANCE = int(os.environ.get("PHASH_MAX_DISTANCE", "3"))
+# Grey-level spread (0-255) below which the 9x8 thumbnail is too flat to hash.
+PHASH_MIN_CONTRAST = int(os.environ.get("PHASH_MIN_CONTRAST", "8"))
+PHASH_TTL_SECONDS = int(os.environ.get("PHASH_TTL_SECONDS", str(30 * 24 * 3600)))
+PHASH_PREFIX = "phash:"
+
+if not 1 <= PHASH_BANDS <= 64:
+    raise ValueError(f"PHASH_BANDS must be between 1 and 64, got {PHASH_BANDS}")
+if not 0 <= PHASH_MAX_DISTANCE < PHASH_BANDS:
+    raise ValueError(
+        f"PHASH_MAX_DISTANCE={PHASH_MAX_DISTANCE} needs PHASH_BANDS > {PHASH_MAX_DISTANCE} "
+        f"(got {PHASH_BANDS}); raise PHASH_BANDS or lower the distance"
+    )
+
+# (shift, mask) per band; bands differ by at most one bit in width when 64 doesn't divide evenly
+_BANDS = [
+    (64 * i // PHASH_BANDS, (1 << (64 * (i + 1) // PHASH_BANDS - 64 * i // PHASH_BANDS)) - 1)
+    for i in range(PHASH_BANDS)
+]
+
+
+def compute_dhash(image_bytes):
+    """Return the 64-bit dHash of ``image_bytes``.
+
+    None if it can't be decoded or is too flat to tell apart from other
+    flat images.
+    """
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            pixels = list(img.convert("L").resize((9, 8), Image.LANCZOS).getdata())
+    except Exception as e:
+        logger.warning(f"[PHASH] Could not decode image: {e}")
+        return None
+
+    if max(pixels) - min(pixels) < PHASH_MIN_CONTRAST:
+        logger.info("[PHASH] Skipping low-contrast image")
+        return None
+
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def _bands(image_hash):
+    return [(image_hash >> shift) & mask for shift, mask in _BANDS]
+
+
+def _band_key(index, band):
+    return f"{PHASH_PREFIX}band:{index}:{band:x}"
+
+
+def _item_key(image_hash):
+    return f"{PHASH_PREFIX}item:{image_hash:016x}"
+
+
+def find_similar(image_hash):
+    """Return the stored entry closest to ``image_hash`` within the threshold."""
+    try:
+        pipe = redis_client.pipeline()
+        for i, band in enumerate(_bands(image_hash)):
+            pipe.smembers(_band_key(i, band))
+        candidates = set().union(*pipe.execute())
+
+        matches = sorted(
+            (distance, candidate)
+            for candidate in candidates
+            if (distance := (int(candidate, 16) ^ image_hash).bit_count()) <= PHASH_MAX_DISTANCE
+        )
+        if not matches:
+            return None
+
+        entries = redis_client.mget([_item_key(int(candidate, 16)) for _, candidate in matches])
+        for (distance, candidate), entry in zip(matches, entries):
+            if entry:
+                entry = json.loads(entry)
+                entry["distance"] = distance
+                return entry
+            _forget(int(candidate, 16))
+        return None
+    except Exception as e:
+        logger.warning(f"[PHASH] Lookup failed: {e}")
+        return None
+
+
+def _forget(image_hash):
+    """Drop an expired entry's hash from its bands."""
+    member = f"{image_hash:016x}"
+    pipe = redis_client.pipeline()
+    for i, band in enumerate(_bands(image_hash)):
+        pipe.srem(_band_key(i, band), member)
+    pipe.execute()
+
+
+def remember(image_hash, image_url, metadata, stored_image_url):
+    """Add a processed image to the shared index for ``PHASH_TTL_SECONDS``."""
+    try:
+        member = f"{image_hash:016x}"
+        pipe = redis_client.pipeline()
+        pipe.set(_item_key(image_hash), json.dumps({
+            "image_url": image_url,
+            "metadata": metadata,
+            "stored_image_url": stored_image_url
+        }), ex=PHASH_TTL_SECONDS)
+        for i, band in enumerate(_bands(image_hash)):
+            pipe.sadd(_band_key(i, band), member)
+            # Bands outlive their oldest members; stale members are dropped on lookup
+            pipe.expire(_band_key(i, band), PHASH_TTL_SECONDS)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"[PHASH] Failed to index {image_url}: {e}")
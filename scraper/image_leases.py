@@ -0,0 +1,227 @@
+"""Lease-based claim/commit state machine for image processing.
+
+Every admitted image moves through explicit states kept in Redis:
+
+    queued ──claim──▶ leased ──commit──▶ done
+       ▲                 │
+       └──fail / reap────┘──(too many attempts)──▶ failed
+
+Each queued or leased image has a deadline in the ``image_leases:deadline``
+sorted set. A claim is atomic and stamps the lease with the claiming task's
+token, and only that token can commit or fail it. If a worker dies
+mid-task its lease runs out and ``reap`` hands the image back out, so
+nothing is silently dropped; while a lease is live no other task can
+claim the image, so duplicate deliveries don't pay for GPT twice.
+
+Only a failed run or an expired lease counts as an attempt. An image still
+queued at its deadline may just be waiting behind a long broker backlog,
+so ``reap`` re-publishes it without charging an attempt, and doubles its
+next queue deadline (up to ``IMAGE_QUEUE_TIMEOUT_MAX_SECONDS``) so a slow
+queue isn't flooded with duplicate messages.
+
+Done images are removed from these structures. The ``seen_images`` filter
+already remembers them, so state stays proportional to in-flight work.
+"""
+import os
+import json
+import time
+import logging
+
+from .redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+LEASE_SECONDS = int(os.environ.get("IMAGE_LEASE_SECONDS", "900"))
+QUEUE_TIMEOUT_SECONDS = int(os.environ.get("IMAGE_QUEUE_TIMEOUT_SECONDS", "3600"))
+QUEUE_TIMEOUT_MAX_SECONDS = int(os.environ.get("IMAGE_QUEUE_TIMEOUT_MAX_SECONDS", "86400"))
+MAX_ATTEMPTS = int(os.environ.get("IMAGE_MAX_ATTEMPTS", "4"))
+
+STATE_KEY = "image_leases:state"
+TOKEN_KEY = "image_leases:token"
+DEADLINE_KEY = "image_leases:deadline"
+ATTEMPTS_KEY = "image_leases:attempts"
+CONTEXT_KEY = "image_leases:context"
+REPUBLISHED_KEY = "image_leases:republished"
+
+_KEYS = [STATE_KEY, TOKEN_KEY, DEADLINE_KEY, ATTEMPTS_KEY, CONTEXT_KEY, REPUBLISHED_KEY]
+
+# ARGV: deadline, then url/context pairs. Returns 1 per newly queued url.
+_ENQUEUE = redis_client.register_script("""
+local deadline = ARGV[1]
+local result = {}
+for i = 2, #ARGV, 2 do
+    local url = ARGV[i]
+    if redis.call('HSETNX', KEYS[1], url, 'queued') == 1 then
+        redis.call('HSET', KEYS[5], url, ARGV[i + 1])
+        redis.call('ZADD', KEYS[3], deadline, url)
+        result[#result + 1] = 1
+    else
+        result[#result + 1] = 0
+    end
+end
+return result
+""")
+
+# ARGV: token, now, lease deadline, urls... Returns the urls claimed.
+_CLAIM = redis_client.register_script("""
+local token, now, deadline = ARGV[1], tonumber(ARGV[2]), ARGV[3]
+local claimed = {}
+for i = 4, #ARGV do
+    local url = ARGV[i]
+    local state = redis.call('HGET', KEYS[1], url)
+    local expired = state == 'leased' and tonumber(redis.call('ZSCORE', KEYS[3], url) or 0) < now
+    local mine = state == 'leased' and redis.call('HGET', KEYS[2], url) == token
+    if state == 'queued' or expired or mine then
+        redis.call('HSET', KEYS[1], url, 'leased')
+        redis.call('HSET', KEYS[2], url, token)
+        redis.call('ZADD', KEYS[3], deadline, url)
+        claimed[#claimed + 1] = url
+    end
+end
+return claimed
+""")
+
+# ARGV: token, new deadline, urls... Returns how many leases were still held.
+_EXTEND = redis_client.register_script("""
+local n = 0
+for i = 3, #ARGV do
+    if redis.call('HGET', KEYS[2], ARGV[i]) == ARGV[1] then
+        redis.call('ZADD', KEYS[3], ARGV[2], ARGV[i])
+        n = n + 1
+    end
+end
+return n
+""")
+
+# ARGV: token, urls... Returns how many leases were still held.
+_COMMIT = redis_client.register_script("""
+local n = 0
+for i = 2, #ARGV do
+    local url = ARGV[i]
+    if redis.call('HGET', KEYS[2], url) == ARGV[1] then
+        redis.call('HDEL', KEYS[1], url)
+        redis.call('HDEL', KEYS[2], url)
+        redis.call('ZREM', KEYS[3], url)
+        redis.call('HDEL', KEYS[4], url)
+        redis.call('HDEL', KEYS[5], url)
+        redis.call('HDEL', KEYS[6], url)
+        n = n + 1
+    end
+end
+return n
+""")
+
+# ARGV: token, max attempts, queue deadline, url. Returns the new state.
+_FAIL = redis_client.register_script("""
+local url = ARGV[4]
+if redis.call('HGET', KEYS[2], url) ~= ARGV[1] then
+    return false
+end
+redis.call('HDEL', KEYS[2], url)
+local attempts = redis.call('HINCRBY', KEYS[4], url, 1)
+if attempts >= tonumber(ARGV[2]) then
+    redis.call('HSET', KEYS[1], url, 'failed')
+    redis.call('ZREM', KEYS[3], url)
+    return 'failed'
+end
+redis.call('HSET', KEYS[1], url, 'queued')
+redis.call('ZADD', KEYS[3], ARGV[3], url)
+return 'queued'
+""")
+
+# ARGV: now, max attempts, queue timeout, max queue timeout, limit.
+# Returns url/context pairs to re-dispatch.
+_REAP = redis_client.register_script("""
+local now, max_attempts = tonumber(ARGV[1]), tonumber(ARGV[2])
+local timeout, max_timeout = tonumber(ARGV[3]), tonumber(ARGV[4])
+local due = redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', now, 'LIMIT', 0, tonumber(ARGV[5]))
+local result = {}
+for _, url in ipairs(due) do
+    local requeue = true
+    if redis.call('HGET', KEYS[1], url) == 'leased' then
+        -- The task holding it died or overran: that run was an attempt
+        redis.call('HDEL', KEYS[2], url)
+        local attempts = redis.call('HINCRBY', KEYS[4], url, 1)
+        if attempts >= max_attempts then
+            redis.call('HSET', KEYS[1], url, 'failed')
+            redis.call('ZREM', KEYS[3], url)
+            requeue = false
+        else
+            redis.call('HSET', KEYS[1], url, 'queued')
+            redis.call('ZADD', KEYS[3], now + timeout, url)
+        end
+    else
+        -- Never picked up: re-publish in case the message was lost, backing off
+        local republished = redis.call('HINCRBY', KEYS[6], url, 1)
+        redis.call('ZADD', KEYS[3], now + math.min(max_timeout, timeout * 2 ^ republished), url)
+    end
+    if requeue then
+        result[#result + 1] = url
+        result[#result + 1] = redis.call('HGET', KEYS[5], url) or ''
+    end
+end
+return result
+""")
+
+
+def enqueue(items):
+    """Mark image items (dicts with ``image_url``) as queued.
+
+    Returns the items that were newly queued; already-tracked ones are dropped.
+    """
+    if not items:
+        return []
+    args = [time.time() + QUEUE_TIMEOUT_SECONDS]
+    for item in items:
+        args.extend([item["image_url"], json.dumps(item)])
+    flags = _ENQUEUE(keys=_KEYS, args=args)
+    return [item for item, is_new in zip(items, flags) if is_new]
+
+
+def claim_many(image_urls, token, lease_seconds=LEASE_SECONDS):
+    """Atomically lease every queued (or expired) url. Returns the set claimed."""
+    if not image_urls:
+        return set()
+    now = time.time()
+    return set(_CLAIM(keys=_KEYS, args=[token, now, now + lease_seconds, *image_urls]))
+
+
+def claim(image_url, token, lease_seconds=LEASE_SECONDS):
+    return image_url in claim_many([image_url], token, lease_seconds)
+
+
+def extend(image_urls, token, lease_seconds):
+    """Push out the deadline of leases still held by ``token``."""
+    if not image_urls:
+        return 0
+    return _EXTEND(keys=_KEYS, args=[token, time.time() + lease_seconds, *image_urls])
+
+
+def commit_many(image_urls, token):
+    if not image_urls:
+        return 0
+    committed = _COMMIT(keys=_KEYS, args=[token, *image_urls])
+    if committed < len(image_urls):
+        logger.warning(f"[LEASE] {len(image_urls) - committed} leases expired before commit")
+    return committed
+
+
+def commit(image_url, token):
+    return commit_many([image_url], token) == 1
+
+
+def fail(image_url, token):
+    """Release a lease after an error. Returns 'queued', 'failed' or None."""
+    return _FAIL(keys=_KEYS, args=[token, MAX_ATTEMPTS, time.time() + QUEUE_TIMEOUT_SECONDS, image_url])
+
+
+def reap(limit=1000):
+    """Re-queue images whose lease or queue deadline has passed.
+
+    Returns the contexts of the images that should be dispatched again.
+    """
+    flat = _REAP(keys=_KEYS, args=[time.time(), MAX_ATTEMPTS, QUEUE_TIMEOUT_SECONDS, QUEUE_TIMEOUT_MAX_SECONDS, limit])
+    contexts = []
+    for url, raw_context in zip(flat[::2], flat[1::2]):
+        contexts.append(json.loads(raw_context) if raw_context else {"image_url": url})
+    return contexts
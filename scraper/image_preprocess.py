@@ -0,0 +1,75 @@
+"""Downscale and re-encode images before they are sent to the vision model.
+
+Editorial photos are often several megabytes. Everything over
+``VISION_MAX_EDGE`` pixels on its longest side is resized and re-encoded as
+``VISION_FORMAT`` at ``VISION_QUALITY`` before base64 encoding, which cuts
+request size, upload time and image tokens. The original bytes are still
+what gets uploaded to Supabase.
+
+``VISION_DETAIL`` is passed through as the ``detail`` level, except for
+``adaptive``, which asks for ``low`` when the prepared image already fits
+in a single 512px tile and ``high`` otherwise.
+"""
+import io
+import os
+import logging
+
+from PIL import Image
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+VISION_MAX_EDGE = int(os.environ.get("VISION_MAX_EDGE", "1024"))
+VISION_FORMAT = os.environ.get("VISION_FORMAT", "JPEG").upper()
+VISION_QUALITY = int(os.environ.get("VISION_QUALITY", "85"))
+VISION_DETAIL = os.environ.get("VISION_DETAIL", "adaptive")
+
+LOW_DETAIL_EDGE = 512
+
+_MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+
+def pick_detail(width, height):
+    if VISION_DETAIL != "adaptive":
+        return VISION_DETAIL
+    return "low" if max(width, height) <= LOW_DETAIL_EDGE else "high"
+
+
+def prepare_vision_image(image_bytes):
+    """Return ``(bytes, mime_type, detail)`` for the vision request.
+
+    ``mime_type`` is None when the original bytes are kept because they
+    could not be decoded or re-encoding would not make them smaller.
+    """
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            img.thumbnail((VISION_MAX_EDGE, VISION_MAX_EDGE))
+            width, height = img.size
+
+            if img.mode in ("RGBA", "LA", "P"):
+                img = img.convert("RGBA")
+                background = Image.new("RGB", img.size, (255, 255, 255))
+                background.paste(img, mask=img.getchannel("A"))
+                img = background
+            elif img.mode != "RGB":
+                img = img.convert("RGB")
+
+            buffer = io.BytesIO()
+            img.save(buffer, format=VISION_FORMAT, quality=VISION_QUALITY)
+            prepared = buffer.getvalue()
+    except Exception as e:
+        logger.warning(f"[PREPROCESS] Could not re-encode image, sending original: {e}")
+        return image_bytes, None, "auto" if VISION_DETAIL == "adaptive" else VISION_DETAIL
+
+    detail = pick_detail(width, height)
+    if len(prepared) >= len(image_bytes):
+        metrics.incr_many({"vision_bytes_in": len(image_bytes), "vision_bytes_out": len(image_bytes)})
+        return image_bytes, None, detail
+
+    metrics.incr_many({
+        "vision_bytes_in": len(image_bytes),
+        "vision_bytes_out": len(prepared),
+        "vision_bytes_saved": len(image_bytes) - len(prepared),
+    })
+    return prepared, _MIME_TYPES.get(VISION_FORMAT, "image/jpeg"), detail
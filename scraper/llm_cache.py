@@ -0,0 +1,91 @@
+"""Content-addressed cache for parsed GPT metadata.
+
+Entries are keyed on the SHA-256 of the image bytes, the ``build_prompt``
+version and the model name, so retries, re-seeds and re-runs after a crash
+reuse the metadata from an earlier identical call. Bumping
+``PROMPT_VERSION`` invalidates everything produced by an older prompt.
+
+Lookups hit a per-process LRU first and fall back to Redis, where entries
+carry a TTL and the cache is capped at ``LLM_CACHE_MAX_ENTRIES`` by evicting
+the oldest keys.
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from .redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_TTL = int(os.environ.get("LLM_CACHE_TTL", str(30 * 24 * 3600)))
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", "500000"))
+LLM_CACHE_LOCAL_SIZE = int(os.environ.get("LLM_CACHE_LOCAL_SIZE", "1024"))
+
+LLM_CACHE_PREFIX = "llm_cache:"
+LLM_CACHE_INDEX = "llm_cache:index"
+
+_local = OrderedDict()
+_local_lock = threading.Lock()
+
+
+def cache_key(image_bytes, prompt_version, model):
+    digest = hashlib.sha256(image_bytes).hexdigest()
+    return f"{LLM_CACHE_PREFIX}{model}:{prompt_version}:{digest}"
+
+
+def _local_get(key):
+    with _local_lock:
+        if key not in _local:
+            return None
+        _local.move_to_end(key)
+        return _local[key]
+
+
+def _local_put(key, metadata):
+    with _local_lock:
+        _local[key] = metadata
+        _local.move_to_end(key)
+        while len(_local) > LLM_CACHE_LOCAL_SIZE:
+            _local.popitem(last=False)
+
+
+def get(key):
+    """Return cached metadata for ``key`` or None."""
+    metadata = _local_get(key)
+    if metadata is not None:
+        return metadata
+
+    try:
+        raw = redis_client.get(key)
+    except Exception as e:
+        logger.warning(f"[LLM CACHE] Lookup failed: {e}")
+        return None
+    if raw is None:
+        return None
+
+    metadata = json.loads(raw)
+    _local_put(key, metadata)
+    return metadata
+
+
+def put(key, metadata):
+    _local_put(key, metadata)
+    try:
+        now = time.time()
+        pipe = redis_client.pipeline()
+        pipe.set(key, json.dumps(metadata), ex=LLM_CACHE_TTL)
+        pipe.zadd(LLM_CACHE_INDEX, {key: now})
+        pipe.zremrangebyscore(LLM_CACHE_INDEX, "-inf", now - LLM_CACHE_TTL)
+        pipe.zcard(LLM_CACHE_INDEX)
+        size = pipe.execute()[-1]
+
+        if size > LLM_CACHE_MAX_ENTRIES:
+            evicted = [k for k, _ in redis_client.zpopmin(LLM_CACHE_INDEX, size - LLM_CACHE_MAX_ENTRIES)]
+            if evicted:
+                redis_client.delete(*evicted)
+    except Exception as e:
+        logger.warning(f"[LLM CACHE] Store failed: {e}")
@@ -0,0 +1,109 @@
+"""Live crawl-worker membership and rendezvous routing.
+
+Workers register in the ``workers:heartbeats`` sorted set (score = last
+heartbeat) and every join, leave or expiry bumps ``workers:generation``.
+Each process caches the member list and only re-reads it when the
+generation changes, checked at most every ``ROUTING_REFRESH_SECONDS``.
+
+URLs are routed with rendezvous (highest-random-weight) hashing, so when a
+worker joins or leaves only the URLs it wins or loses move. A plain
+``hash % n`` remaps almost every URL instead.
+"""
+import os
+import time
+import logging
+from hashlib import blake2b
+
+from .redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_TTL_SECONDS = int(os.environ.get("WORKER_HEARTBEAT_TTL", "30"))
+ROUTING_REFRESH_SECONDS = float(os.environ.get("ROUTING_REFRESH_SECONDS", "5"))
+
+HEARTBEATS_KEY = "workers:heartbeats"
+GENERATION_KEY = "workers:generation"
+KNOWN_MEMBERS_KEY = "workers:known"
+
+# KEYS: heartbeats, generation, known. ARGV: member ('' to only prune), now, ttl.
+# Upserts the member, drops expired ones, bumps the generation on any change.
+_HEARTBEAT = redis_client.register_script("""
+local changed = 0
+local member, now, ttl = ARGV[1], tonumber(ARGV[2]), tonumber(ARGV[3])
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', now - ttl)
+for _, dead in ipairs(expired) do
+    if dead ~= member then
+        redis.call('ZREM', KEYS[1], dead)
+        changed = 1
+    end
+end
+if member ~= '' then
+    if redis.call('ZADD', KEYS[1], now, member) == 1 then
+        changed = 1
+    end
+    redis.call('SADD', KEYS[3], member)
+end
+if changed == 1 then
+    return redis.call('INCR', KEYS[2])
+end
+return tonumber(redis.call('GET', KEYS[2]) or 0)
+""")
+
+
+def rendezvous_owner(key, members):
+    """Return the member with the highest hash weight for ``key``."""
+    best, best_weight = None, -1
+    for member in members:
+        weight = int.from_bytes(blake2b(f"{member}|{key}".encode(), digest_size=8).digest(), "big")
+        if weight > best_weight:
+            best, best_weight = member, weight
+    return best
+
+
+class MembershipRegistry:
+    def __init__(self):
+        self.generation = None
+        self.members = []
+        self._checked_at = 0.0
+
+    def heartbeat(self, member):
+        """Register or refresh ``member`` and prune members that stopped beating."""
+        generation = _HEARTBEAT(
+            keys=[HEARTBEATS_KEY, GENERATION_KEY, KNOWN_MEMBERS_KEY],
+            args=[str(member), time.time(), HEARTBEAT_TTL_SECONDS]
+        )
+        self._refresh(int(generation))
+        return self.generation
+
+    def leave(self, member):
+        pipe = redis_client.pipeline()
+        pipe.zrem(HEARTBEATS_KEY, str(member))
+        pipe.incr(GENERATION_KEY)
+        pipe.execute()
+        self._checked_at = 0.0
+
+    def _refresh(self, generation):
+        if generation != self.generation:
+            live_after = time.time() - HEARTBEAT_TTL_SECONDS
+            self.members = sorted(redis_client.zrangebyscore(HEARTBEATS_KEY, live_after, "+inf"))
+            self.generation = generation
+            logger.info(f"[MEMBERSHIP] Generation {generation}: {len(self.members)} live workers")
+        self._checked_at = time.monotonic()
+
+    def routing_table(self):
+        """Return ``(generation, members)``, re-reading Redis only when stale."""
+        if time.monotonic() - self._checked_at >= ROUTING_REFRESH_SECONDS:
+            self._refresh(int(redis_client.get(GENERATION_KEY) or 0))
+        return self.generation, self.members
+
+    def owner_of(self, key):
+        _, members = self.routing_table()
+        return rendezvous_owner(key, members)
+
+    def departed_members(self):
+        """Members that have owned a shard stream but are no longer live."""
+        live = set(self.routing_table()[1])
+        return [m for m in redis_client.smembers(KNOWN_MEMBERS_KEY) if m not in live]
+
+    def forget(self, member):
+        redis_client.srem(KNOWN_MEMBERS_KEY, member)
@@ -0,0 +1,271 @@
+"""OpenAI Batch API execution mode for metadata extraction.
+
+With ``METADATA_MODE=batch`` image contexts are queued in Redis instead of
+calling GPT inline. ``submit_pending_batch`` turns the queue into a JSONL
+file of chat-completion requests and submits it to the Batch API, and
+``collect_finished_batches`` downloads the results of finished batches so
+they can be fed back into the embedding/store stages.
+
+An image is downloaded from the site once: when it is queued its original
+is uploaded to storage and only its context (with the stored URL) goes into
+Redis, so the queue costs a few hundred bytes per image however long the
+backlog gets. ``submit_pending_batch`` reads the stored copies back and
+builds the request lines (with the downscaled vision image) while writing
+the JSONL. Storing the result doesn't need the bytes at all.
+
+Each URL appears in a file at most once, since the Batch API rejects a
+file with duplicate ``custom_id``s. Requests the Batch API reports as
+failed, in the output or the error file, fail their lease straight away
+and drop the upload; a reply that isn't JSON counts as "no metadata", as in
+sync mode, and the image is finished with.
+
+Point ``OPENAI_BASE_URL`` at ``openai_batch_stub.py`` to run the whole loop
+against a local stand-in server; ``tests/test_metadata_batch.py`` does that
+in-process.
+"""
+import os
+import json
+import hashlib
+import tempfile
+import logging
+
+from .openai_client import (
+    client, build_vision_messages, parse_metadata_response, metadata_cache_key, METADATA_MODEL
+)
+from .redis_client import redis_client
+from .supabase_client import upload_image_to_supabase, download_uploaded_image, delete_uploaded_image
+from .exceptions import StorageError
+from . import image_leases
+
+logger = logging.getLogger(__name__)
+
+METADATA_MODE = os.environ.get("METADATA_MODE", "sync")
+OPENAI_BATCH_MAX_REQUESTS = int(os.environ.get("OPENAI_BATCH_MAX_REQUESTS", "1000"))
+# The Batch API rejects input files over 200 MB; stay clear of the limit.
+OPENAI_BATCH_MAX_BYTES = int(os.environ.get("OPENAI_BATCH_MAX_BYTES", str(190 * 1024 * 1024)))
+# Image leases are held across the Batch API's 24h completion window.
+OPENAI_BATCH_LEASE_SECONDS = int(os.environ.get("OPENAI_BATCH_LEASE_SECONDS", str(26 * 3600)))
+
+BATCH_QUEUE_KEY = "openai_batch:queue"
+ACTIVE_BATCHES_KEY = "openai_batch:active"
+BATCH_ITEMS_PREFIX = "openai_batch:items:"
+
+FAILED_STATUSES = {"failed", "expired", "cancelled"}
+
+
+def is_batch_mode():
+    return METADATA_MODE == "batch"
+
+
+def queue_for_batch(image_context, image_bytes, image_hash=None):
+    """Upload the image and queue its context for the next batch.
+
+    Raises ``StorageError`` if the upload fails, so the caller retries the
+    image instead of deferring it.
+    """
+    image_url = image_context["image_url"]
+    stored_image_url = upload_image_to_supabase(image_url, image_bytes)
+    if not stored_image_url:
+        raise StorageError(f"Upload to Supabase failed for: {image_url}")
+    image_context = {
+        **image_context,
+        "stored_image_url": stored_image_url,
+        "image_hash": image_hash,
+        "metadata_cache_key": metadata_cache_key(image_bytes),
+    }
+    redis_client.rpush(BATCH_QUEUE_KEY, json.dumps({"context": image_context}))
+
+
+def _fail(image_context):
+    """Give up on a batched request: drop its upload and fail its lease."""
+    if image_context.get("stored_image_url"):
+        delete_uploaded_image(image_context["stored_image_url"])
+    if image_context.get("lease_token"):
+        image_leases.fail(image_context["image_url"], image_context["lease_token"])
+
+
+def _finish_empty(image_context):
+    """The model answered without metadata: drop the upload and release the image for good."""
+    if image_context.get("stored_image_url"):
+        delete_uploaded_image(image_context["stored_image_url"])
+    if image_context.get("lease_token"):
+        image_leases.commit(image_context["image_url"], image_context["lease_token"])
+
+
+def _custom_id(image_url):
+    return hashlib.sha1(image_url.encode()).hexdigest()
+
+
+def build_batch_line(image_context, image_bytes):
+    return json.dumps({
+        "custom_id": _custom_id(image_context["image_url"]),
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {
+            "model": METADATA_MODEL,
+            "messages": build_vision_messages(image_context, image_bytes),
+            "max_tokens": 800
+        }
+    })
+
+
+def _request_line(entry):
+    """The JSONL line for a queue entry, or None when it can't be built (the entry is failed)."""
+    image_context = entry.get("context")
+    if image_context is None:
+        # Queued as a bare context by an older release: start it over
+        logger.info(f"[BATCH API] Re-running legacy queue entry for {entry['image_url']}")
+        _fail(entry)
+        return None
+    if "line" in entry:
+        # Queued with its line already built by an older release
+        return entry["line"]
+    try:
+        image_bytes = download_uploaded_image(image_context["stored_image_url"])
+    except Exception as e:
+        logger.warning(f"[BATCH API] Could not read back {image_context['stored_image_url']}: {e}")
+        image_bytes = None
+    if not image_bytes:
+        _fail(image_context)
+        return None
+    return build_batch_line(image_context, image_bytes)
+
+
+def submit_pending_batch(max_requests=OPENAI_BATCH_MAX_REQUESTS, max_bytes=OPENAI_BATCH_MAX_BYTES):
+    """Submit up to ``max_requests`` queued requests, at most ``max_bytes`` of JSONL, as one batch.
+
+    The JSONL is staged in a temporary file as the lines are built.
+    Requests that don't fit go back to the head of the queue for the next
+    batch. Returns the batch id, or None if nothing was queued.
+    """
+    raw_entries = redis_client.lpop(BATCH_QUEUE_KEY, max_requests) or []
+    if not raw_entries:
+        return None
+
+    submitted = []
+    items = {}
+    size = 0
+    with tempfile.TemporaryFile() as payload:
+        for n, raw in enumerate(raw_entries):
+            entry = json.loads(raw)
+            image_context = entry.get("context") or entry
+            custom_id = _custom_id(image_context["image_url"])
+            if custom_id in items:
+                # Same URL queued twice: one request answers both
+                logger.info(f"[BATCH API] Dropping duplicate request for {image_context['image_url']}")
+                stored_image_url = image_context.get("stored_image_url")
+                if stored_image_url and stored_image_url != json.loads(items[custom_id]).get("stored_image_url"):
+                    delete_uploaded_image(stored_image_url)
+                continue
+            line = _request_line(entry)
+            if line is None:
+                continue
+            line = line.encode("utf-8") + b"\n"
+            if submitted and size + len(line) > max_bytes:
+                redis_client.lpush(BATCH_QUEUE_KEY, *reversed(raw_entries[n:]))
+                break
+            payload.write(line)
+            size += len(line)
+            submitted.append(raw)
+            items[custom_id] = json.dumps(image_context)
+
+        if not submitted:
+            return None
+
+        try:
+            payload.seek(0)
+            input_file = client.files.create(file=("metadata_batch.jsonl", payload), purpose="batch")
+            batch = client.batches.create(
+                input_file_id=input_file.id,
+                endpoint="/v1/chat/completions",
+                completion_window="24h"
+            )
+        except Exception:
+            # Put back only what was submitted; failed and duplicate entries are already dealt with
+            redis_client.lpush(BATCH_QUEUE_KEY, *reversed(submitted))
+            raise
+
+    pipe = redis_client.pipeline()
+    pipe.hset(BATCH_ITEMS_PREFIX + batch.id, mapping=items)
+    pipe.sadd(ACTIVE_BATCHES_KEY, batch.id)
+    pipe.execute()
+    logger.info(f"[BATCH API] Submitted {batch.id} with {len(submitted)} requests ({size} bytes)")
+    return batch.id
+
+
+def _parse_output(output_text, items):
+    """Return the ``(image_context, metadata)`` pairs of the requests that got an answer.
+
+    ``metadata`` is None when the answer wasn't JSON, which
+    ``parse_metadata_response`` treats as "no metadata" rather than an error.
+    """
+    results = []
+    for line in output_text.splitlines():
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        raw_context = items.get(record.get("custom_id"))
+        if not raw_context:
+            continue
+        image_context = json.loads(raw_context)
+
+        response = record.get("response") or {}
+        if record.get("error") or response.get("status_code") != 200:
+            logger.warning(f"[BATCH API] Request failed for {image_context['image_url']}: {record.get('error')}")
+            continue
+
+        try:
+            content = response["body"]["choices"][0]["message"]["content"]
+            metadata = parse_metadata_response(content, image_context["image_url"])
+        except Exception as e:
+            logger.warning(f"[BATCH API] Bad response for {image_context['image_url']}: {e}")
+            continue
+        results.append((image_context, metadata))
+    return results
+
+
+def collect_finished_batches():
+    """Return ``(image_context, metadata)`` pairs from every finished batch.
+
+    Both the output and the error file are read, also for failed, expired
+    or cancelled batches (which can have partial output). Every request
+    without usable metadata has its lease failed and its upload dropped.
+    """
+    results = []
+    for batch_id in redis_client.smembers(ACTIVE_BATCHES_KEY):
+        try:
+            batch = client.batches.retrieve(batch_id)
+        except Exception as e:
+            logger.warning(f"[BATCH API] Could not poll {batch_id}: {e}")
+            continue
+
+        if batch.status != "completed" and batch.status not in FAILED_STATUSES:
+            continue
+        # Claim the batch so concurrent pollers don't fan it out twice.
+        if redis_client.srem(ACTIVE_BATCHES_KEY, batch_id) == 0:
+            continue
+
+        items_key = BATCH_ITEMS_PREFIX + batch_id
+        items = redis_client.hgetall(items_key)
+        try:
+            batch_results = []
+            for file_id in (batch.output_file_id, batch.error_file_id):
+                if file_id:
+                    batch_results.extend(_parse_output(client.files.content(file_id).text, items))
+        except Exception as e:
+            logger.warning(f"[BATCH API] Could not collect {batch_id}: {e}")
+            redis_client.sadd(ACTIVE_BATCHES_KEY, batch_id)
+            continue
+
+        answered = {_custom_id(image_context["image_url"]) for image_context, _ in batch_results}
+        unanswered = [json.loads(raw) for custom_id, raw in items.items() if custom_id not in answered]
+        for image_context in unanswered:
+            _fail(image_context)
+        empty = [image_context for image_context, metadata in batch_results if not metadata]
+        for image_context in empty:
+            _finish_empty(image_context)
+        results.extend((image_context, metadata) for image_context, metadata in batch_results if metadata)
+        redis_client.delete(items_key)
+        logger.info(f"[BATCH API] {batch_id} {batch.status}: {len(batch_results) - len(empty)} results, "
+                    f"{len(empty)} without metadata, {len(unanswered)} failed")
+    return results
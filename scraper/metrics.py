@@ -0,0 +1,36 @@
+"""Best-effort counters kept in the Redis ``metrics`` hash.
+
+Read them with ``HGETALL metrics``; a failed increment never fails the caller.
+Coroutines use ``incr_async``, which hands the write to the loop's executor
+instead of blocking the loop on Redis.
+"""
+import asyncio
+import logging
+
+from .redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+METRICS_KEY = "metrics"
+
+
+def incr(name, amount=1):
+    try:
+        redis_client.hincrby(METRICS_KEY, name, int(amount))
+    except Exception as e:
+        logger.debug(f"[METRICS] Could not record {name}: {e}")
+
+
+def incr_async(name, amount=1):
+    """``incr`` from a coroutine: fire-and-forget on the running loop's executor."""
+    asyncio.get_running_loop().run_in_executor(None, incr, name, amount)
+
+
+def incr_many(counters):
+    try:
+        pipe = redis_client.pipeline()
+        for name, amount in counters.items():
+            pipe.hincrby(METRICS_KEY, name, int(amount))
+        pipe.execute()
+    except Exception as e:
+        logger.debug(f"[METRICS] Could not record {', '.join(counters)}: {e}")
@@ -1,13 +1,28 @@
 import os
 import json
-import time
 import base64
 import logging
+import asyncio
 import mimetypes
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
+from .embedding_batcher import get_embedding_batcher, EMBEDDING_TIMEOUT
+from . import llm_cache
+from .image_preprocess import prepare_vision_image
+from . import openai_governor
+from .openai_governor import OpenAIBusy
+from .exceptions import MetadataGenerationError
 
 logger = logging.getLogger(__name__)
 client = OpenAI(api_key=os.environ["OPENAI_API_KEY"])
+# Metadata calls are paced and retried by openai_governor, not by the SDK.
+governed_client = client.with_options(max_retries=0)
+
+METADATA_MODEL = "gpt-4-turbo"
+METADATA_MAX_TOKENS = 800
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# Bump whenever build_prompt changes so cached metadata from the old prompt is ignored.
+PROMPT_VERSION = "1"
 
 
 def build_prompt(image_context):
@@ -69,8 +84,8 @@ Double-check carefully BEFORE responding:
 """
 
 
-def image_bytes_to_data_url(image_bytes, original_url):
-    mime_type = mimetypes.guess_type(original_url)[0] or "image/jpeg"
+def image_bytes_to_data_url(image_bytes, original_url, mime_type=None):
+    mime_type = mime_type or mimetypes.guess_type(original_url)[0] or "image/jpeg"
     base64_data = base64.b64encode(image_bytes).decode("utf-8")
     return f"data:{mime_type};base64,{base64_data}"
 
@@ -91,44 +106,159 @@ def is_meaningful_metadata(metadata: dict) -> bool:
     return has_value(metadata)
 
 
-def generate_gpt_structured_metadata_sync(image_context, image_bytes, retries=3, timeout=60):
+def build_vision_messages(image_context, image_bytes):
+    prompt = build_prompt(image_context)
+    vision_bytes, mime_type, detail = prepare_vision_image(image_bytes)
+    data_url = image_bytes_to_data_url(vision_bytes, image_context["image_url"], mime_type)
+    return [
+        {
+            "role": "user",
+            "content": [
+                {"type": "image_url", "image_url": {"url": data_url, "detail": detail}},
+                {"type": "text", "text": prompt}
+            ]
+        }
+    ]
+
+
+def parse_metadata_response(structured_metadata, image_url):
+    if not structured_metadata or not structured_metadata.strip().startswith("{"):
+        logger.warning(f"[SKIP] GPT returned non-JSON content for: {image_url}")
+        return None
+
+    logger.info(f"[✅ GPT] Metadata success for: {image_url}")
+    return json.loads(structured_metadata)
+
+
+def metadata_cache_key(image_bytes):
+    return llm_cache.cache_key(image_bytes, PROMPT_VERSION, METADATA_MODEL)
+
+
+def get_cached_metadata(image_bytes):
+    return llm_cache.get(metadata_cache_key(image_bytes))
+
+
+def cache_metadata(image_bytes, metadata):
+    llm_cache.put(metadata_cache_key(image_bytes), metadata)
+
+
+def create_async_client():
+    """Governed ``AsyncOpenAI`` for one event loop.
+
+    Its connection pool is bound to the loop it is first used on, so each
+    ``asyncio.run()`` creates its own and closes it (``async with``) on the
+    way out instead of sharing a module-level client across loops.
+    """
+    return AsyncOpenAI(api_key=os.environ["OPENAI_API_KEY"], max_retries=0)
+
+
+def create_metadata_completion(messages, timeout=60, max_wait=openai_governor.OPENAI_MAX_WAIT_SECONDS):
+    """One governed chat completion. Raises ``OpenAIBusy`` when no slot frees up within ``max_wait``."""
+    tokens = openai_governor.estimate_tokens(messages, METADATA_MAX_TOKENS)
+    with openai_governor.slot(METADATA_MODEL, tokens, max_wait) as lease:
+        raw = governed_client.chat.completions.with_raw_response.create(
+            model=METADATA_MODEL,
+            messages=messages,
+            max_tokens=METADATA_MAX_TOKENS,
+            timeout=timeout
+        )
+        lease.observe(raw.headers)
+        return raw.parse()
+
+
+async def create_metadata_completion_async(async_client, messages, timeout=60, max_wait=openai_governor.OPENAI_MAX_WAIT_SECONDS):
+    tokens = openai_governor.estimate_tokens(messages, METADATA_MAX_TOKENS)
+    async with openai_governor.slot_async(METADATA_MODEL, tokens, max_wait) as lease:
+        raw = await async_client.chat.completions.with_raw_response.create(
+            model=METADATA_MODEL,
+            messages=messages,
+            max_tokens=METADATA_MAX_TOKENS,
+            timeout=timeout
+        )
+        lease.observe(raw.headers)
+        return raw.parse()
+
+
+def generate_gpt_structured_metadata_sync(image_context, image_bytes, retries=3, timeout=60,
+                                          max_wait=openai_governor.OPENAI_MAX_WAIT_SECONDS):
+    """Structured metadata for one image, or None.
+
+    Retries go back through the governor rather than sleeping; if it has no
+    slot within ``max_wait`` ``OpenAIBusy`` is raised for the task to defer.
+    If every attempt errors, ``MetadataGenerationError`` is raised so the
+    image is retried instead of being treated as having no metadata.
+    """
     try:
-        prompt = build_prompt(image_context)
-        data_url = image_bytes_to_data_url(image_bytes, image_context["image_url"])
+        cached = get_cached_metadata(image_bytes)
+        if cached is not None:
+            logger.info(f"[LLM CACHE] Hit for: {image_context['image_url']}")
+            return cached
+
+        messages = build_vision_messages(image_context, image_bytes)
+        last_error = None
 
         for attempt in range(1, retries + 1):
             try:
-                response = client.chat.completions.create(
-                    model="gpt-4-turbo",
-                    messages=[
-                        {
-                            "role": "user",
-                            "content": [
-                                {"type": "image_url", "image_url": {"url": data_url}},
-                                {"type": "text", "text": prompt}
-                            ]
-                        }
-                    ],
-                    max_tokens=800,
-                    timeout=timeout
-                )
-
-                structured_metadata = response.choices[0].message.content
-                
-                if not structured_metadata.strip().startswith("{"):
-                    logger.warning(f"[SKIP] GPT returned non-JSON content for: {image_context['image_url']}")
-                    return None
-                    
-                logger.info(f"[✅ GPT] Metadata success for: {image_context['image_url']}")
-                return json.loads(structured_metadata)
+                response = create_metadata_completion(messages, timeout, max_wait)
+
+                metadata = parse_metadata_response(response.choices[0].message.content, image_context["image_url"])
+                if metadata:
+                    cache_metadata(image_bytes, metadata)
+                return metadata
 
+            except OpenAIBusy:
+                raise
             except Exception as e:
                 logger.warning(f"[RETRY {attempt}/{retries}] GPT error for image {image_context['image_url']}: {str(e)}")
-                if attempt < retries:
-                    time.sleep(attempt * 2)
-                    continue
-                break
+                last_error = e
+
+        raise MetadataGenerationError(f"GPT failed {retries} times for {image_context['image_url']}") from last_error
 
+    except (OpenAIBusy, MetadataGenerationError):
+        raise
+    except Exception as e:
+        logger.error(f"[❌ GPT ERROR] {str(e)} for image: {image_context['image_url']}")
+
+    return None
+
+
+async def generate_gpt_structured_metadata_async(async_client, image_context, image_bytes, retries=3, timeout=60,
+                                                 max_wait=openai_governor.OPENAI_MAX_WAIT_SECONDS):
+    """Async twin of generate_gpt_structured_metadata_sync for the batch pipeline.
+
+    ``async_client`` comes from ``create_async_client`` on the calling loop.
+    ``OpenAIBusy`` surfaces to ``run_image_batch``, which hands the image back
+    to the task to defer rather than holding the batch open.
+    """
+    try:
+        cached = await asyncio.to_thread(get_cached_metadata, image_bytes)
+        if cached is not None:
+            logger.info(f"[LLM CACHE] Hit for: {image_context['image_url']}")
+            return cached
+
+        # Re-encodes the image and records its byte metrics: keep both off the loop
+        messages = await asyncio.to_thread(build_vision_messages, image_context, image_bytes)
+        last_error = None
+
+        for attempt in range(1, retries + 1):
+            try:
+                response = await create_metadata_completion_async(async_client, messages, timeout, max_wait)
+
+                metadata = parse_metadata_response(response.choices[0].message.content, image_context["image_url"])
+                if metadata:
+                    await asyncio.to_thread(cache_metadata, image_bytes, metadata)
+                return metadata
+
+            except OpenAIBusy:
+                raise
+            except Exception as e:
+                logger.warning(f"[RETRY {attempt}/{retries}] GPT error for image {image_context['image_url']}: {str(e)}")
+                last_error = e
+
+        raise MetadataGenerationError(f"GPT failed {retries} times for {image_context['image_url']}") from last_error
+
+    except (OpenAIBusy, MetadataGenerationError):
+        raise
     except Exception as e:
         logger.error(f"[❌ GPT ERROR] {str(e)} for image: {image_context['image_url']}")
 
@@ -176,11 +306,20 @@ def generate_embedding_from_text(text: str):
         return None
 
     try:
-        response = client.embeddings.create(
-            input=text,
-            model="text-embedding-3-small"
-        )
-        return response.data[0].embedding
+        return get_embedding_batcher(client, EMBEDDING_MODEL).embed(text)
+    except Exception as e:
+        logger.error(f"[❌ EMBEDDING ERROR] Failed to generate embedding: {e}")
+        return None
+
+
+async def generate_embedding_from_text_async(text: str):
+    if not text:
+        return None
+
+    try:
+        future = get_embedding_batcher(client, EMBEDDING_MODEL).submit(text)
+        # On timeout the cancellation reaches the batcher's future, dropping it if still queued
+        return await asyncio.wait_for(asyncio.wrap_future(future), EMBEDDING_TIMEOUT)
     except Exception as e:
         logger.error(f"[❌ EMBEDDING ERROR] Failed to generate embedding: {e}")
         return None
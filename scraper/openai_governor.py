@@ -0,0 +1,365 @@
+"""Cluster-wide pacing for OpenAI chat completions.
+
+Every metadata call takes a slot from a governor shared by all workers
+through Redis, one per model:
+
+* ``openai_governor:{model}`` keeps the organisation's remaining request and
+  token budget as OpenAI last reported it (``x-ratelimit-remaining-*`` and
+  ``x-ratelimit-reset-*``), the current concurrency window, and how long
+  calls are blocked after a 429.
+* ``openai_governor:{model}:leases`` holds the calls in flight. A lease
+  belonging to a crashed caller expires after ``OPENAI_LEASE_SECONDS``.
+
+Taking a slot is a single Lua call. It either reserves one request plus the
+call's estimated tokens, or says how long to wait. A little of each budget
+(``OPENAI_BUDGET_HEADROOM``) is never spent, which leaves room for calls
+that aren't governed, such as embeddings.
+
+Concurrency follows AIMD. Each successful call adds 1/window, so a full
+window of successes adds one slot, up to ``OPENAI_MAX_CONCURRENCY``. A 429
+halves the window and blocks everyone until ``retry-after``. Timeouts,
+connection errors and 5xx responses halve it without blocking. Only calls
+granted since the last decrease can halve the window again, so one burst of
+failures halves it once.
+
+Callers wait for a slot in-process for at most ``max_wait`` seconds. Longer
+waits raise ``OpenAIBusy``, and Celery tasks then retry with
+``OpenAIBusy.countdown`` instead of sleeping in a worker slot. While the
+window is full, callers poll with exponential backoff (``OPENAI_POLL_SECONDS``
+doubling up to ``OPENAI_POLL_MAX_SECONDS``, jittered). The asyncio variants
+run their Redis calls on a worker thread so the loop is never blocked.
+"""
+import os
+import re
+import time
+import math
+import uuid
+import random
+import asyncio
+import logging
+from contextlib import contextmanager, asynccontextmanager
+
+import openai
+
+from .redis_client import redis_client
+from .rate_limiter import parse_retry_after
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+OPENAI_INITIAL_CONCURRENCY = float(os.environ.get("OPENAI_INITIAL_CONCURRENCY", "8"))
+OPENAI_MIN_CONCURRENCY = float(os.environ.get("OPENAI_MIN_CONCURRENCY", "1"))
+OPENAI_MAX_CONCURRENCY = float(os.environ.get("OPENAI_MAX_CONCURRENCY", "64"))
+OPENAI_BUDGET_HEADROOM = float(os.environ.get("OPENAI_BUDGET_HEADROOM", "0.05"))
+OPENAI_LEASE_SECONDS = float(os.environ.get("OPENAI_LEASE_SECONDS", "180"))
+OPENAI_BACKOFF_SECONDS = float(os.environ.get("OPENAI_BACKOFF_SECONDS", "5"))
+# Longest a Celery task (including each image of a batch) waits inline for a slot before deferring itself.
+OPENAI_MAX_WAIT_SECONDS = float(os.environ.get("OPENAI_MAX_WAIT_SECONDS", "2"))
+# Longest the standalone scraper queues for a slot.
+OPENAI_MAX_QUEUE_SECONDS = float(os.environ.get("OPENAI_MAX_QUEUE_SECONDS", "60"))
+OPENAI_DEFER_SECONDS = float(os.environ.get("OPENAI_DEFER_SECONDS", "15"))
+OPENAI_POLL_SECONDS = 0.25
+OPENAI_POLL_MAX_SECONDS = float(os.environ.get("OPENAI_POLL_MAX_SECONDS", "2"))
+
+# Rough vision-input costs, used only to reserve budget before the call.
+IMAGE_TOKENS = {"low": 85, "high": 765, "auto": 765}
+
+# KEYS[1] = budget hash, KEYS[2] = lease zset.
+# ARGV: now, lease id, lease expiry, tokens, initial concurrency, headroom, poll.
+# Returns 0 when the slot was taken, otherwise the seconds to wait.
+_ACQUIRE = redis_client.register_script("""
+local now, lease, expires = tonumber(ARGV[1]), ARGV[2], tonumber(ARGV[3])
+local cost, initial = tonumber(ARGV[4]), tonumber(ARGV[5])
+local headroom, poll = tonumber(ARGV[6]), tonumber(ARGV[7])
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now)
+local b = redis.call('HMGET', KEYS[1], 'concurrency', 'until',
+                     'req_left', 'req_limit', 'req_reset', 'tok_left', 'tok_limit', 'tok_reset')
+local concurrency = tonumber(b[1]) or initial
+local blocked_until = tonumber(b[2]) or 0
+local req_left, req_limit, req_reset = tonumber(b[3]), tonumber(b[4]), tonumber(b[5]) or 0
+local tok_left, tok_limit, tok_reset = tonumber(b[6]), tonumber(b[7]), tonumber(b[8]) or 0
+if now < blocked_until then
+    return tostring(blocked_until - now)
+end
+-- Past the reset the budget is unknown until the next response reports it
+if req_left and now >= req_reset then
+    req_left = nil
+    redis.call('HDEL', KEYS[1], 'req_left')
+end
+if tok_left and now >= tok_reset then
+    tok_left = nil
+    redis.call('HDEL', KEYS[1], 'tok_left')
+end
+if req_left and req_limit and req_left - 1 < req_limit * headroom then
+    return tostring(math.max(poll, req_reset - now))
+end
+if tok_left and tok_limit and tok_left - cost < tok_limit * headroom then
+    return tostring(math.max(poll, tok_reset - now))
+end
+if redis.call('ZCARD', KEYS[2]) >= math.floor(concurrency) then
+    return tostring(poll)
+end
+redis.call('ZADD', KEYS[2], expires, lease)
+if req_left then
+    redis.call('HSET', KEYS[1], 'req_left', req_left - 1)
+end
+if tok_left then
+    redis.call('HSET', KEYS[1], 'tok_left', tok_left - cost)
+end
+redis.call('HSET', KEYS[1], 'concurrency', concurrency)
+redis.call('EXPIRE', KEYS[1], 3600)
+redis.call('EXPIRE', KEYS[2], 3600)
+return '0'
+""")
+
+# KEYS[1] = budget hash, KEYS[2] = lease zset.
+# ARGV: now, lease id, granted at, outcome, retry after, initial, min, max concurrency,
+#       then req left, req limit, req reset, tok left, tok limit, tok reset ('' when absent).
+# Returns the new concurrency window.
+_RELEASE = redis_client.register_script("""
+local now, lease, granted_at, outcome = tonumber(ARGV[1]), ARGV[2], tonumber(ARGV[3]), ARGV[4]
+local retry_after, initial = tonumber(ARGV[5]), tonumber(ARGV[6])
+local min_c, max_c = tonumber(ARGV[7]), tonumber(ARGV[8])
+redis.call('ZREM', KEYS[2], lease)
+local b = redis.call('HMGET', KEYS[1], 'concurrency', 'decreased_at', 'until')
+local concurrency = tonumber(b[1]) or initial
+local decreased_at = tonumber(b[2]) or 0
+local blocked_until = tonumber(b[3]) or 0
+if outcome == 'ok' then
+    concurrency = math.min(max_c, concurrency + 1 / math.max(1, concurrency))
+elseif (outcome == 'throttled' or outcome == 'error') and granted_at >= decreased_at then
+    concurrency = math.max(min_c, concurrency / 2)
+    redis.call('HSET', KEYS[1], 'decreased_at', now)
+end
+if outcome == 'throttled' then
+    redis.call('HSET', KEYS[1], 'until', math.max(blocked_until, now + retry_after))
+end
+local fields = {'req_left', 'req_limit', 'req_reset', 'tok_left', 'tok_limit', 'tok_reset'}
+for i, field in ipairs(fields) do
+    local value = tonumber(ARGV[8 + i])
+    if value then
+        if field == 'req_reset' or field == 'tok_reset' then
+            value = now + value
+        end
+        redis.call('HSET', KEYS[1], field, value)
+    end
+end
+redis.call('HSET', KEYS[1], 'concurrency', concurrency)
+redis.call('EXPIRE', KEYS[1], 3600)
+return tostring(concurrency)
+""")
+
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+
+
+class OpenAIBusy(Exception):
+    """No slot within ``max_wait``; retry the work after ``countdown`` seconds."""
+
+    def __init__(self, model, wait):
+        super().__init__(f"OpenAI budget for {model} not available for {wait:.1f}s")
+        self.wait = wait
+        # Jittered so deferred tasks don't all come back on the same tick
+        self.countdown = math.ceil(max(wait, OPENAI_DEFER_SECONDS) * random.uniform(1.0, 1.2))
+
+
+def parse_reset(value):
+    """Seconds from an ``x-ratelimit-reset-*`` header (``"1s"``, ``"6m0s"``, ``"20ms"``)."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    parts = _DURATION.findall(value)
+    if not parts:
+        return None
+    scale = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(amount) * scale[unit] for amount, unit in parts)
+
+
+def _header_int(headers, name):
+    try:
+        return int(headers.get(name))
+    except (TypeError, ValueError):
+        return None
+
+
+def budget_from_headers(headers):
+    """``[req left, req limit, req reset, tok left, tok limit, tok reset]`` (None when absent)."""
+    headers = headers or {}
+    return [
+        _header_int(headers, "x-ratelimit-remaining-requests"),
+        _header_int(headers, "x-ratelimit-limit-requests"),
+        parse_reset(headers.get("x-ratelimit-reset-requests")),
+        _header_int(headers, "x-ratelimit-remaining-tokens"),
+        _header_int(headers, "x-ratelimit-limit-tokens"),
+        parse_reset(headers.get("x-ratelimit-reset-tokens")),
+    ]
+
+
+def retry_after_from_headers(headers):
+    headers = headers or {}
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return max(0.0, float(retry_after_ms) / 1000)
+        except ValueError:
+            pass
+    return parse_retry_after(headers.get("retry-after"))
+
+
+def estimate_tokens(messages, max_tokens):
+    """Tokens OpenAI will count against TPM for this call: prompt estimate plus ``max_tokens``."""
+    tokens = max_tokens
+    for message in messages:
+        content = message["content"]
+        parts = [{"type": "text", "text": content}] if isinstance(content, str) else content
+        for part in parts:
+            if part["type"] == "text":
+                tokens += len(part["text"]) // 4
+            elif part["type"] == "image_url":
+                tokens += IMAGE_TOKENS.get(part["image_url"].get("detail", "auto"), IMAGE_TOKENS["auto"])
+        tokens += 4
+    return tokens
+
+
+class Lease:
+    """One granted slot. Report how the call went before it is released."""
+
+    def __init__(self, model, tokens):
+        self.model = model
+        self.tokens = tokens
+        self.lease_id = uuid.uuid4().hex
+        self.granted_at = None
+        self.outcome = "neutral"
+        self.retry_after = None
+        self.headers = None
+
+    def observe(self, headers):
+        """Record a successful response and its rate-limit headers."""
+        self.outcome = "ok"
+        self.headers = headers
+
+    def failed(self, exc):
+        """Classify an exception raised by the call."""
+        response = getattr(exc, "response", None)
+        self.headers = getattr(response, "headers", None)
+        if isinstance(exc, openai.RateLimitError):
+            self.outcome = "throttled"
+            self.retry_after = retry_after_from_headers(self.headers)
+        elif isinstance(exc, (openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError)):
+            self.outcome = "error"
+        else:
+            self.outcome = "neutral"
+
+
+def _keys(model):
+    return [f"openai_governor:{model}", f"openai_governor:{model}:leases"]
+
+
+def _try_acquire(lease):
+    now = time.time()
+    wait = _ACQUIRE(
+        keys=_keys(lease.model),
+        args=[now, lease.lease_id, now + OPENAI_LEASE_SECONDS, lease.tokens,
+              OPENAI_INITIAL_CONCURRENCY, OPENAI_BUDGET_HEADROOM, OPENAI_POLL_SECONDS]
+    )
+    wait = float(wait)
+    if wait <= 0:
+        lease.granted_at = now
+    return wait
+
+
+def release(lease):
+    budget = ["" if value is None else value for value in budget_from_headers(lease.headers)]
+    retry_after = lease.retry_after if lease.retry_after is not None else OPENAI_BACKOFF_SECONDS
+    concurrency = _RELEASE(
+        keys=_keys(lease.model),
+        args=[time.time(), lease.lease_id, lease.granted_at, lease.outcome, retry_after,
+              OPENAI_INITIAL_CONCURRENCY, OPENAI_MIN_CONCURRENCY, OPENAI_MAX_CONCURRENCY, *budget]
+    )
+    if lease.outcome == "throttled":
+        metrics.incr("openai_throttled")
+        logger.warning(f"[OPENAI] 429 from {lease.model}; blocking {retry_after:.1f}s, "
+                       f"concurrency now {float(concurrency):.1f}")
+    elif lease.outcome == "error":
+        metrics.incr("openai_errors")
+
+
+def _next_delay(deadline, wait, attempt):
+    """Seconds to sleep before trying again, or None if ``wait`` overruns ``deadline``.
+
+    A full concurrency window only says "poll", so repeated polls back off
+    exponentially instead of every waiter hitting Redis each
+    ``OPENAI_POLL_SECONDS``. Longer waits (budget resets, 429 blocks) are
+    taken as given.
+    """
+    now = time.monotonic()
+    if now + wait > deadline:
+        return None
+    if wait <= OPENAI_POLL_SECONDS:
+        wait = min(OPENAI_POLL_MAX_SECONDS, OPENAI_POLL_SECONDS * 2 ** attempt) * random.uniform(0.5, 1.0)
+    return max(0.0, min(wait, deadline - now))
+
+
+def acquire(model, tokens, max_wait=OPENAI_MAX_WAIT_SECONDS):
+    """Block up to ``max_wait`` for a slot; raises ``OpenAIBusy`` past that."""
+    lease = Lease(model, tokens)
+    deadline = time.monotonic() + max_wait
+    attempt = 0
+    while True:
+        wait = _try_acquire(lease)
+        if wait <= 0:
+            if attempt:
+                metrics.incr("openai_waits")
+            return lease
+        delay = _next_delay(deadline, wait, attempt)
+        if delay is None:
+            metrics.incr("openai_deferred")
+            raise OpenAIBusy(lease.model, wait)
+        time.sleep(delay)
+        attempt += 1
+
+
+async def acquire_async(model, tokens, max_wait=OPENAI_MAX_WAIT_SECONDS):
+    """``acquire`` for asyncio code: Redis calls (metrics included) run on a thread, waits use ``asyncio.sleep``."""
+    lease = Lease(model, tokens)
+    deadline = time.monotonic() + max_wait
+    attempt = 0
+    while True:
+        wait = await asyncio.to_thread(_try_acquire, lease)
+        if wait <= 0:
+            if attempt:
+                metrics.incr_async("openai_waits")
+            return lease
+        delay = _next_delay(deadline, wait, attempt)
+        if delay is None:
+            metrics.incr_async("openai_deferred")
+            raise OpenAIBusy(lease.model, wait)
+        await asyncio.sleep(delay)
+        attempt += 1
+
+
+@contextmanager
+def slot(model, tokens, max_wait=OPENAI_MAX_WAIT_SECONDS):
+    """Hold a slot around one call; exceptions raised inside are classified on release."""
+    lease = acquire(model, tokens, max_wait)
+    try:
+        yield lease
+    except Exception as e:
+        lease.failed(e)
+        raise
+    finally:
+        release(lease)
+
+
+@asynccontextmanager
+async def slot_async(model, tokens, max_wait=OPENAI_MAX_WAIT_SECONDS):
+    lease = await acquire_async(model, tokens, max_wait)
+    try:
+        yield lease
+    except Exception as e:
+        lease.failed(e)
+        raise
+    finally:
+        await asyncio.to_thread(release, lease)
@@ -0,0 +1,83 @@
+"""Conditional-GET cache for listing pages.
+
+For every fetched page we remember the ``ETag`` / ``Last-Modified``
+validators, a hash of the response body and the links and images extracted
+from it. The next fetch sends ``If-None-Match`` / ``If-Modified-Since``; a
+``304`` or a body with the same hash reuses the cached sets without parsing.
+"""
+import os
+import json
+import hashlib
+import logging
+
+from .redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+PAGE_CACHE_TTL = int(os.environ.get("PAGE_CACHE_TTL", str(30 * 24 * 3600)))
+PAGE_CACHE_PREFIX = "page_cache:"
+
+
+def _key(url):
+    return PAGE_CACHE_PREFIX + hashlib.sha1(url.encode()).hexdigest()
+
+
+def hash_content(body: bytes) -> str:
+    return hashlib.sha256(body).hexdigest()
+
+
+def get(url):
+    """Return the cached entry for ``url`` or None."""
+    try:
+        entry = redis_client.hgetall(_key(url))
+    except Exception as e:
+        logger.warning(f"[CACHE] Lookup failed for {url}: {e}")
+        return None
+    if not entry:
+        return None
+    entry["urls"] = set(json.loads(entry.get("urls", "[]")))
+    entry["images"] = set(json.loads(entry.get("images", "[]")))
+    return entry
+
+
+def conditional_headers(entry):
+    headers = {}
+    if entry:
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
+
+
+def save(url, response_headers, content_hash, urls, images, previous=None):
+    """Store a page's validators and sets.
+
+    Validators missing from ``response_headers`` are taken from ``previous``,
+    if given.
+    """
+    previous = previous or {}
+    entry = {
+        "etag": response_headers.get("ETag") or previous.get("etag", ""),
+        "last_modified": response_headers.get("Last-Modified") or previous.get("last_modified", ""),
+        "content_hash": content_hash,
+        "urls": json.dumps(sorted(urls)),
+        "images": json.dumps(sorted(images)),
+    }
+    try:
+        key = _key(url)
+        pipe = redis_client.pipeline()
+        pipe.hset(key, mapping=entry)
+        pipe.expire(key, PAGE_CACHE_TTL)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"[CACHE] Save failed for {url}: {e}")
+
+
+def refresh(url, response_headers, entry):
+    """Keep the cached sets but pick up new validators and extend the TTL.
+
+    A 304 need not repeat ``ETag`` or ``Last-Modified`` (RFC 7232 4.1), so a
+    validator it leaves out keeps its cached value.
+    """
+    save(url, response_headers, entry["content_hash"], entry["urls"], entry["images"], previous=entry)
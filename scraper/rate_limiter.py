@@ -0,0 +1,197 @@
+"""Per-host token-bucket rate limiting shared by every crawl worker.
+
+Each host has one bucket in Redis (``ratelimit:{host}``), so the limit holds
+across all Celery children and machines rather than per process. A bucket
+refills at ``rate`` tokens per second up to ``burst``; taking a token is a
+single Lua call that either grants it or says how long to wait.
+
+When a host answers 429/503 (or sends ``Retry-After``) the bucket is closed
+until the retry time and its rate is halved; it refills from empty only
+once the block lifts. The rate then climbs back towards the configured
+limit by ``HOST_RATE_RECOVERY`` tokens/s every second, so the crawl
+settles just under whatever the site tolerates.
+
+``RateLimitTimeout`` means "try again later", not "this URL is bad":
+callers let it propagate to their retry or lease-failure path. Its subclass
+``HostThrottled`` is raised for a page the host refused with a throttling
+answer, after ``observe`` has recorded the back-off.
+
+Limits come from ``HOST_RATE_LIMIT`` / ``HOST_RATE_BURST``, with per-host
+overrides in ``HOST_RATE_LIMITS`` (``"sheerluxe.com=5,slman.com=20"``).
+"""
+import os
+import time
+import asyncio
+import logging
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+from .redis_client import redis_client
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+HOST_RATE_LIMIT = float(os.environ.get("HOST_RATE_LIMIT", "5"))
+HOST_RATE_BURST = float(os.environ.get("HOST_RATE_BURST", "10"))
+HOST_RATE_MIN = float(os.environ.get("HOST_RATE_MIN", "0.2"))
+HOST_RATE_RECOVERY = float(os.environ.get("HOST_RATE_RECOVERY", "0.05"))
+HOST_BACKOFF_SECONDS = float(os.environ.get("HOST_BACKOFF_SECONDS", "5"))
+HOST_MAX_WAIT_SECONDS = float(os.environ.get("HOST_MAX_WAIT_SECONDS", "120"))
+
+THROTTLE_STATUSES = {429, 503}
+
+
+def _parse_overrides(raw):
+    overrides = {}
+    for part in filter(None, (p.strip() for p in raw.split(","))):
+        host, _, rate = part.partition("=")
+        try:
+            overrides[host.strip().lower()] = float(rate)
+        except ValueError:
+            logger.warning(f"[RATE LIMIT] Ignoring bad HOST_RATE_LIMITS entry: {part}")
+    return overrides
+
+
+HOST_RATE_LIMITS = _parse_overrides(os.environ.get("HOST_RATE_LIMITS", ""))
+
+# KEYS[1] = bucket. ARGV: max rate, burst, min rate, recovery, now, cost.
+# Returns 0 when the tokens were taken, otherwise the seconds to wait.
+_ACQUIRE = redis_client.register_script("""
+local max_rate, burst, min_rate = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local recovery, now, cost = tonumber(ARGV[4]), tonumber(ARGV[5]), tonumber(ARGV[6])
+local b = redis.call('HMGET', KEYS[1], 'tokens', 'ts', 'rate', 'until')
+local tokens = tonumber(b[1]) or burst
+local ts = tonumber(b[2]) or now
+local rate = tonumber(b[3]) or max_rate
+local blocked_until = tonumber(b[4]) or 0
+-- Nothing refills while the bucket is closed, so a lifted block doesn't release a burst
+local elapsed = math.max(0, now - math.max(ts, blocked_until))
+rate = math.max(min_rate, math.min(max_rate, rate + recovery * elapsed))
+tokens = math.min(burst, tokens + elapsed * rate)
+local wait = 0
+if now < blocked_until then
+    wait = blocked_until - now
+elseif tokens >= cost then
+    tokens = tokens - cost
+else
+    wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now, 'rate', rate)
+redis.call('EXPIRE', KEYS[1], 3600)
+return tostring(wait)
+""")
+
+# KEYS[1] = bucket. ARGV: now, retry after (seconds), min rate, max rate.
+# Halves the rate, empties the bucket and closes it until the retry time.
+_BACKOFF = redis_client.register_script("""
+local now, retry_after = tonumber(ARGV[1]), tonumber(ARGV[2])
+local min_rate, max_rate = tonumber(ARGV[3]), tonumber(ARGV[4])
+local rate = tonumber(redis.call('HGET', KEYS[1], 'rate') or max_rate)
+rate = math.max(min_rate, rate / 2)
+local blocked_until = math.max(tonumber(redis.call('HGET', KEYS[1], 'until') or 0), now + retry_after)
+redis.call('HSET', KEYS[1], 'tokens', 0, 'ts', now, 'rate', rate, 'until', blocked_until)
+redis.call('EXPIRE', KEYS[1], 3600)
+return tostring(rate)
+""")
+
+
+class RateLimitTimeout(Exception):
+    pass
+
+
+class HostThrottled(RateLimitTimeout):
+    """The host answered 429/503: retry once the limiter's block has lifted."""
+
+
+def host_of(url):
+    host = (urlsplit(url).hostname or url).lower()
+    return host[4:] if host.startswith("www.") else host
+
+
+def limit_for(host):
+    return HOST_RATE_LIMITS.get(host, HOST_RATE_LIMIT)
+
+
+def _try_acquire(host, cost):
+    rate = limit_for(host)
+    wait = _ACQUIRE(
+        keys=[f"ratelimit:{host}"],
+        args=[rate, max(HOST_RATE_BURST, cost), min(HOST_RATE_MIN, rate), HOST_RATE_RECOVERY, time.time(), cost]
+    )
+    return float(wait)
+
+
+def acquire(url, cost=1, max_wait=HOST_MAX_WAIT_SECONDS):
+    """Block until ``cost`` tokens are available for ``url``'s host."""
+    host = host_of(url)
+    deadline = time.monotonic() + max_wait
+    waited = False
+    while True:
+        wait = _try_acquire(host, cost)
+        if wait <= 0:
+            if waited:
+                metrics.incr("rate_limit_waits")
+            return
+        waited = True
+        if time.monotonic() + wait > deadline:
+            raise RateLimitTimeout(f"Rate limit for {host} not available within {max_wait}s")
+        time.sleep(wait)
+
+
+async def acquire_async(url, cost=1, max_wait=HOST_MAX_WAIT_SECONDS):
+    """``acquire`` for asyncio code: Redis runs off the loop and waits use ``asyncio.sleep``."""
+    host = host_of(url)
+    deadline = time.monotonic() + max_wait
+    waited = False
+    while True:
+        wait = await asyncio.to_thread(_try_acquire, host, cost)
+        if wait <= 0:
+            if waited:
+                metrics.incr_async("rate_limit_waits")
+            return
+        waited = True
+        if time.monotonic() + wait > deadline:
+            raise RateLimitTimeout(f"Rate limit for {host} not available within {max_wait}s")
+        await asyncio.sleep(wait)
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date)."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+async def observe_async(url, status, headers=None):
+    """``observe`` for asyncio code; only touches Redis when throttled, but never on the loop."""
+    if status not in THROTTLE_STATUSES and status < 400:
+        return False
+    return await asyncio.to_thread(observe, url, status, headers)
+
+
+def observe(url, status, headers=None):
+    """Feed a response back into the limiter; backs off on throttling.
+
+    Returns True when the host throttled us.
+    """
+    retry_after = parse_retry_after((headers or {}).get("Retry-After"))
+    if status not in THROTTLE_STATUSES and (retry_after is None or status < 400):
+        return False
+
+    host = host_of(url)
+    rate = limit_for(host)
+    new_rate = _BACKOFF(
+        keys=[f"ratelimit:{host}"],
+        args=[time.time(), retry_after if retry_after is not None else HOST_BACKOFF_SECONDS,
+              min(HOST_RATE_MIN, rate), rate]
+    )
+    metrics.incr("rate_limit_throttled")
+    logger.warning(f"[RATE LIMIT] {host} returned {status}; backing off to {float(new_rate):.2f} req/s")
+    return True
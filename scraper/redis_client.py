@@ -0,0 +1,6 @@
+import os
+import redis
+
+REDIS_URL = f"rediss://:{os.environ['REDIS_PASSWORD']}@{os.environ['REDIS_HOST']}:{os.environ['REDIS_PORT']}/0?ssl_cert_reqs=none"
+
+redis_client = redis.Redis.from_url(REDIS_URL, decode_responses=True)
@@ -1,16 +1,22 @@
 import asyncio
 import aiohttp
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin
 import logging
 from typing import List, Optional, Set
 import os
 from datetime import datetime, timedelta
 import re
+from . import rate_limiter
+from .extraction import StreamingExtractor, STREAM_CHUNK_SIZE, best_image_url
 from .url_frontier import URLFrontier
+from .frontier_journal import FrontierJournal, FRONTIER_STATE_DIR
+from .discovery import discover, discover_shared, is_sitemap_mode
+from .canonical import canonicalize
+from .task_coordinator import TaskCoordinator
+from .openai_governor import OpenAIBusy
+from .exceptions import MetadataGenerationError
 from config import (
     SCRAPER_CONCURRENCY_LIMIT, SCRAPER_SEED_URLS, FASHION_SUBCATEGORIES, 
-    URL_BATCH_SIZE, SCRAPER_MAX_AGE_YEARS, SCRAPER_RATE_LIMIT
+    URL_BATCH_SIZE, SCRAPER_MAX_AGE_YEARS
 )
 from utils.openai_utils import generate_gpt_structured_metadata_sync
 from utils.db_utils import generate_embedding_sync, insert_metadata_to_supabase_sync, prepare_metadata_record
@@ -18,16 +24,43 @@ from utils.db_utils import generate_embedding_sync, insert_metadata_to_supabase_
 logger = logging.getLogger(__name__)
 
 class AsyncScraper:
-    def __init__(self, concurrency_limit: int = SCRAPER_CONCURRENCY_LIMIT):
-        self.frontier = URLFrontier()
+    def __init__(self, concurrency_limit: int = SCRAPER_CONCURRENCY_LIMIT, state_dir: Optional[str] = None):
+        # With a state_dir, resumes where an unfinished run there left off; by default in memory only
+        self.frontier = URLFrontier(journal=FrontierJournal(state_dir) if state_dir else None)
         self.sem = asyncio.Semaphore(concurrency_limit)
         self.session = None
         self.url_cache = {}  # Cache URL responses
         self.processing_tasks = set()  # Track active tasks
+        self.coordinator = None  # One per scraper; caches the routing table
+        self.sitemap_sections = set()  # Sections whose articles came from sitemaps/archives
         # Cache existing items
         from utils.db_utils import get_existing_urls_and_images
         self.existing_urls, self.existing_images = get_existing_urls_and_images()
 
+    def belongs_to_worker(self, url: str, worker_id: int = None) -> bool:
+        if worker_id is None:
+            return True
+        if self.coordinator is None:
+            self.coordinator = TaskCoordinator()
+        return self.coordinator.url_belongs_to_worker(url, worker_id)
+
+    def in_sitemap_section(self, url: str) -> bool:
+        return any(url.startswith(section) for section in self.sitemap_sections)
+
+    def discover_sections(self, sections: List[str], worker_id: int = None) -> int:
+        """Queue this worker's article URLs from sitemaps and archives. Returns how many.
+
+        With a ``worker_id`` the sitemaps are read by one worker and shared
+        with the rest (see ``discover_shared``).
+        """
+        queued = 0
+        source = discover if worker_id is None else discover_shared
+        for _, url, lastmod in source(sections, SCRAPER_MAX_AGE_YEARS, covered=self.sitemap_sections):
+            if not self.frontier.is_visited(url) and self.belongs_to_worker(url, worker_id):
+                self.frontier.add_url(url, depth=1, lastmod=lastmod)
+                queued += 1
+        return queued
+
     async def init_session(self):
         if not self.session:
             from utils.auth_utils import AuthSession
@@ -35,7 +68,7 @@ class AsyncScraper:
             self.session = await auth.create_session()
 
     async def process_single_image(self, img, image_url: str, source_url: str, context: dict):
-        if image_url in self.existing_images:
+        if canonicalize(image_url) in self.existing_images:
             return None
 
         try:
@@ -61,6 +94,8 @@ class AsyncScraper:
                 "stored_url": stored_image_url,
                 "context": context
             }
+        except (OpenAIBusy, MetadataGenerationError):
+            raise  # Not stored, so the page is retried
         except Exception as e:
             logger.error(f"Failed processing single image {image_url}: {str(e)}")
             return None
@@ -68,19 +103,42 @@ class AsyncScraper:
     async def close(self):
         if self.session:
             await self.session.close()
-
-    async def process_url(self, url: str, depth: int) -> List[str]:
-        if url in self.frontier.visited or url in self.frontier.pending:
+        self.frontier.close()
+
+    def admit_link(self, new_url: str, depth: int, priority: int):
+        """Queue a link found on a page at ``depth`` if it is crawlable and unseen."""
+        if ("sheerluxe.com/fashion" in new_url and 
+            not new_url.endswith(('.jpg', '.jpeg', '.png', '.gif'))):
+            # Check pagination
+            if "?page=" in new_url:
+                page_num = int(new_url.split("page=")[1])
+                # Allow up to page 100 to ensure we get everything
+                if page_num <= 100:
+                    if not self.frontier.is_visited(new_url):
+                        self.frontier.add_url(new_url, depth + 1, priority)
+                        logger.info(f"Added pagination URL: {new_url}")
+            # Handle regular URLs
+            elif not self.frontier.is_visited(new_url):
+                self.frontier.add_url(new_url, depth + 1, priority)
+                logger.info(f"Added new URL to queue: {new_url}")
+
+    async def process_url(self, url: str, depth: int) -> Optional[List[str]]:
+        """Crawl one page. Returns None when the host throttled us and the URL should be retried."""
+        if self.frontier.is_visited(url):
             return []
 
-        self.frontier.pending.add(url)
+        self.frontier.pending.add(canonicalize(url))
         async with self.sem:
             try:
                 if not url.startswith(('http://', 'https://')):
                     url = f'https://{url}'
 
-                # Single attempt, no retries
+                # Single attempt; throttled pages go back on the frontier
+                await rate_limiter.acquire_async(url)
                 async with self.session.get(url, timeout=10) as response:
+                    if await rate_limiter.observe_async(url, response.status, response.headers):
+                        logger.info(f"Throttled on {url} with status {response.status}, will retry")
+                        return None
                     if response.status != 200:
                         logger.info(f"Skipping failed URL {url} with status {response.status}")
                         self.frontier.mark_visited(url)  # Mark as visited to prevent retries
@@ -91,52 +149,46 @@ class AsyncScraper:
                     elif response.status != 200:
                         return []
 
-                    html = await response.text()
-                    soup = BeautifulSoup(html, "html.parser")
-
-                    # Handle year archives
-                    current_year = datetime.now().year
-                    for year in range(current_year - SCRAPER_MAX_AGE_YEARS, current_year + 1):
-                        archive_url = f"https://sheerluxe.com/fashion/archive/{year}"
-                        if archive_url not in self.frontier.visited:
-                            self.frontier.add_url(archive_url, depth + 1)
-                            logger.info(f"Added archive URL: {archive_url}")
-
-                    # Extract links for crawling
-                    links = soup.find_all("a", href=True)
-                    for link in links:
-                        new_url = urljoin(url, link["href"])
-                        if ("sheerluxe.com/fashion" in new_url and 
-                            not new_url.endswith(('.jpg', '.jpeg', '.png', '.gif'))):
-                            # Check pagination
-                            if "?page=" in new_url:
-                                page_num = int(new_url.split("page=")[1])
-                                # Allow up to page 100 to ensure we get everything
-                                if page_num <= 100:
-                                    if new_url not in self.frontier.visited:
-                                        self.frontier.add_url(new_url, depth + 1)
-                                        logger.info(f"Added pagination URL: {new_url}")
-                            # Handle regular URLs
-                            elif new_url not in self.frontier.visited:
-                                self.frontier.add_url(new_url, depth + 1)
-                                logger.info(f"Added new URL to queue: {new_url}")
+                    # Sections covered by sitemaps/archives are not link-crawled
+                    follow_links = not self.in_sitemap_section(url)
+
+                    # Parse while the body downloads; stops at the size cap or after the content region.
+                    # Links go on the frontier as soon as their tag is parsed, ranked by the images seen so far
+                    extractor = StreamingExtractor(url, encoding=response.charset)
+                    async for chunk in response.content.iter_chunked(STREAM_CHUNK_SIZE):
+                        for kind, value in extractor.feed(chunk):
+                            if kind == "link" and follow_links:
+                                self.admit_link(value, depth, len(extractor.page["images"]))
+                        if extractor.done:
+                            break
+                    page = extractor.close()
+                    images = page["images"]
+
+                    if follow_links:
+                        # Handle year archives
+                        current_year = datetime.now().year
+                        for year in range(current_year - SCRAPER_MAX_AGE_YEARS, current_year + 1):
+                            archive_url = f"https://sheerluxe.com/fashion/archive/{year}"
+                            if not self.frontier.is_visited(archive_url):
+                                self.frontier.add_url(archive_url, depth + 1, len(images))
+                                logger.info(f"Added archive URL: {archive_url}")
 
                     # Process images in larger batches
-                    images = soup.find_all("img")
                     inserted_images = []
+                    retry_page = False  # Some image got no metadata yet (OpenAI busy or failing)
                     batch_records = []
                     batch_size = 100  # Balanced batch size
 
                     valid_images = [
-                        (img, urljoin(url, img.get("src")))
+                        (img, best_image_url(img, url))
                         for img in images
-                        if img.get("src") and img.get("src").startswith(('http://', 'https://'))
+                        if img["src"] and img["src"].startswith(('http://', 'https://'))
                     ]
 
                     async def process_image_batch(batch):
                         tasks = []
                         for img, image_url in batch:
-                            if image_url in self.existing_images:
+                            if canonicalize(image_url) in self.existing_images:
                                 continue
                             tasks.append(self.process_single_image(img, image_url, url, context))
                         return await asyncio.gather(*tasks, return_exceptions=True)
@@ -145,7 +197,7 @@ class AsyncScraper:
                         batch = valid_images[i:i + batch_size]
 
                         # Filter out existing images first
-                        filtered_batch = [(img, image_url) for img, image_url in batch if image_url not in self.existing_images]
+                        filtered_batch = [(img, image_url) for img, image_url in batch if canonicalize(image_url) not in self.existing_images]
                         if not filtered_batch:
                             continue
 
@@ -154,8 +206,8 @@ class AsyncScraper:
                             {
                                 "image_url": image_url,
                                 "alt_text": img.get("alt", ""),
-                                "title": soup.title.string if soup.title else "",
-                                "surrounding_text": img.parent.get_text(strip=True) if img.parent else ""
+                                "title": page["title"],
+                                "surrounding_text": img["surrounding_text"]
                             }
                             for img, image_url in filtered_batch
                         ]
@@ -165,12 +217,20 @@ class AsyncScraper:
                             self.process_single_image(img, image_url, url, context)
                             for (img, image_url), context in zip(filtered_batch, contexts)
                         ]
-                        results = await asyncio.gather(*tasks)
-                        results = [r for r in results if r]  # Filter out None results
+                        results = await asyncio.gather(*tasks, return_exceptions=True)
+                        retry_page = retry_page or any(
+                            isinstance(r, (OpenAIBusy, MetadataGenerationError)) for r in results
+                        )
+                        results = [r for r in results if r and not isinstance(r, BaseException)]
 
                         # Process valid results
                         for result in results:
-                            metadata = generate_gpt_structured_metadata_sync(result['context'])
+                            try:
+                                metadata = generate_gpt_structured_metadata_sync(result['context'])
+                            except (OpenAIBusy, MetadataGenerationError) as e:
+                                logger.info(f"No metadata yet for {result['image_url']}, will retry: {e}")
+                                retry_page = True
+                                continue
                             if not metadata:
                                 logger.info(f"Skipping image {result['image_url']} - empty metadata")
                                 continue
@@ -223,16 +283,31 @@ class AsyncScraper:
                             finally:
                                 batch_records = []
 
+                    if retry_page:
+                        # Images stored this time are skipped when the page comes round again
+                        for image_url in inserted_images:
+                            self.existing_images.add(canonicalize(image_url))
+                        logger.info(f"Some images on {url} are waiting for OpenAI, will retry the page")
+                        return None
                     return inserted_images
 
+            except rate_limiter.RateLimitTimeout as e:
+                # Not a bad URL: put it back on the frontier like a throttled response
+                logger.info(f"Rate limit wait too long for {url}, will retry: {e}")
+                return None
             except Exception as e:
                 logger.error(f"Error processing URL {url}: {str(e)}")
                 return []
 
     async def crawl(self, seed_url: str, worker_id: int = None) -> List[str]:
         await self.init_session()
+        if worker_id is not None:
+            if self.coordinator is None:
+                self.coordinator = TaskCoordinator()
+            self.coordinator.register(worker_id)
+            self.coordinator.start_heartbeat()
         # Only add seed URL if it belongs to this worker
-        if worker_id is None or TaskCoordinator().url_belongs_to_worker(seed_url, worker_id):
+        if self.belongs_to_worker(seed_url, worker_id) and not self.in_sitemap_section(seed_url):
             self.frontier.add_url(seed_url)
         all_processed_images = []
         pending_tasks = []
@@ -244,24 +319,22 @@ class AsyncScraper:
         try:
             while True:  # Run continuously
                 if not self.frontier.has_urls:
-                    logger.info("No URLs in frontier, waiting for new URLs...")
-                    await asyncio.sleep(10)  # Reduced wait time
-                    continue
+                    # Only this loop feeds the frontier, so an empty one never refills
+                    logger.info("Completed processing all URLs in frontier")
+                    self.frontier.finish()
+                    break
 
                 # Get larger batch of URLs to process
                 current_batch = []
                 while len(current_batch) < 20 and self.frontier.has_urls:  # Increased batch size
                     url, depth = self.frontier.get_next_url()
-                    if (url not in self.frontier.visited and 
+                    if (not self.frontier.is_visited(url) and 
                         url not in [u for u, _ in current_batch] and
-                        (worker_id is None or TaskCoordinator().url_belongs_to_worker(url, worker_id))):
+                        self.belongs_to_worker(url, worker_id)):
                         logger.info(f"Worker {worker_id}: Processing URL in batch: {url}")
                         current_batch.append((url, depth))
 
                 if not current_batch:
-                    if not self.frontier.has_urls:
-                        logger.info("Completed processing all URLs in frontier")
-                        break
                     continue
 
                 # Process batch
@@ -269,38 +342,47 @@ class AsyncScraper:
                 results = await asyncio.gather(*tasks, return_exceptions=True)
 
                 # Mark URLs as visited only after processing
-                for (url, _), result in zip(current_batch, results):
+                for (url, depth), result in zip(current_batch, results):
+                    if result is None:
+                        # Throttled: the rate limiter has backed off, try again later
+                        self.frontier.release_url(url)
+                        self.frontier.add_url(url, depth)
+                        continue
                     if isinstance(result, list):
                         all_processed_images.extend(result)
                     self.frontier.mark_visited(url)
                     logger.info(f"Completed processing URL: {url}")
 
-                if tasks:
-                    results = await asyncio.gather(*tasks, return_exceptions=True)
-                    for result in results:
-                        if isinstance(result, list):
-                            all_processed_images.extend(result)
-
-                    # Rate limiting between batches
-                    await asyncio.sleep(60 / SCRAPER_RATE_LIMIT)  # Evenly space requests
-
         except asyncio.CancelledError:
             logger.info("Crawling cancelled")
         finally:
+            if self.coordinator is not None and worker_id is not None:
+                self.coordinator.deregister()
             await self.close()
 
         return all_processed_images
 
 def scrape_page(url: str, worker_id: int = None) -> List[str]:
-    scraper = AsyncScraper()
+    state_dir = FRONTIER_STATE_DIR or None  # FRONTIER_STATE_DIR="" turns persistence off
+    if state_dir and worker_id is not None:
+        state_dir = os.path.join(state_dir, f"worker-{worker_id}")
+    scraper = AsyncScraper(state_dir=state_dir)
     # Add the main URL and ensure it's properly formatted
     main_url = url if url.startswith(('http://', 'https://')) else f'https://{url}'
-    if worker_id is None or TaskCoordinator().url_belongs_to_worker(main_url, worker_id):
+    subcat_urls = [f"https://sheerluxe.com/fashion/{subcat}" for subcat in FASHION_SUBCATEGORIES]
+
+    if is_sitemap_mode():
+        queued = scraper.discover_sections([main_url, *subcat_urls], worker_id)
+        logger.info(f"Queued {queued} article URLs from sitemaps/archives; "
+                    f"covered sections: {sorted(scraper.sitemap_sections)}")
+
+    # Listing pages are only crawled for sections without a sitemap or archive
+    if scraper.belongs_to_worker(main_url, worker_id) and not scraper.in_sitemap_section(main_url):
         scraper.frontier.add_url(main_url, depth=0)
 
     # Add fashion subcategory URLs
-    for subcat in FASHION_SUBCATEGORIES:
-        subcat_url = f"https://sheerluxe.com/fashion/{subcat}"
-        scraper.frontier.add_url(subcat_url, depth=0)
+    for subcat_url in subcat_urls:
+        if not scraper.in_sitemap_section(subcat_url):
+            scraper.frontier.add_url(subcat_url, depth=0)
 
-    return asyncio.run(scraper.crawl(main_url))
\ No newline at end of file
+    return asyncio.run(scraper.crawl(main_url, worker_id))
\ No newline at end of file
@@ -2,6 +2,8 @@ import os
 from supabase import create_client
 from uuid import uuid4
 import mimetypes
+from .bulk_writer import create_writer
+from .exceptions import StorageError
 
 SUPABASE_URL = os.environ['SUPABASE_URL']
 SUPABASE_KEY = os.environ['SUPABASE_KEY']
@@ -9,6 +11,7 @@ SUPABASE_BUCKET = os.environ.get('SUPABASE_BUCKET', 'sheerluxe-images')
 SUPABASE_TABLE = os.environ.get('SUPABASE_TABLE', 'moodboard_items')
 
 supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+moodboard_writer = create_writer(supabase, SUPABASE_TABLE, on_conflict="image_url")
 
 def upload_image_to_supabase(image_url, image_bytes):
     filename = f"{uuid4()}.jpg"
@@ -26,6 +29,19 @@ def upload_image_to_supabase(image_url, image_bytes):
         print(f"[ERROR] Upload failed: {e}")
         return None
 
+def download_uploaded_image(stored_image_url):
+    """Bytes of an image uploaded by ``upload_image_to_supabase``."""
+    filename = stored_image_url.rsplit("/", 1)[-1]
+    return supabase.storage.from_(SUPABASE_BUCKET).download(filename)
+
+def delete_uploaded_image(stored_image_url):
+    """Remove an upload that will never get a row. Best effort."""
+    filename = stored_image_url.rsplit("/", 1)[-1]
+    try:
+        supabase.storage.from_(SUPABASE_BUCKET).remove([filename])
+    except Exception as e:
+        print(f"[WARN] Could not remove orphaned upload {filename}: {e}")
+
 def store_analysis_result(
     image_url,
     metadata,
@@ -33,29 +49,39 @@ def store_analysis_result(
     stored_image_url=None,
     source_url=None,
     title=None,
-    description=None
+    description=None,
+    wait=True
 ):
-    try:
-        data = {
-            "image_url": image_url,
-            "metadata": metadata
-        }
-
-        if embedding:
-            data["embedding"] = embedding
-        if stored_image_url:
-            data["stored_image_url"] = stored_image_url
-        if source_url:
-            data["source_url"] = source_url
-        if title:
-            data["title"] = title
-        if description:
-            data["description"] = description
-
-        supabase.table("moodboard_items").insert(data).execute()
-        print(f"[✅ DB] Saved metadata for: {image_url}")
+    """Write one moodboard row.
 
-    except Exception as e:
-        print(f"[ERROR] DB insert failed: {e}")
+    With ``wait`` (the default) the row is flushed before returning and
+    ``StorageError`` is raised if it was rejected, so a lease is only
+    committed once its row is durable. Otherwise the row is buffered and a
+    future resolving to whether it was written is returned.
+
+    Waiting writes from one process share an upsert only when they overlap,
+    so in a prefork child (one task at a time) each is its own upsert; see
+    ``bulk_writer``.
+    """
+    data = {
+        "image_url": image_url,
+        "metadata": metadata
+    }
+
+    if embedding:
+        data["embedding"] = embedding
+    if stored_image_url:
+        data["stored_image_url"] = stored_image_url
+    if source_url:
+        data["source_url"] = source_url
+    if title:
+        data["title"] = title
+    if description:
+        data["description"] = description
 
+    if not wait:
+        return moodboard_writer.add(data)
 
+    if not moodboard_writer.write(data):
+        raise StorageError(f"DB write failed for: {image_url}")
+    print(f"[✅ DB] Stored metadata for: {image_url}")
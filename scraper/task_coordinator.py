@@ -1,78 +1,315 @@
 
 import asyncio
+import os
 from typing import List, Set
 import logging
 import hashlib
+import threading
 import time
 import redis
 import json
-from utils.supabase_client import supabase_client
+from contextlib import nullcontext
+from .membership import MembershipRegistry, HEARTBEAT_TTL_SECONDS, KNOWN_MEMBERS_KEY, ROUTING_REFRESH_SECONDS
+from .redis_client import redis_client
 
 logger = logging.getLogger(__name__)
 
+SHARD_STREAM_PREFIX = 'frontier:shard:'
+CONSUMER_GROUP = 'crawlers'
+KNOWN_URLS_KEY = 'known_urls'
+COMPLETED_URLS_KEY = 'completed_urls'
+# Entries left unacknowledged this long are assumed to belong to a crashed consumer.
+CLAIM_IDLE_MS = int(os.environ.get('FRONTIER_CLAIM_IDLE_MS', str(10 * 60 * 1000)))
+
+HANDOFF_LOCK_PREFIX = 'workers:handoff:'
+HANDOFF_CHUNK = 500
+# member -> when its stream was last found non-empty. A departed stream is kept
+# and re-drained until writers routing from a stale table have moved on.
+DEPARTED_KEY = 'workers:departed'
+DEPARTED_GRACE_SECONDS = 2 * ROUTING_REFRESH_SECONDS
+
+# KEYS[1] = stream, KEYS[2] = departed, KEYS[3] = known members. ARGV[1] = member.
+# Retires a departed worker's stream only if nothing was added to it since the last drain.
+RETIRE_STREAM_SCRIPT = """
+if redis.call('XLEN', KEYS[1]) > 0 then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+redis.call('HDEL', KEYS[2], ARGV[1])
+redis.call('SREM', KEYS[3], ARGV[1])
+return 1
+"""
+
+# KEYS[1] = known_urls, KEYS[2] = completed_urls, KEYS[3..] = shard streams.
+# ARGV = url, stream index pairs. Enqueues and returns only never-seen URLs.
+ADMIT_URLS_SCRIPT = """
+local admitted = {}
+for i = 1, #ARGV, 2 do
+    local url = ARGV[i]
+    if redis.call('SISMEMBER', KEYS[2], url) == 0
+            and redis.call('SADD', KEYS[1], url) == 1 then
+        redis.call('XADD', KEYS[tonumber(ARGV[i + 1])], '*', 'url', url)
+        admitted[#admitted + 1] = url
+    end
+end
+return admitted
+"""
+
 class TaskCoordinator:
+    """Hands out crawl URLs from one Redis Stream per live worker.
+
+    URLs are routed to workers by rendezvous hashing over the live
+    membership registry, so scaling workers up or down only moves the URLs
+    the joining or leaving worker wins or loses. Each worker's stream has a
+    consumer group, so claiming a batch is a single XREADGROUP of
+    ``chunk_size`` entries and every claimed entry sits in the group's
+    pending-entries list until it is acknowledged. Entries a crashed consumer
+    never acknowledged are reclaimed with XAUTOCLAIM.
+
+    Create one coordinator per process and reuse it; the routing table is
+    cached on the instance. ``start_heartbeat`` keeps the registration alive
+    from a background thread, so a long crawl batch never lets it expire.
+    """
+
     def __init__(self, chunk_size: int = 50, total_workers: int = 8):
         self.chunk_size = chunk_size
         self.worker_id = None
+        # Only used to route URLs before any worker has registered.
         self.total_workers = total_workers
-        self.redis = redis.Redis(
-            host=os.environ['REDIS_HOST'],
-            port=int(os.environ['REDIS_PORT']),
-            password=os.environ['REDIS_PASSWORD'],
-            ssl=True,
-            ssl_cert_reqs=None,
-            decode_responses=True
-        )
-        
-    def url_belongs_to_worker(self, url: str, worker_id: int) -> bool:
+        self.redis = redis_client
+        self.membership = MembershipRegistry()
+        self._admit_urls = self.redis.register_script(ADMIT_URLS_SCRIPT)
+        self._retire_stream = self.redis.register_script(RETIRE_STREAM_SCRIPT)
+        self._groups_ready = set()
+        self._entry_ids = {}  # url -> stream entry id, for acknowledging
+        self._routed_generation = None
+        self._heartbeat_lock = threading.Lock()
+        # Held while claiming, acknowledging or re-routing entries of our own stream,
+        # so the heartbeat thread never moves a URL the crawl loop is claiming.
+        self._claim_lock = threading.Lock()
+        self._heartbeat_stop = threading.Event()
+        self._heartbeat_thread = None
+
+    def url_belongs_to_worker(self, url: str, worker_id) -> bool:
+        return self.shard_for(url) == str(worker_id)
+
+    def shard_for(self, url: str) -> str:
+        owner = self.membership.owner_of(url)
+        if owner is not None:
+            return owner
         url_hash = int(hashlib.md5(url.encode()).hexdigest(), 16)
-        return url_hash % self.total_workers == worker_id
+        return str(url_hash % self.total_workers)
+
+    def register(self, worker_id) -> None:
+        """Join the membership registry as ``worker_id``."""
+        self.worker_id = str(worker_id)
+        self.heartbeat()
+
+    def heartbeat(self) -> None:
+        """Refresh this worker's registration; hand off work if membership changed."""
+        with self._heartbeat_lock:
+            generation = self.membership.heartbeat(self.worker_id)
+            if generation != self._routed_generation:
+                self._routed_generation = generation
+                self.rebalance()
+            elif self.redis.hlen(DEPARTED_KEY):
+                self._drain_departed()
+
+    def _heartbeat_loop(self) -> None:
+        while not self._heartbeat_stop.wait(min(HEARTBEAT_TTL_SECONDS / 3, ROUTING_REFRESH_SECONDS)):
+            try:
+                self.heartbeat()
+            except Exception as e:
+                logger.error(f"Worker {self.worker_id}: heartbeat failed: {str(e)}")
+
+    def start_heartbeat(self) -> None:
+        """Heartbeat from a daemon thread until ``deregister``."""
+        if self._heartbeat_thread is not None:
+            return
+        self._heartbeat_stop.clear()
+        self._heartbeat_thread = threading.Thread(
+            target=self._heartbeat_loop, name=f'heartbeat-{self.worker_id}', daemon=True
+        )
+        self._heartbeat_thread.start()
+
+    def deregister(self) -> None:
+        if self._heartbeat_thread is not None:
+            self._heartbeat_stop.set()
+            self._heartbeat_thread.join()
+            self._heartbeat_thread = None
+        self.membership.leave(self.worker_id)
+
+    def stream_key(self, shard) -> str:
+        return f'{SHARD_STREAM_PREFIX}{shard}'
+
+    @property
+    def consumer_name(self) -> str:
+        return f'worker-{self.worker_id}'
+
+    def _ensure_group(self, shard) -> None:
+        if shard in self._groups_ready:
+            return
+        try:
+            self.redis.xgroup_create(self.stream_key(shard), CONSUMER_GROUP, id='0', mkstream=True)
+        except redis.ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+        self._groups_ready.add(shard)
+
+    def _remember(self, entries) -> List[str]:
+        urls = []
+        for entry_id, fields in entries:
+            if not fields:  # entry deleted while pending
+                continue
+            url = fields['url']
+            self._entry_ids[url] = entry_id
+            urls.append(url)
+        return urls
 
     async def get_next_batch(self) -> List[str]:
-        """Get next batch of URLs from Redis queue"""
+        """Claim up to chunk_size URLs from this worker's shard in O(batch)."""
         try:
-            # Atomic operation to get and mark URLs as processing
-            urls = []
-            pipe = self.redis.pipeline()
-            # Get all pending URLs and filter for this worker
-            pending = self.redis.lrange('pending_urls', 0, -1) or []
-            for url in pending:
-                if self.url_belongs_to_worker(url, self.worker_id):
-                    pipe.lrem('pending_urls', 1, url)
-                    pipe.rpush(f'processing_urls:{self.worker_id}', url)
-                    urls.append(url)
-                if len(urls) >= self.chunk_size:
-                    break
-            pipe.execute()
+            stream = self.stream_key(self.worker_id)
+            self._ensure_group(self.worker_id)
+
+            with self._claim_lock:
+                # Recover entries a crashed consumer claimed but never acknowledged
+                _, stale, *_ = self.redis.xautoclaim(
+                    stream, CONSUMER_GROUP, self.consumer_name,
+                    min_idle_time=CLAIM_IDLE_MS, start_id='0-0', count=self.chunk_size
+                )
+                urls = self._remember(stale)
+
+                remaining = self.chunk_size - len(urls)
+                if remaining > 0:
+                    response = self.redis.xreadgroup(
+                        CONSUMER_GROUP, self.consumer_name, {stream: '>'}, count=remaining
+                    )
+                    for _, entries in response or []:
+                        urls.extend(self._remember(entries))
             return urls
         except Exception as e:
             logger.error(f"Failed to get next batch: {str(e)}")
             return []
 
-    async def add_urls(self, urls: List[str]) -> None:
-        """Add new URLs to Redis queue"""
+    async def add_urls(self, urls: List[str]) -> List[str]:
+        """Admit a batch of URLs in one round trip.
+
+        A server-side script checks every URL against the known_urls set and
+        XADDs only the new ones to their shard streams, atomically. Returns
+        the URLs that were admitted.
+        """
         try:
-            pipe = self.redis.pipeline()
+            urls = list(dict.fromkeys(urls))
+            if not urls:
+                return []
+
+            streams = []
+            stream_index = {}
+            args = []
             for url in urls:
-                if self.url_belongs_to_worker(url, self.worker_id):
-                    # Check completed, pending and processing queues
-                    if not (self.redis.sismember('completed_urls', url) or
-                           self.redis.lpos('pending_urls', url) or
-                           any(self.redis.lpos(f'processing_urls:{i}', url)
-                               for i in range(self.total_workers))):
-                        pipe.lpush('pending_urls', url)
-            pipe.execute()
+                stream = self.stream_key(self.shard_for(url))
+                if stream not in stream_index:
+                    streams.append(stream)
+                    stream_index[stream] = len(streams) + 2  # after the two set keys
+                args.extend([url, stream_index[stream]])
+
+            return self._admit_urls(keys=[KNOWN_URLS_KEY, COMPLETED_URLS_KEY, *streams], args=args)
         except Exception as e:
             logger.error(f"Failed to add URLs: {str(e)}")
+            return []
+
+    def _move_entries(self, stream: str, keep, lock=None) -> int:
+        """Re-route entries of ``stream`` that ``keep`` rejects to their owners.
+
+        ``lock`` is held around each chunk's read and move.
+        """
+        moved = 0
+        start = '-'
+        while True:
+            with lock or nullcontext():
+                entries = self.redis.xrange(stream, min=start, max='+', count=HANDOFF_CHUNK)
+                if not entries:
+                    return moved
+                pipe = self.redis.pipeline()
+                for entry_id, fields in entries:
+                    url = fields.get('url')
+                    if url and not keep(url):
+                        pipe.xadd(self.stream_key(self.shard_for(url)), {'url': url})
+                        pipe.xack(stream, CONSUMER_GROUP, entry_id)
+                        pipe.xdel(stream, entry_id)
+                        moved += 1
+                pipe.execute()
+            start = f'({entries[-1][0]}'
+
+    def rebalance(self) -> None:
+        """Hand off queued work after a membership change.
+
+        Entries in our own stream that now route elsewhere are moved to their
+        new owner (URLs we are currently crawling stay put), and streams of
+        departed workers are drained into the live ones. Runs on the
+        heartbeat thread, so the own-stream pass holds the claim lock.
+        """
+        try:
+            own = self.stream_key(self.worker_id)
+            moved = self._move_entries(
+                own,
+                lambda url: url in self._entry_ids or self.url_belongs_to_worker(url, self.worker_id),
+                lock=self._claim_lock
+            )
+            moved += self._drain_departed()
+
+            if moved:
+                logger.info(f"Worker {self.worker_id}: handed off {moved} URLs after membership change")
+        except Exception as e:
+            logger.error(f"Failed to rebalance: {str(e)}")
+
+    def _drain_departed(self) -> int:
+        """Move departed workers' entries to the live ones; retire their streams once quiet.
+
+        Writers only re-read the routing table every ROUTING_REFRESH_SECONDS,
+        so for a while after a worker leaves some still XADD to its stream.
+        The stream is therefore tombstoned in DEPARTED_KEY rather than
+        deleted, re-drained on every heartbeat, and only retired once it has
+        stayed empty for DEPARTED_GRACE_SECONDS. A short lock keeps two
+        survivors from draining the same stream at once.
+        """
+        moved = 0
+        live = set(self.membership.routing_table()[1])
+        for member in self.redis.hkeys(DEPARTED_KEY):
+            if member in live:  # came back before its stream was retired
+                self.redis.hdel(DEPARTED_KEY, member)
+
+        for member in self.membership.departed_members():
+            lock = f'{HANDOFF_LOCK_PREFIX}{member}'
+            if not self.redis.set(lock, self.worker_id, nx=True, ex=60):
+                continue
+            try:
+                stream = self.stream_key(member)
+                drained = self._move_entries(stream, lambda url: False)
+                moved += drained
+                last_seen = self.redis.hget(DEPARTED_KEY, member)
+                if drained or last_seen is None:
+                    self.redis.hset(DEPARTED_KEY, member, time.time())
+                elif time.time() - float(last_seen) >= DEPARTED_GRACE_SECONDS:
+                    if self._retire_stream(keys=[stream, DEPARTED_KEY, KNOWN_MEMBERS_KEY], args=[member]):
+                        logger.info(f"Worker {self.worker_id}: retired stream of departed worker {member}")
+            finally:
+                self.redis.delete(lock)
+        return moved
 
     async def mark_completed(self, urls: List[str]) -> None:
-        """Mark URLs as completed in Redis"""
+        """Acknowledge URLs and mark them as completed in Redis"""
         try:
-            pipe = self.redis.pipeline()
-            for url in urls:
-                # Remove from processing and add to completed
-                pipe.lrem(f'processing_urls:{self.worker_id}', 0, url)
-                pipe.sadd('completed_urls', url)
-            pipe.execute()
+            stream = self.stream_key(self.worker_id)
+            with self._claim_lock:
+                pipe = self.redis.pipeline()
+                for url in urls:
+                    entry_id = self._entry_ids.pop(url, None)
+                    if entry_id:
+                        pipe.xack(stream, CONSUMER_GROUP, entry_id)
+                        pipe.xdel(stream, entry_id)
+                    pipe.sadd(COMPLETED_URLS_KEY, url)
+                pipe.execute()
         except Exception as e:
             logger.error(f"Failed to mark URLs completed: {str(e)}")
@@ -1,144 +1,427 @@
 import os
-import time
-import redis
-from celery import shared_task
+import asyncio
+from uuid import uuid4
+from celery import group
+import threading
+from celery.signals import worker_process_shutdown, worker_shutdown, worker_ready
 from .celery_app import app
-from .utils import fetch_and_extract_urls_and_images, download_image_file
-from .openai_client import generate_gpt_structured_metadata_sync
-from .supabase_client import upload_image_to_supabase, store_analysis_result
+from .utils import fetch_and_extract_urls_and_images, download_image_file, is_supported_image_url
+from .image_batch import run_image_batch, build_image_context, DEFERRED
+from . import image_leases
+from .dedup import seen_urls, seen_images, add_many_batched, migrate_legacy_sets
+from .discovery import discover, is_sitemap_mode
+from .canonical import unique_by_canonical, flush_metrics as flush_canonical_metrics
+from .image_hash import compute_dhash, find_similar, remember
+from .metadata_batch import (
+    is_batch_mode, queue_for_batch, submit_pending_batch, collect_finished_batches,
+    OPENAI_BATCH_LEASE_SECONDS
+)
+from . import llm_cache
+from .openai_client import generate_gpt_structured_metadata_sync, get_cached_metadata, cache_metadata, OpenAIBusy
+from .supabase_client import upload_image_to_supabase, delete_uploaded_image, store_analysis_result, moodboard_writer
+from .exceptions import StorageError
 from scraper.openai_client import is_meaningful_metadata
 from scraper.openai_client import (
     summarize_metadata_for_embedding,
     generate_embedding_from_text
 )
-import os
 
-redis_client = redis.Redis.from_url(
-    f"rediss://:{os.environ['REDIS_PASSWORD']}@{os.environ['REDIS_HOST']}:{os.environ['REDIS_PORT']}/0?ssl_cert_reqs=none",
-    decode_responses=True
-)
+IMAGE_BATCH_SIZE = int(os.environ.get("IMAGE_BATCH_SIZE", "50"))
+DISCOVERY_ENQUEUE_CHUNK = 500
+# Pages per scrape_page_batch task when fanning a page's links out.
+CRAWL_FANOUT_CHUNK = int(os.environ.get("CRAWL_FANOUT_CHUNK", "10"))
+# Batches one submit_metadata_batch run may submit when the queue outgrows one.
+OPENAI_BATCH_MAX_SUBMISSIONS = int(os.environ.get("OPENAI_BATCH_MAX_SUBMISSIONS", "10"))
+# Extra retries an image task may spend waiting for OpenAI budget.
+OPENAI_MAX_DEFERRALS = int(os.environ.get("OPENAI_MAX_DEFERRALS", "20"))
 
-@app.task(bind=True, default_retry_delay=180, max_retries=3)
-def process_image(self, image_url):
-    if redis_client.sadd('processed_images', image_url) == 0:
-        print(f"[SKIP] Already processed image: {image_url}")
-        return
+ALLOWED_SEED_PREFIXES = [
+    "https://slman.com/style",
+    "https://sheerluxe.com/luxegen/fashion",
+    "https://sheerluxe.com/gold/fashion",
+    "https://sheerluxe.com/weddings"
+]
 
-    try:
-        print(f"[IMAGE] Processing: {image_url}")
 
-        ext = os.path.splitext(image_url.split("?")[0])[1].lower()
-        if ext not in [".jpg", ".jpeg", ".png", ".gif", ".webp"]:
-            print(f"[SKIP] Unsupported image format: {image_url}")
-            return
+def is_allowed_child_url(url):
+    return any(url.startswith(prefix) for prefix in ALLOWED_SEED_PREFIXES)
 
-        image_bytes = download_image_file(image_url)
-        if not image_bytes:
-            print(f"[SKIP] Could not download: {image_url}")
-            return
 
-        image_context = {
-            "image_url": image_url,
-            "alt_text": "",
-            "title": "",
-            "surrounding_text": "",
-            "source_url": "https://sheerluxe.com/fashion"  # placeholder, update later
-        }
+# Prefork children flush on worker_process_shutdown; threads and solo pools
+# run tasks in the main process, which only sees worker_shutdown.
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def flush_buffered_writes(**kwargs):
+    moodboard_writer.flush()
+    flush_canonical_metrics()
 
-        metadata = generate_gpt_structured_metadata_sync(image_context, image_bytes)
-        if not metadata or not is_meaningful_metadata(metadata):
-            print(f"[SKIP] No meaningful metadata for: {image_url}")
-            return
 
-        summary = summarize_metadata_for_embedding(metadata)
-        embedding = generate_embedding_from_text(summary)
+@worker_ready.connect
+def start_legacy_dedup_migration(**kwargs):
+    """Fold the old processed_urls/processed_images sets into the seen filters, once per cluster."""
+    threading.Thread(target=migrate_legacy_sets, name="dedup-migration", daemon=True).start()
 
-        stored_image_url = upload_image_to_supabase(image_url, image_bytes)
 
-        if not stored_image_url:
-            print(f"[SKIP] Failed to upload image to Supabase: {image_url}")
-            return
+def finish_image(image_context, image_bytes, image_hash, metadata, stored_image_url=None):
+    """Embed, upload and store an image whose metadata is already known.
+
+    Pass ``stored_image_url`` for an image that is already uploaded.
+    Raises ``StorageError`` if the upload or the row write failed, so the
+    caller fails or retries the lease instead of committing it.
+    """
+    image_url = image_context["image_url"]
+    if not metadata or not is_meaningful_metadata(metadata):
+        print(f"[SKIP] No meaningful metadata for: {image_url}")
+        return False
+
+    summary = summarize_metadata_for_embedding(metadata)
+    embedding = generate_embedding_from_text(summary)
+
+    stored_image_url = stored_image_url or upload_image_to_supabase(image_url, image_bytes)
+
+    if not stored_image_url:
+        raise StorageError(f"Upload to Supabase failed for: {image_url}")
+
+    store_analysis_result(
+        image_url=image_url,
+        metadata=metadata,
+        embedding=embedding,
+        stored_image_url=stored_image_url,
+        source_url=image_context["source_url"],
+        title=image_context["title"],
+        description=image_context["surrounding_text"]
+    )
+
+    # Only index rows that made it to the table
+    if image_hash is not None:
+        remember(image_hash, image_url, metadata, stored_image_url)
+    return True
+
+
+def handle_image(image_context):
+    """Run one leased image through the pipeline.
+
+    Returns ``DEFERRED`` when the image was handed to the Batch API and its
+    lease must stay open, otherwise None once the image is finished with.
+    """
+    image_url = image_context["image_url"]
+    print(f"[IMAGE] Processing: {image_url}")
+
+    if not is_supported_image_url(image_url):
+        print(f"[SKIP] Unsupported image format: {image_url}")
+        return None
+
+    image_bytes = download_image_file(image_url)
+    if not image_bytes:
+        print(f"[SKIP] Image gone: {image_url}")
+        return None
+
+    image_hash = compute_dhash(image_bytes)
+    match = find_similar(image_hash) if image_hash is not None else None
 
+    if match:
+        print(f"[DEDUP] {image_url} matches {match['image_url']} (distance {match['distance']})")
         store_analysis_result(
             image_url=image_url,
-            metadata=metadata,
-            embedding=embedding,
-            stored_image_url=stored_image_url,
+            metadata=match["metadata"],
+            embedding=generate_embedding_from_text(summarize_metadata_for_embedding(match["metadata"])),
+            stored_image_url=match["stored_image_url"],
             source_url=image_context["source_url"],
             title=image_context["title"],
             description=image_context["surrounding_text"]
         )
+    elif is_batch_mode() and get_cached_metadata(image_bytes) is None:
+        queue_for_batch(image_context, image_bytes, image_hash)
+        print(f"[BATCH API] Queued for metadata batch: {image_url}")
+        return DEFERRED
+    else:
+        metadata = generate_gpt_structured_metadata_sync(image_context, image_bytes)
+        if not finish_image(image_context, image_bytes, image_hash, metadata):
+            return None
+
+    print(f"[✅ STORED] {image_url}")
+    return None
+
+
+@app.task(bind=True, default_retry_delay=180, max_retries=3)
+def process_image(self, image_url):
+    token = self.request.id or str(uuid4())
+    if seen_images.add(image_url):
+        image_leases.enqueue([{"image_url": image_url}])
 
-        redis_client.sadd('processed_images', image_url)
-        print(f"[✅ STORED] {image_url}")
+    if not image_leases.claim(image_url, token):
+        print(f"[SKIP] Already processed or leased elsewhere: {image_url}")
+        return
 
+    try:
+        outcome = handle_image(build_image_context({"image_url": image_url, "lease_token": token}))
+    except OpenAIBusy as e:
+        # Keep the lease (a retry keeps the task id) and come back once there is budget
+        print(f"[DEFER] No OpenAI budget for {image_url}, retrying in {e.countdown}s")
+        image_leases.extend([image_url], token, e.countdown + image_leases.LEASE_SECONDS)
+        raise self.retry(countdown=e.countdown, max_retries=self.max_retries + OPENAI_MAX_DEFERRALS)
     except Exception as e:
         print(f"[ERROR] process_image failed on {image_url}: {e}")
-        self.retry(exc=e)
+        if image_leases.fail(image_url, token) == "queued":
+            raise self.retry(exc=e)
+        return
+
+    if outcome == DEFERRED:
+        image_leases.extend([image_url], token, OPENAI_BATCH_LEASE_SECONDS)
+    else:
+        image_leases.commit(image_url, token)
+
+
+def _image_url(item):
+    return item if isinstance(item, str) else item["image_url"]
 
 
 @app.task(bind=True, default_retry_delay=180, max_retries=3)
-def scrape_page(self, url):
-    print(f"[SCRAPE] 👀 Running scrape_page for: {url}")
+def process_image_batch(self, items):
+    """Process many images concurrently in one asyncio loop.
+
+    ``items`` is a list of image URLs or dicts carrying the page context
+    (``image_url``, ``source_url``, ``title``, ``alt_text``, ``surrounding_text``).
+    Only images this task manages to lease are processed, and only the ones
+    that failed with an exception are retried.
+    """
+    token = self.request.id or str(uuid4())
+    claimed = image_leases.claim_many([_image_url(item) for item in items], token)
+    items = [
+        {**({"image_url": item} if isinstance(item, str) else item), "lease_token": token}
+        for item in items if _image_url(item) in claimed
+    ]
+    if not items:
+        print("[SKIP] No images left to lease in batch")
+        return
 
-    from scraper.utils import fetch_and_extract_urls_and_images
-    from scraper.tasks import process_image
+    print(f"[BATCH] Processing {len(items)} images")
 
-    ALLOWED_SEED_PREFIXES = [
-        "https://slman.com/style",
-        "https://sheerluxe.com/luxegen/fashion",
-        "https://sheerluxe.com/gold/fashion",
-        "https://sheerluxe.com/weddings"
+    try:
+        stored, failed, deferred, throttled = asyncio.run(run_image_batch(items))
+    except Exception as e:
+        print(f"[ERROR] process_image_batch failed: {e}")
+        for image_url in claimed:
+            image_leases.fail(image_url, token)
+        raise self.retry(exc=e)
+
+    print(f"[✅ BATCH] Stored {len(stored)}/{len(items)} images, {len(failed)} failed, "
+          f"{len(deferred)} deferred, {len(throttled)} waiting for OpenAI budget")
+
+    failed, deferred = set(failed), set(deferred)
+    image_leases.commit_many([u for u in claimed if u not in failed and u not in deferred and u not in throttled], token)
+    image_leases.extend(list(deferred), token, OPENAI_BATCH_LEASE_SECONDS)
+
+    retry_items = [
+        item for item in items
+        if item["image_url"] in failed and image_leases.fail(item["image_url"], token) == "queued"
     ]
+    if throttled:
+        # Throttled images keep their lease and wait out the budget without counting as a failure
+        countdown = max(countdown for countdown, _ in throttled.values())
+        image_leases.extend(list(throttled), token, countdown + image_leases.LEASE_SECONDS)
+        # The retry reads each image back from storage instead of downloading it again
+        retry_items += [
+            {**item, "stored_image_url": throttled[item["image_url"]][1]}
+            for item in items if item["image_url"] in throttled
+        ]
+        raise self.retry(args=(retry_items,), countdown=countdown,
+                         max_retries=self.max_retries + OPENAI_MAX_DEFERRALS)
+    if retry_items:
+        raise self.retry(args=(retry_items,))
+
+
+@app.task
+def reap_image_leases():
+    """Hand images with expired leases or lost queue messages back out."""
+    contexts = image_leases.reap()
+    for i in range(0, len(contexts), IMAGE_BATCH_SIZE):
+        process_image_batch.delay(contexts[i:i + IMAGE_BATCH_SIZE])
+    if contexts:
+        print(f"[LEASE] Re-queued {len(contexts)} images with expired leases")
+
+
+@app.task(bind=True, default_retry_delay=60, max_retries=3)
+def submit_metadata_batch(self):
+    """Submit queued image requests to the OpenAI Batch API, as several batches if need be."""
+    try:
+        for _ in range(OPENAI_BATCH_MAX_SUBMISSIONS):
+            batch_id = submit_pending_batch()
+            if not batch_id:
+                break
+            print(f"[BATCH API] Submitted batch {batch_id}")
+    except Exception as e:
+        print(f"[ERROR] submit_metadata_batch failed: {e}")
+        raise self.retry(exc=e)
+
+
+@app.task
+def poll_metadata_batches():
+    """Fan finished Batch API results out to store_batched_image."""
+    results = collect_finished_batches()
+    for image_context, metadata in results:
+        store_batched_image.delay(image_context, metadata)
+    if results:
+        print(f"[BATCH API] Dispatched {len(results)} batched results")
+
+
+@app.task(bind=True, default_retry_delay=180, max_retries=3)
+def store_batched_image(self, image_context, metadata):
+    image_url = image_context["image_url"]
+    try:
+        stored_image_url = image_context.get("stored_image_url")
+        if stored_image_url:
+            # Uploaded when it was queued: nothing to download again
+            image_bytes, image_hash = None, image_context.get("image_hash")
+            llm_cache.put(image_context["metadata_cache_key"], metadata)
+        else:
+            # Queued by an older release. Transient download errors raise and are
+            # retried below; None means the image is gone
+            image_bytes = download_image_file(image_url)
+            if not image_bytes:
+                print(f"[SKIP] Image gone: {image_url}")
+                if image_context.get("lease_token"):
+                    image_leases.commit(image_url, image_context["lease_token"])
+                return
+            cache_metadata(image_bytes, metadata)
+            image_hash = compute_dhash(image_bytes)
+
+        if finish_image(image_context, image_bytes, image_hash, metadata, stored_image_url):
+            print(f"[✅ STORED] {image_url}")
+        elif stored_image_url:
+            delete_uploaded_image(stored_image_url)
+
+        if image_context.get("lease_token"):
+            image_leases.commit(image_url, image_context["lease_token"])
+
+    except Exception as e:
+        print(f"[ERROR] store_batched_image failed on {image_url}: {e}")
+        # Keep the lease while retrying; the metadata is cached if it lapses.
+        if image_context.get("lease_token"):
+            image_leases.extend([image_url], image_context["lease_token"], image_leases.LEASE_SECONDS)
+        self.retry(exc=e)
+
+
+def crawl_page(url, follow_links=True):
+    """Fetch one admitted page and fan its new links and images out.
+
+    Both of the page's dedup checks share one pipelined round trip, and every
+    child task goes out in one ``fan_out`` publish.
+    """
+    print(f"[SCRAPE] Fetching: {url}")
+    urls, images = fetch_and_extract_urls_and_images(url)
+    print(f"[PARSE] Found {len(urls)} links and {len(images)} images")
+
+    candidate_urls = [u for u in urls if is_allowed_child_url(u)] if follow_links else []
+    candidate_images = [
+        image_url for image_url in images
+        if "sheerluxe.com" in image_url or "slman.com" in image_url
+    ]
+    new_urls, new_images = add_many_batched([(seen_urls, candidate_urls), (seen_images, candidate_images)])
+
+    next_urls = [u for u, is_new in zip(candidate_urls, new_urls) if is_new]
+    batch = [
+        {"image_url": image_url, "source_url": url}
+        for image_url, is_new in zip(candidate_images, new_images) if is_new
+    ]
+    duplicates = len(candidate_urls) - len(next_urls) + len(candidate_images) - len(batch)
+    if duplicates:
+        print(f"[DUPLICATE] Skipping {duplicates} already seen links/images on {url}")
+
+    fan_out(next_urls, image_leases.enqueue(batch))
+
+
+def fan_out(page_urls, image_items, follow_links=True):
+    """Publish pages and images as chunked batch tasks in a single group."""
+    signatures = [
+        scrape_page_batch.s(page_urls[i:i + CRAWL_FANOUT_CHUNK], follow_links=follow_links)
+        for i in range(0, len(page_urls), CRAWL_FANOUT_CHUNK)
+    ]
+    signatures += [
+        process_image_batch.s(image_items[i:i + IMAGE_BATCH_SIZE])
+        for i in range(0, len(image_items), IMAGE_BATCH_SIZE)
+    ]
+    if signatures:
+        print(f"[ENQUEUE] {len(page_urls)} pages and {len(image_items)} images in {len(signatures)} tasks")
+        group(signatures).apply_async()
+
+
+@app.task(bind=True, default_retry_delay=180, max_retries=3)
+def scrape_page(self, url, admitted=False, follow_links=True):
+    """Fetch ``url`` and fan its links and images out to further tasks.
+
+    Links enqueued from here are already marked seen, so they are passed
+    ``admitted=True``; only externally dispatched URLs (seeds) are checked
+    against the filter on entry. Pages found through sitemaps are passed
+    ``follow_links=False``: their section is discovered without crawling.
+    """
+    print(f"[SCRAPE] 👀 Running scrape_page for: {url}")
 
     try:
         # ✅ Only mark as processed inside this task
-        if redis_client.sadd("processed_urls", url) == 0:
+        if not admitted and not seen_urls.add(url):
             print(f"[SKIP] Already processed: {url}")
             return
 
-        print(f"[SCRAPE] Fetching: {url}")
-        urls, images = fetch_and_extract_urls_and_images(url)
-        print(f"[PARSE] Found {len(urls)} links and {len(images)} images")
-
-        for next_url in urls:
-            ALLOWED_SEED_PREFIXES = [
-                "https://slman.com/style",
-                "https://sheerluxe.com/luxegen/fashion",
-                "https://sheerluxe.com/gold/fashion",
-                "https://sheerluxe.com/weddings"
-            ]
-
-            def is_allowed_child_url(url):
-                return any(url.startswith(prefix) for prefix in ALLOWED_SEED_PREFIXES)
-
-            for next_url in urls:
-                if not is_allowed_child_url(next_url):
-                    continue
-                if redis_client.sadd("processed_urls", next_url) == 0:
-                    print(f"[DUPLICATE] Skipping already seen URL: {next_url}")
-                    continue
-                print(f"[ENQUEUE] scrape_page → {next_url}")
-                scrape_page.delay(next_url)
-
-            
-            if redis_client.sadd("processed_urls", next_url) == 0:
-                print(f"[DUPLICATE] Skipping already seen URL: {next_url}")
-                continue
-            print(f"[ENQUEUE] scrape_page → {next_url}")
-            scrape_page.delay(next_url)
-
-        for image_url in images:
-            if "sheerluxe.com" not in image_url and "slman.com" not in image_url:
-                continue
-            if redis_client.sadd("processed_images", image_url) == 0:
-                print(f"[DUPLICATE] Skipping already seen image: {image_url}")
-                continue
-            print(f"[ENQUEUE] process_image → {image_url}")
-            process_image.delay(image_url)
+        crawl_page(url, follow_links)
 
     except Exception as e:
         print(f"[ERROR] ❌ scrape_page failed for {url}: {e}")
-        self.retry(exc=e)
+        # Already marked seen above, so the retry must not be filtered out again
+        raise self.retry(exc=e, args=(url,), kwargs={"admitted": True, "follow_links": follow_links})
+
 
+@app.task
+def scrape_page_batch(urls, follow_links=True):
+    """Crawl a chunk of already-admitted pages.
 
+    A page that fails is handed to its own ``scrape_page`` task, which has
+    the usual retries, so one bad page doesn't redo the whole chunk.
+    """
+    for url in urls:
+        try:
+            crawl_page(url, follow_links)
+        except Exception as e:
+            print(f"[ERROR] ❌ scrape_page_batch failed for {url}: {e}")
+            scrape_page.apply_async((url,), {"admitted": True, "follow_links": follow_links}, countdown=180)
+
+
+def _enqueue_discovered(urls):
+    urls = unique_by_canonical(urls)
+    new_urls = [url for url, is_new in zip(urls, seen_urls.add_many(urls)) if is_new]
+    fan_out(new_urls, [], follow_links=False)
+    return len(new_urls)
+
+
+@app.task(bind=True, default_retry_delay=300, max_retries=3)
+def discover_articles(self, sections=None):
+    """Feed article URLs from sitemaps and archives straight to ``scrape_page``.
+
+    Sections with neither are link-crawled from their seed as before.
+    """
+    sections = sections or ALLOWED_SEED_PREFIXES
+    if not is_sitemap_mode():
+        for section in sections:
+            scrape_page.delay(section)
+        return
+
+    try:
+        covered = set()
+        found = admitted = 0
+        pending = []
+        for _, url, _ in discover(sections, covered=covered):
+            found += 1
+            pending.append(url)
+            if len(pending) >= DISCOVERY_ENQUEUE_CHUNK:
+                admitted += _enqueue_discovered(pending)
+                pending = []
+        admitted += _enqueue_discovered(pending)
+        print(f"[DISCOVERY] {found} article URLs found, {admitted} new")
+
+        for section in sections:
+            if section not in covered:
+                print(f"[DISCOVERY] No sitemap or archive for {section}, link-crawling it")
+                scrape_page.delay(section)
+    except Exception as e:
+        print(f"[ERROR] ❌ discover_articles failed: {e}")
+        self.retry(exc=e)
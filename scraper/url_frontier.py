@@ -1,71 +1,240 @@
-from collections import deque
+import heapq
+import itertools
+import math
 from datetime import datetime, timedelta
 import logging
-from typing import Set, Optional
+from typing import Callable, Optional
 import re
 from config import SCRAPER_MAX_DEPTH, SCRAPER_MAX_AGE_YEARS
+from utils.url_hash_set import UrlHashSet
+from .canonical import canonicalize
 
 logger = logging.getLogger(__name__)
 
+_REMOVED = None  # url slot of a heap entry that was re-prioritised
+
+ARTICLE_DATE_RE = re.compile(r'/(\d{4})/(\d{2})/')
+PAGINATION_RE = re.compile(r'[?&]page=(\d+)')
+
+
+def article_date(url: str) -> Optional[datetime]:
+    """Month an article was published, from its ``/YYYY/MM/`` path."""
+    match = ARTICLE_DATE_RE.search(url)
+    if not match:
+        return None
+    try:
+        return datetime(int(match.group(1)), int(match.group(2)), 1)
+    except ValueError:
+        return None
+
+
+def url_kind(url: str) -> str:
+    """Classify a URL as 'article', 'archive', 'pagination' or 'section'."""
+    if PAGINATION_RE.search(url):
+        return 'pagination'
+    if '/archive/' in url:
+        return 'archive'
+    if article_date(url):
+        return 'article'
+    return 'section'
+
+
+KIND_SCORES = {'article': 3.0, 'archive': 1.5, 'section': 1.0, 'pagination': 0.5}
+
+
+def default_score(url: str, depth: int, parent_yield: int = 0, lastmod: Optional[datetime] = None,
+                  max_age_years: int = SCRAPER_MAX_AGE_YEARS) -> float:
+    """Higher is crawled sooner.
+
+    Fresh article pages whose parent page carried many images come first;
+    deep, old, far-paginated listing pages come last.
+    """
+    score = KIND_SCORES[url_kind(url)] - 0.5 * depth
+
+    published = lastmod or article_date(url)
+    if published:
+        age_years = (datetime.now() - published).days / 365
+        score += 2.0 * max(0.0, 1 - age_years / max(max_age_years, 1))
+
+    page = PAGINATION_RE.search(url)
+    if page:
+        score -= 0.05 * int(page.group(1))
+
+    return score + 0.5 * math.log1p(parent_yield)
+
+
 class URLFrontier:
-    def __init__(self, max_depth: int = SCRAPER_MAX_DEPTH, max_age_years: int = SCRAPER_MAX_AGE_YEARS):
-        self.queue = deque()
-        self.visited = set()
-        self.pending = set()  # Track URLs in queue
+    """Priority queue of URLs to crawl.
+
+    ``queue`` is a binary heap of ``[-score, seq, url, depth]`` entries, so
+    push and pop are O(log n). Re-adding a queued URL with a better score
+    re-prioritises it: the old entry is blanked in place and skipped when
+    popped (lazy deletion) and a new entry is pushed. ``scorer`` takes
+    ``(url, depth, parent_yield, lastmod)`` and returns a score; higher pops
+    first. ``lastmod`` is the sitemap modification date, when known.
+
+    With a ``FrontierJournal`` every add, pop and visit is journaled and the
+    frontier is restored from disk on construction.
+
+    ``entries``, ``visited`` and ``pending`` are keyed on ``canonicalize(url)``
+    so variants of a page are crawled once, but the URL queued, popped and
+    fetched is always the one that was added.
+    """
+
+    def __init__(self, max_depth: int = SCRAPER_MAX_DEPTH, max_age_years: int = SCRAPER_MAX_AGE_YEARS,
+                 scorer: Callable[..., float] = None, journal=None):
+        self.queue = []
+        self.entries = {}  # canonical url -> live heap entry
+        self.visited = UrlHashSet()  # canonical urls
+        self.pending = set()  # canonical urls queued or being crawled
+        self.in_flight = {}  # Popped but not yet visited: url -> (depth, score)
         self.max_depth = max_depth
         self.max_age_years = max_age_years
+        self.scorer = scorer or (lambda url, depth, parent_yield=0, lastmod=None:
+                                 default_score(url, depth, parent_yield, lastmod, max_age_years))
+        self._counter = itertools.count()
+
+        self.journal = None
+        if journal is not None:
+            journal.restore(self)
+        self.journal = journal
 
     def is_valid_url(self, url: str, seed_url: str = "sheerluxe.com/fashion") -> bool:
         """Validate URL before adding to queue"""
         if not url or not isinstance(url, str):
             return False
-            
+
         url = url.strip()
         if not url.startswith(('http://', 'https://')):
             return False
-            
+
         # Check if URL is descendant of seed URL
         if seed_url not in url:
             return False
-            
+
         # Skip file downloads, images etc
         if url.endswith(('.jpg', '.jpeg', '.png', '.gif', '.pdf', '.zip')):
             return False
-            
+
         # Skip invalid dates
         if '/20' in url and not self.is_valid_date(url):
             return False
-            
+
         # Skip already visited/queued
-        if url in self.visited or url in self.pending:
+        if self.is_known(url):
             return False
-            
+
         return True
 
-    def add_url(self, url: str, depth: int = 0) -> None:
+    def is_visited(self, url: str) -> bool:
+        return canonicalize(url) in self.visited
+
+    def is_known(self, url: str) -> bool:
+        """Visited, queued or being crawled, under any variant of the URL."""
+        key = canonicalize(url)
+        return key in self.visited or key in self.pending
+
+    def _push(self, url: str, depth: int, score: float) -> None:
+        entry = [-score, next(self._counter), url, depth]
+        self.entries[canonicalize(url)] = entry
+        heapq.heappush(self.queue, entry)
+        if self.journal:
+            self.journal.record_add(url, depth, score)
+
+    def add_url(self, url: str, depth: int = 0, parent_yield: int = 0, lastmod: Optional[datetime] = None) -> None:
+        key = canonicalize(url)
+        entry = self.entries.get(key)
+        if entry is not None:
+            # Already queued (perhaps as another variant): only ever move it forward
+            score = self.scorer(entry[2], min(depth, entry[3]), parent_yield, lastmod)
+            if -score < entry[0]:
+                queued_url, entry[2] = entry[2], _REMOVED
+                self._push(queued_url, min(depth, entry[3]), score)
+                if len(self.queue) > 2 * len(self.entries) + 1024:
+                    self._compact()
+            return
+
         if self.is_valid_url(url):
-            self.queue.append((url, depth))
-            self.pending.add(url)
+            self.in_flight.pop(url, None)
+            self._push(url, depth, self.scorer(url, depth, parent_yield, lastmod))
+            self.pending.add(key)
+
+    def restore_url(self, url: str, depth: int, score: float) -> bool:
+        """Queue ``url`` with a known score, skipping validation (journal replay)."""
+        key = canonicalize(url)
+        if key in self.visited:
+            return False
+        self.in_flight.pop(url, None)
+        old = self.entries.get(key)
+        if old is not None:
+            old[2] = _REMOVED
+        self._push(url, depth, score)
+        self.pending.add(key)
+        return True
+
+    def claim_url(self, url: str) -> bool:
+        """Take a specific queued URL out of the queue, as if popped."""
+        entry = self.entries.pop(canonicalize(url), None)
+        if entry is None:
+            return False
+        queued_url, entry[2] = entry[2], _REMOVED
+        self.in_flight[queued_url] = (entry[3], -entry[0])
+        return True
+
+    def _compact(self) -> None:
+        """Drop blanked entries once they outnumber the live ones."""
+        self.queue = [entry for entry in self.queue if entry[2] is not _REMOVED]
+        heapq.heapify(self.queue)
 
     def get_next_url(self) -> Optional[tuple[str, int]]:
-        return self.queue.popleft() if self.queue else None
+        while self.queue:
+            neg_score, _, url, depth = heapq.heappop(self.queue)
+            if url is not _REMOVED:
+                del self.entries[canonicalize(url)]
+                self.in_flight[url] = (depth, -neg_score)
+                if self.journal:
+                    self.journal.record_pop(url)
+                return url, depth
+        return None
+
+    def release_url(self, url: str) -> None:
+        """Forget that ``url`` is being crawled, so it can be queued again."""
+        self.pending.discard(canonicalize(url))
+        self.in_flight.pop(url, None)
 
     def mark_visited(self, url: str):
-        self.visited.add(url)
+        key = canonicalize(url)
+        self.visited.add(key)
+        self.pending.discard(key)
+        self.in_flight.pop(url, None)
+        if self.journal:
+            self.journal.record_visit(url)
+            self.journal.maybe_checkpoint(self)
+
+    def finish(self) -> None:
+        """The crawl is complete: drop the journal so the next run starts fresh."""
+        if self.journal:
+            self.journal.clear()
+            self.journal = None
+
+    def close(self) -> None:
+        """Write a final checkpoint, if journaling."""
+        if self.journal:
+            self.journal.checkpoint(self)
+            self.journal.close()
 
     def is_valid_date(self, url: str) -> bool:
-        date_match = re.search(r'/(\d{4})/(\d{2})/', url)
-        if not date_match:
+        published = article_date(url)
+        if not published:
             return False
 
-        article_date = datetime(int(date_match.group(1)), int(date_match.group(2)), 1)
         cutoff_date = datetime.now() - timedelta(days=365 * self.max_age_years)
-        return article_date >= cutoff_date
+        return published >= cutoff_date
 
     @property
     def has_urls(self) -> bool:
-        return len(self.queue) > 0
+        return len(self.entries) > 0
 
     @property
     def url_count(self) -> int:
-        return len(self.queue)
\ No newline at end of file
+        return len(self.entries)
@@ -1,51 +1,132 @@
-import requests
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin
+import os
+from .canonical import unique_by_canonical
+from .extraction import extract_page, best_image_url, StreamingExtractor, STREAM_CHUNK_SIZE
+from .http_client import fetch, is_permanent_failure
+from .rate_limiter import RateLimitTimeout, HostThrottled
+from . import metrics
+from . import page_cache
+
+# Parse pages while they download instead of after the whole body arrives.
+FETCH_STREAMING = os.environ.get("FETCH_STREAMING", "1") == "1"
+
+SUPPORTED_IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".webp")
+
+
+def is_supported_image_url(image_url):
+    ext = os.path.splitext(image_url.split("?")[0])[1].lower()
+    return ext in SUPPORTED_IMAGE_EXTENSIONS
+
+
+def extract_urls_and_images(html, base_url):
+    return select_urls_and_images(extract_page(html, base_url), base_url)
+
+
+def select_urls_and_images(page, base_url):
+    """Crawlable links and sheerluxe images on ``page``, as found.
+
+    Variants of one URL (see ``canonicalize``) are collapsed to the first
+    one seen; the URLs themselves are never rewritten.
+    """
+    urls = set()
+    images = set()
+
+    # Extract and print all <a> links
+    raw_links = unique_by_canonical(page["links"])
+    print(f"[PARSE] {base_url} → Found {len(raw_links)} raw <a> tags")
+
+    for full_url in raw_links:
+        print(f"  ↳ [LINK] {full_url}")
+        if "sheerluxe.com/fashion" in full_url:
+            urls.add(full_url)
+
+    raw_imgs = page["images"]
+    print(f"[PARSE] {base_url} → Found {len(raw_imgs)} raw <img> tags")
+
+    resolved = (best_image_url(img, base_url) for img in raw_imgs)
+    for full_img_url in unique_by_canonical(url for url in resolved if url):
+        print(f"  🖼️ [IMAGE] {full_img_url}")
+        if "sheerluxe.com" in full_img_url:
+            images.add(full_img_url)
+
+    return urls, images
+
+
+def stream_extract(response, base_url):
+    """Parse a ``stream=True`` response while it downloads.
+
+    Stops at STREAM_MAX_BODY_BYTES or once the content region has closed.
+    Returns the page dict and the hash of the bytes read.
+    """
+    content_type = response.headers.get("Content-Type", "")
+    encoding = response.encoding if "charset" in content_type.lower() else None
+    extractor = StreamingExtractor(base_url, encoding=encoding)
+    for chunk in response.iter_content(STREAM_CHUNK_SIZE):
+        extractor.feed(chunk)
+        if extractor.done:
+            break
+    page = extractor.close()
+
+    if extractor.truncated:
+        print(f"[STREAM] {base_url} → Body cap hit after {extractor.bytes_read} bytes")
+        metrics.incr("stream_truncated")
+    elif extractor.done:
+        metrics.incr("stream_early_stop")
+    metrics.incr("stream_bytes_read", extractor.bytes_read)
+    return page, extractor.content_hash
+
 
 def fetch_and_extract_urls_and_images(base_url):
     try:
-        response = requests.get(base_url, timeout=10)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, 'html.parser')
-
-        urls = set()
-        images = set()
-
-        # Extract and print all <a> links
-        raw_links = soup.find_all("a", href=True)
-        print(f"[PARSE] {base_url} → Found {len(raw_links)} raw <a> tags")
-
-        for a in raw_links:
-            href = a['href']
-            full_url = urljoin(base_url, href)
-            print(f"  ↳ [LINK] {full_url}")
-            if "sheerluxe.com/fashion" in full_url:
-                urls.add(full_url)
-
-        raw_imgs = soup.find_all("img", src=True)
-        print(f"[PARSE] {base_url} → Found {len(raw_imgs)} raw <img> tags")
-
-        for img in raw_imgs:
-            src = img['src']
-            full_img_url = urljoin(base_url, src)
-            print(f"  🖼️ [IMAGE] {full_img_url}")
-            if "sheerluxe.com" in full_img_url:
-                images.add(full_img_url)
+        cached = page_cache.get(base_url)
+        response = fetch(base_url, headers=page_cache.conditional_headers(cached), stream=FETCH_STREAMING)
+
+        try:
+            if response.throttled:
+                # Not an empty page: the caller retries it once the host's block lifts
+                raise HostThrottled(f"{base_url} throttled with {response.status_code}")
+            if response.status_code == 304 and cached:
+                print(f"[CACHE] {base_url} → 304 Not Modified, reusing {len(cached['urls'])} URLs, {len(cached['images'])} images")
+                page_cache.refresh(base_url, response.headers, cached)
+                return cached["urls"], cached["images"]
+
+            response.raise_for_status()
+            if FETCH_STREAMING:
+                page, content_hash = stream_extract(response, base_url)
+            else:
+                page, content_hash = None, page_cache.hash_content(response.content)
+        finally:
+            response.close()
+
+        if cached and cached["content_hash"] == content_hash:
+            print(f"[CACHE] {base_url} → Unchanged content, reusing {len(cached['urls'])} URLs, {len(cached['images'])} images")
+            page_cache.refresh(base_url, response.headers, cached)
+            return cached["urls"], cached["images"]
+
+        if page is None:
+            page = extract_page(response.text, base_url)
+        urls, images = select_urls_and_images(page, base_url)
+        page_cache.save(base_url, response.headers, content_hash, urls, images)
 
         print(f"[RESULT] {base_url} → {len(urls)} valid URLs, {len(images)} valid images")
         return urls, images
 
+    except RateLimitTimeout:
+        # The page was never fetched (or was refused); the caller's retry picks it up once the host recovers
+        raise
     except Exception as e:
         print(f"[ERROR] Failed to parse {base_url}: {e}")
         return set(), set()
 
 def download_image_file(image_url):
-    import requests
-    try:
-        response = requests.get(image_url, timeout=10)
-        response.raise_for_status()
-        return response.content
-    except Exception as e:
-        print(f"[ERROR] Failed to download image {image_url}: {e}")
+    """Image bytes, or None when the server says the image is gone for good.
+
+    Network errors, 5xx answers, throttling and rate-limit timeouts are
+    raised, so the caller retries the image instead of dropping it.
+    """
+    response = fetch(image_url)
+    if is_permanent_failure(response.status_code):
+        print(f"[SKIP] {image_url} returned {response.status_code}")
         return None
+    response.raise_for_status()
+    return response.content
 
@@ -0,0 +1,75 @@
+import io
+import os
+import sys
+
+import pytest
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(ROOT, "tests", "fixtures")
+
+sys.path.insert(0, ROOT)
+
+# Clients are built at import time; nothing here connects to them.
+os.environ.setdefault("REDIS_HOST", "localhost")
+os.environ.setdefault("REDIS_PORT", "6379")
+os.environ.setdefault("REDIS_PASSWORD", "test")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_KEY", "test.test.test")
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES, name), "rb") as f:
+        return f.read()
+
+
+class _Raw(io.BytesIO):
+    decode_content = False
+
+
+class FakeResponse:
+    """The parts of ``requests.Response`` the crawler reads."""
+
+    def __init__(self, body=b"", status_code=200):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.throttled = status_code in (429, 503)
+        self.headers = {}
+        self.content = body
+        self.text = body.decode("utf-8", errors="replace")
+        self.raw = _Raw(body)
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise requests.HTTPError(f"{self.status_code} Error")
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+@pytest.fixture
+def stub_fetch(monkeypatch):
+    """Serve ``{url: fixture name}`` through ``module.fetch``; anything else is a 404.
+
+    Returns ``install(module, routes)``, which returns the list of fetched URLs.
+    """
+    def install(module, routes):
+        fetched = []
+
+        def fetch(url, **kwargs):
+            fetched.append(url)
+            if url not in routes:
+                return FakeResponse(status_code=404)
+            return FakeResponse(read_fixture(routes[url]))
+
+        monkeypatch.setattr(module, "fetch", fetch)
+        return fetched
+
+    return install
@@ -0,0 +1,70 @@
+"""Upsert bisection: only input errors are split, everything else fails the group."""
+import pytest
+
+from scraper import bulk_writer
+
+
+class APIError(Exception):
+    def __init__(self, code):
+        super().__init__(code)
+        self.code = code
+
+
+class FakeTable:
+    def __init__(self, client):
+        self.client = client
+
+    def upsert(self, records, on_conflict):
+        self.records = records
+        return self
+
+    def execute(self):
+        self.client.calls.append(len(self.records))
+        error = self.client.error_for(self.records)
+        if error:
+            raise error
+
+
+class FakeClient:
+    def __init__(self, error_for):
+        self.error_for = error_for
+        self.calls = []
+
+    def table(self, name):
+        return FakeTable(self)
+
+
+def rows(n):
+    return [{"image_url": f"https://img/{i}.jpg", "metadata": {}} for i in range(n)]
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(bulk_writer.time, "sleep", lambda seconds: None)
+
+
+def test_constraint_error_is_bisected_to_the_bad_row():
+    bad = "https://img/5.jpg"
+    client = FakeClient(lambda records: APIError("23502") if any(r["image_url"] == bad for r in records) else None)
+
+    failed = bulk_writer.upsert_with_bisect(client, "moodboard_items", rows(8))
+
+    assert [r["image_url"] for r in failed] == [bad]
+    assert len(client.calls) < 2 * 8
+
+
+def test_server_error_fails_the_group_without_bisecting():
+    client = FakeClient(lambda records: APIError("503"))
+
+    failed = bulk_writer.upsert_with_bisect(client, "moodboard_items", rows(200))
+
+    assert len(failed) == 200
+    assert client.calls == [200] * (bulk_writer.DB_WRITE_RETRIES + 1)
+
+
+def test_transient_error_is_retried():
+    outcomes = iter([TimeoutError("read timeout"), None])
+    client = FakeClient(lambda records: next(outcomes))
+
+    assert bulk_writer.upsert_with_bisect(client, "moodboard_items", rows(10)) == []
+    assert client.calls == [10, 10]
@@ -0,0 +1,59 @@
+"""Canonical URL keys."""
+import pytest
+
+from scraper import canonical
+from scraper.canonical import canonicalize, unique_by_canonical
+
+CASES = [
+    # Tracking parameters go, the rest are sorted with their encoding kept
+    ("https://sheerluxe.com/fashion/a?utm_source=x&utm_medium=y", "https://sheerluxe.com/fashion/a"),
+    ("https://sheerluxe.com/fashion/a?page=2&fbclid=abc&gclid=d", "https://sheerluxe.com/fashion/a?page=2"),
+    ("https://sheerluxe.com/fashion/a?b=2&a=1&_ga=x", "https://sheerluxe.com/fashion/a?a=1&b=2"),
+    ("https://sheerluxe.com/search?q=a%20b&utm_campaign=z", "https://sheerluxe.com/search?q=a%20b"),
+    # Fragments
+    ("https://sheerluxe.com/fashion/a#comments", "https://sheerluxe.com/fashion/a"),
+    ("https://sheerluxe.com/fashion/a#", "https://sheerluxe.com/fashion/a"),
+    # Host rules: https, www. and trailing slash
+    ("http://www.sheerluxe.com/fashion/a/", "https://sheerluxe.com/fashion/a"),
+    ("HTTPS://WWW.SheerLuxe.com:443/fashion/a", "https://sheerluxe.com/fashion/a"),
+    ("https://images.sheerluxe.com/look.jpg", "https://images.sheerluxe.com/look.jpg"),
+    ("https://sheerluxe.com/", "https://sheerluxe.com/"),
+    ("https://sheerluxe.com", "https://sheerluxe.com/"),
+    # Hosts without a rule keep their scheme, www. and trailing slash
+    ("http://www.example.com/a/?utm_source=x", "http://www.example.com/a/"),
+    ("https://example.com:8443/a#top", "https://example.com:8443/a"),
+    # Not http(s): untouched
+    ("mailto:style@sheerluxe.com", "mailto:style@sheerluxe.com"),
+    ("", ""),
+]
+
+
+@pytest.mark.parametrize("url, expected", CASES)
+def test_canonical_form(url, expected):
+    assert canonicalize(url) == expected
+
+
+@pytest.mark.parametrize("url", [url for url, _ in CASES])
+def test_canonicalize_is_idempotent(url):
+    assert canonicalize(canonicalize(url)) == canonicalize(url)
+
+
+def test_drop_params_only_apply_to_their_host(monkeypatch):
+    rule = {**canonical.DEFAULT_RULE, "https": True, "drop_params": {"w", "q"}}
+    monkeypatch.setitem(canonical._rules, "cdn.example.com", rule)
+    canonicalize.cache_clear()
+    try:
+        assert canonicalize("http://img.cdn.example.com/a.jpg?w=640&q=80&v=3") == "https://img.cdn.example.com/a.jpg?v=3"
+        assert canonicalize("https://other.example.org/a.jpg?w=640") == "https://other.example.org/a.jpg?w=640"
+    finally:
+        canonicalize.cache_clear()
+
+
+def test_unique_by_canonical_keeps_the_first_url_as_found():
+    urls = [
+        "https://sheerluxe.com/fashion/a?utm_source=x",
+        "https://www.sheerluxe.com/fashion/a/",
+        "https://sheerluxe.com/fashion/b",
+    ]
+
+    assert unique_by_canonical(urls) == [urls[0], urls[2]]
@@ -0,0 +1,45 @@
+"""Seen filters: legacy-set fallback and migration."""
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")  # fakeredis needs it for the bitmap scripts
+
+from scraper import dedup
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    redis = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(dedup, "redis_client", redis)
+    return redis
+
+
+def make_filter(name):
+    return dedup.SeenFilter(name, capacity=10000, key_func=dedup.canonicalize, legacy_set=f"processed_{name}")
+
+
+def test_legacy_set_counts_as_seen_until_migrated(redis):
+    redis.sadd("processed_urls", "https://sheerluxe.com/fashion/a?utm_source=x", "https://sheerluxe.com/fashion/b")
+    urls = make_filter("urls")
+
+    assert urls.add_many([
+        "https://sheerluxe.com/fashion/a?utm_source=x",
+        "https://sheerluxe.com/fashion/b",
+        "https://sheerluxe.com/fashion/c",
+    ]) == [False, False, True]
+
+
+def test_migration_copies_legacy_set_and_stops_fallback(redis, monkeypatch):
+    members = [f"https://sheerluxe.com/fashion/{n}" for n in range(25)]
+    redis.sadd("processed_urls", *members)
+    monkeypatch.setattr(dedup, "LEGACY_MIGRATION_BATCH", 10)
+    urls = make_filter("urls")
+
+    dedup.migrate_legacy_sets([urls])
+
+    assert redis.exists(urls.migrated_key)
+    assert not redis.exists("seen:legacy_migration:lock")
+    redis.delete("processed_urls")
+    fresh = make_filter("urls")
+    assert not fresh.needs_legacy_set()
+    assert fresh.add_many(members + ["https://sheerluxe.com/fashion/new"]) == [False] * 25 + [True]
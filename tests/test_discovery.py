@@ -0,0 +1,102 @@
+import io
+from datetime import datetime
+
+from conftest import read_fixture
+from scraper import discovery
+from scraper.discovery import discover, iter_archive_urls, iter_sitemap_urls, parse_sitemap
+
+
+def test_parse_sitemap_reads_page_loc_not_image_loc():
+    entries = list(parse_sitemap(io.BytesIO(read_fixture("sitemap.xml"))))
+
+    assert entries == [
+        ("url", "https://sheerluxe.com/fashion/trends/spring-edit", datetime(2025, 3, 1, 8, 30)),
+        ("url", "https://sheerluxe.com/fashion/denim-guide", datetime(2024, 11, 20)),
+        ("url", "https://sheerluxe.com/beauty/skincare-routine", None),
+    ]
+
+
+def test_parse_sitemap_index():
+    entries = list(parse_sitemap(io.BytesIO(read_fixture("sitemap_index.xml"))))
+
+    assert entries == [
+        ("sitemap", "https://sheerluxe.com/sitemap-articles.xml", datetime(2025, 3, 2)),
+        ("sitemap", "https://sheerluxe.com/sitemap-archive.xml.gz", None),
+    ]
+
+
+def test_parse_sitemap_gzip():
+    entries = list(parse_sitemap(io.BytesIO(read_fixture("sitemap_archive.xml.gz"))))
+
+    assert entries == [
+        ("url", "https://sheerluxe.com/fashion/what-to-wear-to-a-wedding", datetime(2025, 1, 15)),
+    ]
+
+
+def test_parse_sitemap_ignores_other_namespaces():
+    body = b"""<?xml version="1.0"?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" xmlns:x="urn:example">
+  <url><x:loc>https://sheerluxe.com/wrong</x:loc><loc>https://sheerluxe.com/right</loc></url>
+  <x:url><loc>https://sheerluxe.com/not-an-entry</loc></x:url>
+</urlset>"""
+
+    assert list(parse_sitemap(io.BytesIO(body))) == [("url", "https://sheerluxe.com/right", None)]
+
+
+def test_iter_sitemap_urls_follows_index_and_gzip(stub_fetch):
+    fetched = stub_fetch(discovery, {
+        "https://sheerluxe.com/sitemap_index.xml": "sitemap_index.xml",
+        "https://sheerluxe.com/sitemap-articles.xml": "sitemap.xml",
+        "https://sheerluxe.com/sitemap-archive.xml.gz": "sitemap_archive.xml.gz",
+    })
+
+    urls = [url for url, _ in iter_sitemap_urls(["https://sheerluxe.com/sitemap_index.xml"])]
+
+    assert urls == [
+        "https://sheerluxe.com/fashion/trends/spring-edit",
+        "https://sheerluxe.com/fashion/denim-guide",
+        "https://sheerluxe.com/beauty/skincare-routine",
+        "https://sheerluxe.com/fashion/what-to-wear-to-a-wedding",
+    ]
+    assert len(fetched) == 3
+
+
+def test_iter_archive_urls_paginates_until_nothing_new(stub_fetch):
+    fetched = stub_fetch(discovery, {
+        "https://sheerluxe.com/fashion/archive/2025": "archive_page_1.html",
+        "https://sheerluxe.com/fashion/archive/2025?page=2": "archive_page_2.html",
+        "https://sheerluxe.com/fashion/archive/2025?page=3": "archive_page_3.html",
+    })
+
+    urls = [url for url, _ in iter_archive_urls("https://sheerluxe.com/fashion", [2025])]
+
+    assert urls == [
+        "https://sheerluxe.com/fashion/trends/spring-edit",
+        "https://sheerluxe.com/fashion/denim-guide",
+        "https://sheerluxe.com/fashion/what-to-wear-to-a-wedding",
+    ]
+    # Page 3 has nothing new, so page 4 is never asked for
+    assert fetched[-1] == "https://sheerluxe.com/fashion/archive/2025?page=3"
+
+
+def test_discover_reads_each_host_sitemap_once(stub_fetch, monkeypatch):
+    monkeypatch.setattr(discovery, "DISCOVERY_ARCHIVE_SECTIONS", [])
+    fetched = stub_fetch(discovery, {
+        "https://sheerluxe.com/sitemap_index.xml": "sitemap_index.xml",
+        "https://sheerluxe.com/sitemap-articles.xml": "sitemap.xml",
+        "https://sheerluxe.com/sitemap-archive.xml.gz": "sitemap_archive.xml.gz",
+    })
+    covered = set()
+
+    found = list(discover(
+        ["https://sheerluxe.com/fashion", "https://sheerluxe.com/fashion/trends", "https://sheerluxe.com/home"],
+        max_age_years=100, covered=covered,
+    ))
+
+    assert [(section, url) for section, url, _ in found] == [
+        ("https://sheerluxe.com/fashion/trends", "https://sheerluxe.com/fashion/trends/spring-edit"),
+        ("https://sheerluxe.com/fashion", "https://sheerluxe.com/fashion/denim-guide"),
+        ("https://sheerluxe.com/fashion", "https://sheerluxe.com/fashion/what-to-wear-to-a-wedding"),
+    ]
+    assert covered == {"https://sheerluxe.com/fashion", "https://sheerluxe.com/fashion/trends"}
+    assert fetched.count("https://sheerluxe.com/sitemap-articles.xml") == 1
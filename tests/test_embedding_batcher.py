@@ -0,0 +1,109 @@
+from concurrent.futures import TimeoutError
+
+import pytest
+
+from scraper.embedding_batcher import EmbeddingBatcher
+from scraper.exceptions import EmbeddingGenerationError
+
+
+class BadRequest(Exception):
+    status_code = 400
+
+
+class Unavailable(Exception):
+    status_code = 503
+
+
+class FakeEmbeddings:
+    """Embeds a text as ``[len(text)]``; rejects any request containing a text in ``reject``."""
+
+    def __init__(self, reject=(), error=BadRequest):
+        self.reject = set(reject)
+        self.error = error
+        self.requests = []
+
+    def create(self, input, model):
+        self.requests.append(list(input))
+        if self.reject.intersection(input):
+            raise self.error("rejected")
+        return type("Response", (), {"data": [
+            type("Item", (), {"index": i, "embedding": [len(text)]}) for i, text in enumerate(input)
+        ]})
+
+
+def batcher_for(embeddings):
+    client = type("Client", (), {"embeddings": embeddings})
+    return EmbeddingBatcher(client, "test-model", max_batch=8, max_delay=0.05)
+
+
+def outcomes(futures):
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result(5))
+        except Exception as e:
+            results.append(type(e))
+    return results
+
+
+def test_bad_input_only_fails_its_own_caller():
+    embeddings = FakeEmbeddings(reject={"bad"})
+    batcher = batcher_for(embeddings)
+
+    futures = [batcher.submit(text) for text in ["a", "bb", "bad", "cccc", "d"]]
+
+    assert outcomes(futures) == [[1], [2], BadRequest, [4], [1]]
+
+
+def test_service_errors_fail_the_batch_without_bisecting():
+    embeddings = FakeEmbeddings(reject={"a"}, error=Unavailable)
+    batcher = batcher_for(embeddings)
+
+    futures = [batcher.submit(text) for text in ["a", "bb", "ccc"]]
+
+    assert outcomes(futures) == [Unavailable] * 3
+    assert len(embeddings.requests) == 1
+
+
+def test_embed_times_out():
+    batcher = batcher_for(FakeEmbeddings())
+    batcher.max_delay = 10  # Hold the batch open past the caller's timeout
+
+    with pytest.raises(TimeoutError):
+        batcher.embed("slow", timeout=0.1)
+
+
+class ShortEmbeddings(FakeEmbeddings):
+    """Drops the last vector of every response."""
+
+    def create(self, input, model):
+        response = super().create(input, model)
+        response.data = response.data[:-1]
+        return response
+
+
+class BrokenEmbeddings(FakeEmbeddings):
+    """Fails the first request with something the batcher doesn't handle."""
+
+    def create(self, input, model):
+        if not self.requests:
+            self.requests.append(list(input))
+            return None  # response.data raises AttributeError
+        return super().create(input, model)
+
+
+def test_short_response_fails_the_missing_input():
+    batcher = batcher_for(ShortEmbeddings())
+
+    futures = [batcher.submit(text) for text in ["a", "bb", "ccc"]]
+
+    assert outcomes(futures) == [[1], [2], EmbeddingGenerationError]
+
+
+def test_unexpected_error_fails_only_its_batch():
+    batcher = batcher_for(BrokenEmbeddings())
+
+    first = batcher.submit("a")
+    assert outcomes([first]) == [AttributeError]
+
+    assert outcomes([batcher.submit("bb")]) == [[2]]
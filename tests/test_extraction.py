@@ -0,0 +1,104 @@
+import pytest
+
+from conftest import read_fixture
+from scraper.extraction import BACKENDS, StreamingExtractor, best_image_url, etree, extract_bs4, extract_page
+from scraper.utils import select_urls_and_images
+
+BASE_URL = "https://sheerluxe.com/fashion/spring-edit"
+PAGES = ["pages/article.html", "pages/listing.html", "pages/messy.html"]
+
+needs_lxml = pytest.mark.skipif(etree is None, reason="lxml is not installed")
+
+
+def stream_in_chunks(body, chunk_size):
+    extractor = StreamingExtractor(BASE_URL, max_bytes=0, stop_after=())
+    for start in range(0, len(body), chunk_size):
+        extractor.feed(body[start:start + chunk_size])
+    return extractor.close()
+
+
+@needs_lxml
+@pytest.mark.parametrize("page", PAGES)
+@pytest.mark.parametrize("backend", ["lxml", "stream"])
+def test_backend_matches_bs4_reference(page, backend):
+    html = read_fixture(page).decode("utf-8")
+
+    assert extract_page(html, BASE_URL, backend=backend) == extract_bs4(html, BASE_URL)
+
+
+@needs_lxml
+@pytest.mark.parametrize("page", PAGES)
+@pytest.mark.parametrize("chunk_size", [1, 7, 4096])
+def test_streaming_extractor_matches_bs4_reference(page, chunk_size):
+    body = read_fixture(page)
+
+    assert stream_in_chunks(body, chunk_size) == extract_bs4(body.decode("utf-8"), BASE_URL)
+
+
+@pytest.mark.parametrize("backend", sorted(BACKENDS))
+def test_only_images_with_src_are_emitted(backend):
+    if backend != "bs4" and etree is None:
+        pytest.skip("lxml is not installed")
+    page = extract_page(read_fixture("pages/article.html").decode("utf-8"), BASE_URL, backend=backend)
+
+    assert [image["src"] for image in page["images"]] == [
+        "https://images.sheerluxe.com/spring-edit-hero.jpg",
+        "/images/look-1.jpg",
+        "//images.sheerluxe.com/look-2.jpg",
+        "",
+    ]
+
+
+def test_best_image_url_resolves_src_and_never_falls_back_to_srcset():
+    page = extract_bs4(read_fixture("pages/article.html").decode("utf-8"), BASE_URL)
+
+    assert [best_image_url(image, BASE_URL) for image in page["images"]] == [
+        "https://images.sheerluxe.com/spring-edit-hero.jpg",
+        "https://sheerluxe.com/images/look-1.jpg",
+        "https://images.sheerluxe.com/look-2.jpg",
+        None,
+    ]
+    assert page["images"][0]["srcset"] == [
+        ("https://images.sheerluxe.com/spring-edit-hero-640.jpg", 640.0),
+        ("https://images.sheerluxe.com/spring-edit-hero-1280.jpg", 1280.0),
+    ]
+
+
+def test_select_urls_and_images_skips_images_without_a_url():
+    page = extract_bs4(read_fixture("pages/article.html").decode("utf-8"), BASE_URL)
+
+    urls, images = select_urls_and_images(page, BASE_URL)
+
+    assert urls == {
+        "https://sheerluxe.com/fashion",
+        "https://sheerluxe.com/fashion/trench-coats",
+        "https://sheerluxe.com/fashion?page=2",
+    }
+    assert images == {
+        "https://images.sheerluxe.com/spring-edit-hero.jpg",
+        "https://sheerluxe.com/images/look-1.jpg",
+        "https://images.sheerluxe.com/look-2.jpg",
+    }
+
+
+@pytest.mark.parametrize("extra, truncated", [(0, False), (1, True)])
+def test_body_cap_truncates_only_past_max_bytes(extra, truncated):
+    body = read_fixture("pages/article.html")
+    extractor = StreamingExtractor(BASE_URL, max_bytes=len(body), stop_after=())
+    for start in range(0, len(body) + extra, 100):
+        extractor.feed((body + b" " * extra)[start:start + 100])
+
+    assert extractor.truncated is truncated
+    assert extractor.bytes_read == len(body)
+    assert extractor.close() == extract_bs4(body.decode("utf-8"), BASE_URL)
+
+
+@needs_lxml
+def test_links_are_emitted_before_the_body_ends():
+    body = read_fixture("pages/article.html")
+    extractor = StreamingExtractor(BASE_URL, max_bytes=0, stop_after=())
+    half = body.index(b"</body>")
+
+    emitted = [value for kind, value in extractor.feed(body[:half]) if kind == "link"]
+
+    assert emitted and emitted == extractor.page["links"]
@@ -0,0 +1,26 @@
+"""Page fetches: a throttled page is retried, not recorded as empty."""
+import pytest
+
+from conftest import FakeResponse
+from scraper import utils
+from scraper.rate_limiter import HostThrottled
+
+
+@pytest.fixture(autouse=True)
+def no_page_cache(monkeypatch):
+    monkeypatch.setattr(utils.page_cache, "get", lambda url: None)
+    monkeypatch.setattr(utils.page_cache, "save", lambda *args, **kwargs: None)
+
+
+@pytest.mark.parametrize("status", [429, 503])
+def test_throttled_page_raises_for_retry(monkeypatch, status):
+    monkeypatch.setattr(utils, "fetch", lambda url, **kwargs: FakeResponse(status_code=status))
+
+    with pytest.raises(HostThrottled):
+        utils.fetch_and_extract_urls_and_images("https://sheerluxe.com/fashion")
+
+
+def test_server_error_is_still_an_empty_page(monkeypatch):
+    monkeypatch.setattr(utils, "fetch", lambda url, **kwargs: FakeResponse(status_code=500))
+
+    assert utils.fetch_and_extract_urls_and_images("https://sheerluxe.com/fashion") == (set(), set())
@@ -0,0 +1,75 @@
+"""Frontier persistence: journal replay, checkpoints and clearing."""
+import os
+
+import pytest
+
+pytest.importorskip("config")  # the deployment's settings module, not checked in
+
+from scraper.frontier_journal import FrontierJournal
+from scraper.url_frontier import URLFrontier
+
+PAGES = [f"https://sheerluxe.com/fashion/look-{n}" for n in range(5)]
+
+
+def frontier(state_dir):
+    return URLFrontier(journal=FrontierJournal(str(state_dir)))
+
+
+def drain(frontier):
+    urls = []
+    while (popped := frontier.get_next_url()) is not None:
+        urls.append(popped[0])
+    return urls
+
+
+def test_journal_replays_after_a_crash_mid_append(tmp_path):
+    crashed = frontier(tmp_path)
+    for url in PAGES:
+        crashed.add_url(url)
+    first, _ = crashed.get_next_url()
+    crashed.mark_visited(first)
+    in_flight, _ = crashed.get_next_url()
+    # Killed while writing the next line: no checkpoint, no close
+    with open(os.path.join(tmp_path, "journal.log"), "a", encoding="utf-8") as f:
+        f.write("A\t0\t1.0\thttps://sheerluxe.com/fashion/torn")
+
+    restored = frontier(tmp_path)
+
+    assert restored.is_visited(first)
+    assert sorted(drain(restored)) == sorted(set(PAGES) - {first})
+    assert in_flight in PAGES
+    assert not restored.is_known("https://sheerluxe.com/fashion/torn")
+
+
+def test_checkpoint_compacts_and_the_journal_replays_on_top(tmp_path):
+    before = frontier(tmp_path)
+    for url in PAGES[:3]:
+        before.add_url(url)
+    visited, _ = before.get_next_url()
+    before.mark_visited(visited)
+    before.journal.checkpoint(before)
+    assert os.path.getsize(os.path.join(tmp_path, "journal.log")) == 0
+
+    before.add_url(PAGES[3])
+    later, _ = before.get_next_url()
+    before.mark_visited(later)
+
+    restored = frontier(tmp_path)
+    assert restored.is_visited(visited) and restored.is_visited(later)
+    assert sorted(drain(restored)) == sorted(set(PAGES[:4]) - {visited, later})
+
+
+def test_finish_clears_state_for_the_next_run(tmp_path):
+    done = frontier(tmp_path)
+    done.add_url(PAGES[0])
+    done.mark_visited(drain(done)[0])
+    done.journal.checkpoint(done)
+
+    done.finish()
+    done.close()
+
+    assert not any(os.listdir(tmp_path))
+    fresh = frontier(tmp_path)
+    assert not fresh.is_known(PAGES[0])
+    fresh.add_url(PAGES[0])
+    assert drain(fresh) == [PAGES[0]]
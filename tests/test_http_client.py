@@ -0,0 +1,66 @@
+"""Pooled session: cached DNS with per-address fallback."""
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from scraper import http_client
+
+
+class Ok(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = HTTPServer(("127.0.0.1", 0), Ok)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def lookups(monkeypatch):
+    """Resolve ``crawl.test`` to IPv6 loopback, where nothing listens, then to loopback."""
+    real_getaddrinfo = socket.getaddrinfo
+    calls = []
+
+    def getaddrinfo(host, port, *args, **kwargs):
+        if host != "crawl.test":
+            return real_getaddrinfo(host, port, *args, **kwargs)
+        calls.append(host)
+        return [
+            (socket.AF_INET6, socket.SOCK_STREAM, 6, "", ("::1", port, 0, 0)),
+            (socket.AF_INET, socket.SOCK_STREAM, 6, "", ("127.0.0.1", port)),
+            (socket.AF_INET, socket.SOCK_STREAM, 6, "", ("127.0.0.1", port)),
+        ]
+
+    monkeypatch.setattr(socket, "getaddrinfo", getaddrinfo)
+    return calls
+
+
+def test_dns_cache_keeps_every_address_in_order(lookups):
+    cache = http_client.DNSCache(ttl=60)
+
+    assert cache.resolve("crawl.test", 80) == ["::1", "127.0.0.1"]
+    assert cache.resolve("crawl.test", 80) == ["::1", "127.0.0.1"]
+    assert lookups == ["crawl.test"]
+
+
+def test_connection_falls_back_to_the_next_address(lookups, server):
+    session = http_client._build_session()
+
+    response = session.get(f"http://crawl.test:{server}/", timeout=2)
+
+    assert response.text == "ok"
+    assert lookups == ["crawl.test"]
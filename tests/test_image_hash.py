@@ -0,0 +1,59 @@
+"""dHash dedup index: flat images, near-duplicates and expiry."""
+import io
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+Image = pytest.importorskip("PIL.Image")
+
+from scraper import image_hash
+
+
+def png(pixels, size=(9, 8)):
+    img = Image.new("L", size)
+    img.putdata(pixels)
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    redis = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(image_hash, "redis_client", redis)
+    return redis
+
+
+def test_flat_images_are_not_hashed():
+    assert image_hash.compute_dhash(png([200] * 72)) is None
+    assert image_hash.compute_dhash(png([200, 203] * 36)) is None
+
+
+def test_gradient_is_hashed():
+    assert image_hash.compute_dhash(png([(col * 28) % 256 for _ in range(8) for col in range(9)])) is not None
+
+
+def test_near_duplicate_is_found(redis):
+    original = 0x0F0F_F0F0_1234_5678
+    image_hash.remember(original, "https://img/a.jpg", {"brand": "x"}, "https://storage/a.jpg")
+
+    match = image_hash.find_similar(original ^ 0b101)
+    assert match["image_url"] == "https://img/a.jpg"
+    assert match["distance"] == 2
+    assert "embedding" not in match
+    assert 0 < redis.ttl(image_hash._item_key(original)) <= image_hash.PHASH_TTL_SECONDS
+
+    assert image_hash.find_similar(original ^ 0xFF) is None
+
+
+def test_expired_entry_is_dropped_from_bands(redis):
+    original = 0x1111_2222_3333_4444
+    image_hash.remember(original, "https://img/b.jpg", {}, "https://storage/b.jpg")
+    redis.delete(image_hash._item_key(original))
+
+    assert image_hash.find_similar(original) is None
+    member = f"{original:016x}"
+    assert not any(
+        redis.sismember(image_hash._band_key(i, band), member)
+        for i, band in enumerate(image_hash._bands(original))
+    )
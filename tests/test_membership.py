@@ -0,0 +1,49 @@
+"""Worker membership registry and rendezvous routing."""
+import pytest
+
+from scraper import membership
+from scraper.membership import rendezvous_owner
+
+KEYS = [f"https://sheerluxe.com/fashion/page-{n}" for n in range(2000)]
+
+
+def owners(members):
+    return {key: rendezvous_owner(key, members) for key in KEYS}
+
+
+def test_joining_member_only_takes_urls_it_wins():
+    before = owners(["a", "b", "c"])
+    after = owners(["a", "b", "c", "d"])
+
+    moved = [key for key in KEYS if before[key] != after[key]]
+    assert moved and all(after[key] == "d" for key in moved)
+    assert len(moved) == sum(owner == "d" for owner in after.values())
+
+
+def test_leaving_member_only_gives_up_its_own_urls():
+    before = owners(["a", "b", "c"])
+    after = owners(["a", "b"])
+
+    assert [key for key in KEYS if before[key] != after[key]] == [key for key in KEYS if before[key] == "c"]
+
+
+def test_routing_does_not_depend_on_member_order():
+    assert owners(["c", "a", "b"]) == owners(["a", "b", "c"])
+
+
+def test_heartbeat_prunes_expired_members_and_bumps_the_generation(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    redis = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(membership, "redis_client", redis)
+    monkeypatch.setattr(membership, "_HEARTBEAT", redis.register_script(membership._HEARTBEAT.script))
+    registry = membership.MembershipRegistry()
+
+    first = registry.heartbeat("a")
+    assert registry.heartbeat("a") == first  # a refresh is not a membership change
+    registry.heartbeat("b")
+    redis.zadd(membership.HEARTBEATS_KEY, {"b": 0})  # b stops beating
+
+    assert registry.heartbeat("a") == first + 2
+    assert registry.members == ["a"]
+    assert registry.departed_members() == ["b"]
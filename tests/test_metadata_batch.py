@@ -0,0 +1,146 @@
+"""The Batch API loop end to end, against ``openai_batch_stub`` served in-process."""
+import json
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+httpx = pytest.importorskip("httpx")
+pytest.importorskip("flask")
+
+import openai_batch_stub
+from openai import OpenAI
+from scraper import metadata_batch
+
+
+def image_context(n):
+    return {
+        "image_url": f"https://images.sheerluxe.com/look-{n}.jpg",
+        "alt_text": f"Look {n}",
+        "title": "The Spring Edit",
+        "surrounding_text": "Linen for warmer days",
+        "source_url": "https://sheerluxe.com/fashion/spring-edit",
+        "lease_token": "token",
+    }
+
+
+@pytest.fixture
+def batch_env(monkeypatch):
+    """Fake Redis, the stub behind the OpenAI client, and recorded uploads and lease outcomes."""
+    redis = fakeredis.FakeRedis(decode_responses=True)
+    stub_client = OpenAI(
+        api_key="stub",
+        base_url="http://stub/v1",
+        http_client=httpx.Client(transport=httpx.WSGITransport(app=openai_batch_stub.app)),
+    )
+    calls = {"uploaded": [], "deleted": [], "failed": [], "committed": []}
+    storage = {}
+
+    def upload(image_url, image_bytes):
+        calls["uploaded"].append(image_url)
+        stored_image_url = f"https://storage.test/{len(calls['uploaded'])}.jpg"
+        storage[stored_image_url] = image_bytes
+        return stored_image_url
+
+    monkeypatch.setattr(metadata_batch, "redis_client", redis)
+    monkeypatch.setattr(metadata_batch, "client", stub_client)
+    monkeypatch.setattr(metadata_batch, "upload_image_to_supabase", upload)
+    monkeypatch.setattr(metadata_batch, "download_uploaded_image", storage.get)
+    monkeypatch.setattr(metadata_batch, "delete_uploaded_image", calls["deleted"].append)
+    monkeypatch.setattr(metadata_batch.image_leases, "fail",
+                        lambda image_url, token: calls["failed"].append(image_url))
+    monkeypatch.setattr(metadata_batch.image_leases, "commit",
+                        lambda image_url, token: calls["committed"].append(image_url))
+    monkeypatch.setattr(openai_batch_stub, "FAIL_CUSTOM_IDS", set())
+    monkeypatch.setattr(openai_batch_stub, "TEXT_CUSTOM_IDS", set())
+    return redis, calls
+
+
+def test_batch_round_trip_fails_errored_requests_right_away(batch_env):
+    redis, calls = batch_env
+    for n in range(3):
+        metadata_batch.queue_for_batch(image_context(n), f"image {n}".encode(), image_hash=n)
+    openai_batch_stub.FAIL_CUSTOM_IDS.add(metadata_batch._custom_id(image_context(1)["image_url"]))
+
+    batch_id = metadata_batch.submit_pending_batch()
+    results = metadata_batch.collect_finished_batches()
+
+    assert batch_id is not None
+    assert [(context["image_url"], context["stored_image_url"], context["image_hash"]) for context, _ in results] == [
+        ("https://images.sheerluxe.com/look-0.jpg", "https://storage.test/1.jpg", 0),
+        ("https://images.sheerluxe.com/look-2.jpg", "https://storage.test/3.jpg", 2),
+    ]
+    assert all(metadata == openai_batch_stub.CANNED_METADATA for _, metadata in results)
+    assert calls["failed"] == ["https://images.sheerluxe.com/look-1.jpg"]
+    assert calls["deleted"] == ["https://storage.test/2.jpg"]
+    assert redis.smembers(metadata_batch.ACTIVE_BATCHES_KEY) == set()
+
+
+def test_queue_holds_only_the_context(batch_env):
+    redis, _ = batch_env
+    metadata_batch.queue_for_batch(image_context(0), b"x" * 100_000)
+
+    (raw,) = redis.lrange(metadata_batch.BATCH_QUEUE_KEY, 0, -1)
+    assert json.loads(raw).keys() == {"context"}
+    assert len(raw) < 1000
+
+
+def test_submission_is_split_by_input_file_size(batch_env):
+    redis, _ = batch_env
+    for n in range(3):
+        metadata_batch.queue_for_batch(image_context(n), f"image {n}".encode())
+    first_line = metadata_batch.build_batch_line(
+        json.loads(redis.lindex(metadata_batch.BATCH_QUEUE_KEY, 0))["context"], b"image 0"
+    )
+
+    metadata_batch.submit_pending_batch(max_bytes=len(first_line) + 1)
+
+    left = [json.loads(raw)["context"]["image_url"] for raw in redis.lrange(metadata_batch.BATCH_QUEUE_KEY, 0, -1)]
+    assert left == [
+        "https://images.sheerluxe.com/look-1.jpg",
+        "https://images.sheerluxe.com/look-2.jpg",
+    ]
+    (batch_id,) = redis.smembers(metadata_batch.ACTIVE_BATCHES_KEY)
+    assert len(redis.hgetall(metadata_batch.BATCH_ITEMS_PREFIX + batch_id)) == 1
+
+
+def test_url_queued_twice_is_submitted_once(batch_env):
+    redis, calls = batch_env
+    metadata_batch.queue_for_batch(image_context(0), b"image 0")
+    metadata_batch.queue_for_batch(image_context(0), b"image 0")
+
+    batch_id = metadata_batch.submit_pending_batch()
+
+    assert batch_id is not None
+    assert len(redis.hgetall(metadata_batch.BATCH_ITEMS_PREFIX + batch_id)) == 1
+    assert calls["deleted"] == ["https://storage.test/2.jpg"]
+    assert redis.llen(metadata_batch.BATCH_QUEUE_KEY) == 0
+
+
+def test_non_json_reply_finishes_the_image(batch_env):
+    _, calls = batch_env
+    metadata_batch.queue_for_batch(image_context(0), b"image 0")
+    openai_batch_stub.TEXT_CUSTOM_IDS.add(metadata_batch._custom_id(image_context(0)["image_url"]))
+
+    metadata_batch.submit_pending_batch()
+
+    assert metadata_batch.collect_finished_batches() == []
+    assert calls["failed"] == []
+    assert calls["committed"] == ["https://images.sheerluxe.com/look-0.jpg"]
+    assert calls["deleted"] == ["https://storage.test/1.jpg"]
+
+
+def test_failed_submit_requeues_only_submitted_entries(batch_env, monkeypatch):
+    redis, calls = batch_env
+    redis.rpush(metadata_batch.BATCH_QUEUE_KEY, json.dumps(image_context(9)))  # legacy bare context
+    metadata_batch.queue_for_batch(image_context(0), b"image 0")
+
+    def refuse(**kwargs):
+        raise RuntimeError("upload refused")
+
+    monkeypatch.setattr(metadata_batch.client.files, "create", refuse)
+    with pytest.raises(RuntimeError):
+        metadata_batch.submit_pending_batch()
+
+    left = [json.loads(raw)["context"]["image_url"] for raw in redis.lrange(metadata_batch.BATCH_QUEUE_KEY, 0, -1)]
+    assert left == ["https://images.sheerluxe.com/look-0.jpg"]
+    assert calls["failed"] == ["https://images.sheerluxe.com/look-9.jpg"]
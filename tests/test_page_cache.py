@@ -0,0 +1,36 @@
+"""Conditional-GET cache: validators survive a 304 that omits them."""
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from scraper import page_cache
+
+URL = "https://sheerluxe.com/fashion"
+
+
+@pytest.fixture(autouse=True)
+def redis(monkeypatch):
+    redis = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(page_cache, "redis_client", redis)
+    return redis
+
+
+def test_304_without_validators_keeps_cached_ones():
+    page_cache.save(URL, {"ETag": '"v1"', "Last-Modified": "Tue, 01 Sep 2026 10:00:00 GMT"}, "hash", {"a"}, {"b"})
+
+    page_cache.refresh(URL, {"Date": "Wed, 02 Sep 2026 10:00:00 GMT"}, page_cache.get(URL))
+
+    entry = page_cache.get(URL)
+    assert page_cache.conditional_headers(entry) == {
+        "If-None-Match": '"v1"',
+        "If-Modified-Since": "Tue, 01 Sep 2026 10:00:00 GMT",
+    }
+    assert entry["urls"] == {"a"} and entry["images"] == {"b"}
+
+
+def test_304_with_new_etag_replaces_it():
+    page_cache.save(URL, {"ETag": '"v1"'}, "hash", set(), set())
+
+    page_cache.refresh(URL, {"ETag": '"v2"'}, page_cache.get(URL))
+
+    assert page_cache.get(URL)["etag"] == '"v2"'
@@ -0,0 +1,146 @@
+"""TaskCoordinator: shard streams, batch admission and handoff."""
+import asyncio
+import threading
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")  # fakeredis needs it for the admission and retire scripts
+
+from scraper import membership, task_coordinator
+from scraper.task_coordinator import COMPLETED_URLS_KEY, CONSUMER_GROUP, TaskCoordinator
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    redis = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(membership, "redis_client", redis)
+    monkeypatch.setattr(membership, "_HEARTBEAT", redis.register_script(membership._HEARTBEAT.script))
+    monkeypatch.setattr(task_coordinator, "redis_client", redis)
+    monkeypatch.setattr(membership, "ROUTING_REFRESH_SECONDS", 0)  # every lookup sees the latest generation
+    return redis
+
+
+def worker(worker_id, chunk_size=50):
+    coordinator = TaskCoordinator(chunk_size=chunk_size)
+    coordinator.register(worker_id)
+    return coordinator
+
+
+def urls(count, prefix="page"):
+    return [f"https://sheerluxe.com/fashion/{prefix}-{n}" for n in range(count)]
+
+
+def test_batches_are_claimed_from_the_own_stream_and_acknowledged(redis):
+    a = worker("a", chunk_size=2)
+    pages = urls(3)
+    asyncio.run(a.add_urls(pages))
+
+    first = asyncio.run(a.get_next_batch())
+    second = asyncio.run(a.get_next_batch())
+    assert first + second == pages
+    assert redis.xpending(a.stream_key("a"), CONSUMER_GROUP)["pending"] == 3
+
+    asyncio.run(a.mark_completed(pages))
+    assert redis.xpending(a.stream_key("a"), CONSUMER_GROUP)["pending"] == 0
+    assert redis.xlen(a.stream_key("a")) == 0
+    assert redis.smembers(COMPLETED_URLS_KEY) == set(pages)
+    assert asyncio.run(a.get_next_batch()) == []
+
+
+def test_unacknowledged_entries_are_reclaimed_after_a_crash(redis, monkeypatch):
+    crashed = worker("a", chunk_size=2)
+    pages = urls(3)
+    asyncio.run(crashed.add_urls(pages))
+    claimed = asyncio.run(crashed.get_next_batch())
+
+    restarted = worker("a", chunk_size=2)
+    assert asyncio.run(restarted.get_next_batch()) == pages[2:]  # still within CLAIM_IDLE_MS
+
+    monkeypatch.setattr(task_coordinator, "CLAIM_IDLE_MS", 0)
+    assert asyncio.run(restarted.get_next_batch()) == claimed
+    asyncio.run(restarted.mark_completed(pages))
+    assert redis.xpending(restarted.stream_key("a"), CONSUMER_GROUP)["pending"] == 0
+
+
+def test_admission_enqueues_only_unknown_urls(redis):
+    a = worker("a")
+    b = worker("b")
+    pages = urls(40)
+    asyncio.run(b.mark_completed(pages[:5]))
+
+    admitted = asyncio.run(a.add_urls(pages + pages[10:20]))
+
+    assert admitted == pages[5:]
+    assert asyncio.run(a.add_urls(pages)) == []
+    queued = {
+        fields["url"]: member
+        for member in ("a", "b")
+        for _, fields in redis.xrange(a.stream_key(member))
+    }
+    assert sorted(queued) == sorted(pages[5:])
+    assert all(queued[url] == a.shard_for(url) for url in queued)
+    assert set(queued.values()) == {"a", "b"}
+
+
+def queued(redis, coordinator, member):
+    return [fields["url"] for _, fields in redis.xrange(coordinator.stream_key(member))]
+
+
+def test_join_hands_off_only_the_urls_the_new_worker_wins(redis):
+    a = worker("a", chunk_size=5)
+    pages = urls(60)
+    asyncio.run(a.add_urls(pages))
+    in_flight = asyncio.run(a.get_next_batch())
+
+    b = worker("b")
+    a.heartbeat()
+
+    winners = {url for url in pages if membership.rendezvous_owner(url, ["a", "b"]) == "b"}
+    assert set(queued(redis, b, "b")) == winners - set(in_flight)
+    assert set(queued(redis, a, "a")) == (set(pages) - winners) | set(in_flight)
+    assert redis.xpending(a.stream_key("a"), CONSUMER_GROUP)["pending"] == len(in_flight)
+
+
+def test_handoff_waits_for_a_claim_in_progress(redis):
+    a = worker("a")
+    pages = urls(60)
+    asyncio.run(a.add_urls(pages))
+    worker("b")
+
+    with a._claim_lock:  # the crawl loop is mid-claim
+        handoff = threading.Thread(target=a.heartbeat)
+        handoff.start()
+        handoff.join(0.2)
+        assert handoff.is_alive()
+        assert sorted(queued(redis, a, "a")) == sorted(pages)
+    handoff.join()
+
+    assert 0 < len(queued(redis, a, "b")) < len(pages)
+
+
+def test_departed_stream_is_drained_until_quiet_then_retired(redis, monkeypatch):
+    a = worker("a")
+    b = worker("b", chunk_size=3)
+    pages = urls(40)
+    asyncio.run(a.add_urls(pages))
+    asyncio.run(b.get_next_batch())  # b dies holding these
+    b_stream = b.stream_key("b")
+    b.deregister()
+
+    a.heartbeat()
+    assert redis.xlen(b_stream) == 0
+    assert sorted(queued(redis, a, "a")) == sorted(pages)
+    assert redis.hexists(task_coordinator.DEPARTED_KEY, "b")
+
+    # A writer still routing with the old table
+    redis.xadd(b_stream, {"url": "https://sheerluxe.com/fashion/late"})
+    monkeypatch.setattr(task_coordinator, "DEPARTED_GRACE_SECONDS", 0)
+    a.heartbeat()
+    assert "https://sheerluxe.com/fashion/late" in queued(redis, a, "a")
+    assert redis.exists(b_stream)  # drained this time, so not retired yet
+
+    a.heartbeat()
+    assert not redis.exists(b_stream)
+    assert not redis.hexists(task_coordinator.DEPARTED_KEY, "b")
+    assert "b" not in redis.smembers(membership.KNOWN_MEMBERS_KEY)
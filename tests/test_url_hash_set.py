@@ -0,0 +1,24 @@
+"""UrlHashSet construction, membership and snapshots."""
+from array import array
+
+from utils.url_hash_set import UrlHashSet, hash_url
+
+
+def test_array_is_sorted_and_deduplicated_in_place():
+    hashes = array("Q", [5, 1, 5, 3, 1, 2**64 - 1, 0, 3])
+    urls = UrlHashSet(hashes)
+    assert urls._hashes is hashes
+    assert list(hashes) == [0, 1, 3, 5, 2**64 - 1]
+
+
+def test_membership_survives_save_and_load(tmp_path):
+    urls = UrlHashSet.from_urls(["https://sheerluxe.com/a", "https://sheerluxe.com/b", ""])
+    urls.add("https://sheerluxe.com/c")
+    path = tmp_path / "urls.bin"
+    urls.save(str(path))
+
+    loaded = UrlHashSet.load(str(path))
+    assert len(loaded) == 3
+    assert "https://sheerluxe.com/c" in loaded
+    assert "https://sheerluxe.com/d" not in loaded
+    assert list(loaded._hashes) == sorted(hash_url(f"https://sheerluxe.com/{c}") for c in "abc")
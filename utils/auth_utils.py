@@ -1,7 +1,7 @@
 
-import aiohttp
 import logging
 from config import SHEERLUXE_COOKIE
+from scraper.http_client import create_async_session
 
 logger = logging.getLogger(__name__)
 
@@ -39,4 +39,4 @@ class AuthSession:
         return headers
 
     async def create_session(self):
-        return aiohttp.ClientSession(headers=self.get_headers())
+        return create_async_session(headers=self.get_headers())
@@ -1,12 +1,24 @@
 from supabase import create_client
 from openai import OpenAI
-import os, logging
+import os, logging, time
+from array import array
 from datetime import datetime
 import json
 from config import BATCH_SIZE
+from scraper.embedding_batcher import get_embedding_batcher
+from scraper.bulk_writer import upsert_with_bisect
+from scraper.canonical import canonicalize
+from utils.url_hash_set import UrlHashSet, hash_url
 
 logger = logging.getLogger(__name__)
 
+EXISTING_PAGE_SIZE = int(os.getenv("EXISTING_PAGE_SIZE", "1000"))
+# Resolved once at import so workers started from any directory share the same snapshot.
+EXISTING_SNAPSHOT_DIR = os.path.abspath(os.path.expanduser(os.getenv(
+    "EXISTING_SNAPSHOT_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache")
+)))
+EXISTING_SNAPSHOT_MAX_AGE = int(os.getenv("EXISTING_SNAPSHOT_MAX_AGE", str(6 * 3600)))
+
 supabase_client = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
@@ -33,29 +45,17 @@ def insert_metadata_to_supabase_sync(metadata_list, batch_size=5000):
         batches = [processed_records[i:i + batch_size] 
                   for i in range(0, len(processed_records), batch_size)]
         
-        # Use regular insert with error handling per batch
+        # Upsert each batch, bisecting failed batches down to the bad records
         for batch in batches:
-            try:
-                logger.info(f"========== STARTING DB FLUSH: {len(batch)} records ==========")
-                supabase_client.table('moodboard_items')\
-                    .insert(batch)\
-                    .execute()
-                logger.info(f"========== COMPLETED DB FLUSH: {len(batch)} records ==========")
-            except Exception as e:
-                logger.error(f"Failed to insert batch: {str(e)}")
-                failed_records.extend(batch)
-                continue
-                
-        # Retry failed records individually
-        for record in failed_records:
-            try:
-                supabase_client.table('moodboard_items')\
-                    .insert([record])\
-                    .execute()
-                logger.info("Recovered failed record")
-            except Exception as e:
-                logger.error(f"Failed to recover record {record['image_url']}: {str(e)}")
-            
+            logger.info(f"========== STARTING DB FLUSH: {len(batch)} records ==========")
+            failed = upsert_with_bisect(supabase_client, 'moodboard_items', batch)
+            failed_records.extend(failed)
+            logger.info(f"========== COMPLETED DB FLUSH: {len(batch) - len(failed)}/{len(batch)} records ==========")
+
+        if failed_records:
+            logger.error(f"Failed to write {len(failed_records)} records: "
+                         f"{[r['image_url'] for r in failed_records]}")
+
     except Exception as e:
         logger.error(f"Supabase Error: {e}")
         # Log failed batch for retry
@@ -64,11 +64,7 @@ def insert_metadata_to_supabase_sync(metadata_list, batch_size=5000):
 
 def generate_embedding_sync(metadata):
     try:
-        response = client.embeddings.create(
-            input=json.dumps(metadata),
-            model="text-embedding-ada-002"
-        )
-        embedding_vector = response.data[0].embedding
+        embedding_vector = get_embedding_batcher(client, "text-embedding-ada-002").embed(json.dumps(metadata))
         return embedding_vector
     except Exception as e:
         logger.error(f"Embedding generation failed: {str(e)}")
@@ -91,15 +87,75 @@ def check_image_exists(image_url: str) -> bool:
         logger.error(f"Failed to check image existence: {e}")
         return False
 
-def get_existing_urls_and_images():
+def iter_moodboard_rows(columns="id,source_url,image_url", page_size=EXISTING_PAGE_SIZE):
+    """Stream moodboard_items rows with keyset pagination on id.
+
+    Stops only on an empty page, so a server-side row cap lower than
+    page_size just means more pages rather than silently truncated results.
+    """
+    last_id = None
+    while True:
+        query = supabase_client.table('moodboard_items').select(columns).order('id').limit(page_size)
+        if last_id is not None:
+            query = query.gt('id', last_id)
+        rows = query.execute().data
+        if not rows:
+            return
+        yield from rows
+        last_id = rows[-1]['id']
+
+def _snapshot_paths():
+    # Hashes are of canonical URLs; the name changed when that started
+    return (os.path.join(EXISTING_SNAPSHOT_DIR, "existing_urls.canonical.bin"),
+            os.path.join(EXISTING_SNAPSHOT_DIR, "existing_images.canonical.bin"))
+
+def _load_snapshot():
+    urls_path, images_path = _snapshot_paths()
     try:
-        result = supabase_client.table('moodboard_items').select('source_url,image_url').execute()
-        urls = {item['source_url'] for item in result.data if item['source_url']}
-        images = {item['image_url'] for item in result.data if item['image_url']}
-        return urls, images
+        age = time.time() - min(os.path.getmtime(urls_path), os.path.getmtime(images_path))
+    except OSError:
+        return None
+    if age > EXISTING_SNAPSHOT_MAX_AGE:
+        return None
+    try:
+        return UrlHashSet.load(urls_path), UrlHashSet.load(images_path)
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable existing-items snapshot: {e}")
+        return None
+
+def get_existing_urls_and_images(use_snapshot=True):
+    """Return compact membership sets of known source URLs and image URLs.
+
+    Loads a local snapshot when one is fresher than EXISTING_SNAPSHOT_MAX_AGE,
+    otherwise streams the whole table and writes a new snapshot.
+    """
+    if use_snapshot:
+        snapshot = _load_snapshot()
+        if snapshot:
+            logger.info(f"Loaded existing items snapshot: {len(snapshot[0])} URLs, {len(snapshot[1])} images")
+            return snapshot
+
+    try:
+        url_hashes = array('Q')
+        image_hashes = array('Q')
+        for row in iter_moodboard_rows():
+            if row.get('source_url'):
+                url_hashes.append(hash_url(canonicalize(row['source_url'])))
+            if row.get('image_url'):
+                image_hashes.append(hash_url(canonicalize(row['image_url'])))
+        urls, images = UrlHashSet(url_hashes), UrlHashSet(image_hashes)
     except Exception as e:
         logger.error(f"Failed to fetch existing URLs and images: {e}")
-        return set(), set()
+        return UrlHashSet(), UrlHashSet()
+
+    if use_snapshot:
+        try:
+            urls_path, images_path = _snapshot_paths()
+            urls.save(urls_path)
+            images.save(images_path)
+        except Exception as e:
+            logger.warning(f"Failed to write existing items snapshot: {e}")
+    return urls, images
 
 def prepare_metadata_record(image_url, source_url, title, description, structured_metadata, embedding, stored_image_url=None):
     return {
@@ -1,46 +1,68 @@
-from openai import OpenAI, APITimeoutError, APIConnectionError
+from openai import OpenAI, APITimeoutError, APIConnectionError, RateLimitError, InternalServerError
 import json
 import logging
+from scraper.embedding_batcher import get_embedding_batcher
+from scraper import openai_governor
+from scraper.openai_governor import OpenAIBusy
+from scraper.exceptions import MetadataGenerationError
 import os
 
 logger = logging.getLogger(__name__)
 
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Paced and retried by the shared OpenAI governor instead of the SDK
+governed_client = client.with_options(max_retries=0)
 
-def generate_gpt_structured_metadata_sync(image_context, retries=3, timeout=60):
+METADATA_MODEL = "gpt-4-turbo"
+# Bounds the token reservation; the JSON schema answer fits comfortably
+METADATA_MAX_TOKENS = 1500
+
+def generate_gpt_structured_metadata_sync(image_context, retries=3, timeout=60,
+                                          max_wait=openai_governor.OPENAI_MAX_QUEUE_SECONDS):
+    """Structured metadata for one image, or None when there is none.
+
+    Every attempt, retries included, takes a slot from the governor, which
+    blocks callers after a 429 and shrinks concurrency after timeouts and
+    5xx, so retries are paced rather than fired back to back. ``OpenAIBusy``
+    (no slot within ``max_wait``) and ``MetadataGenerationError`` (every
+    attempt failed) are raised so the caller retries the image later.
+    """
     prompt = build_prompt(image_context)
+    messages = [{"role": "system", "content": prompt}]
+    tokens = openai_governor.estimate_tokens(messages, METADATA_MAX_TOKENS)
+    last_error = None
 
     for attempt in range(1, retries + 1):
         try:
-            response = client.chat.completions.create(
-                model="gpt-4-turbo",
-                response_format={"type": "json_object"},
-                messages=[{"role": "system", "content": prompt}],
-                timeout=120  # Increased timeout
-            )
-            structured_metadata = response.choices[0].message.content
+            with openai_governor.slot(METADATA_MODEL, tokens, max_wait) as lease:
+                raw = governed_client.chat.completions.with_raw_response.create(
+                    model=METADATA_MODEL,
+                    response_format={"type": "json_object"},
+                    messages=messages,
+                    max_tokens=METADATA_MAX_TOKENS,
+                    timeout=120  # Increased timeout
+                )
+                lease.observe(raw.headers)
+            structured_metadata = raw.parse().choices[0].message.content
             logger.info(f"GPT metadata success for: {image_context['image_url']}")
             return json.loads(structured_metadata)
-        except (APITimeoutError, APIConnectionError) as e:
+        except OpenAIBusy as e:
+            logger.warning(f"OpenAI budget exhausted for {image_context['image_url']}: {str(e)}")
+            raise
+        except (APITimeoutError, APIConnectionError, RateLimitError, InternalServerError) as e:
             logger.warning(f"Temporary error (attempt {attempt}/{retries}): {str(e)}")
-            if attempt < retries:
-                import time
-                time.sleep(attempt * 2)  # Exponential backoff
-                continue
+            last_error = e
         except Exception as e:
             logger.error(f"GPT metadata error: {str(e)}")
-            break
-    
-    logger.error(f"All attempts failed for image: {image_context['image_url']}")
-    return None
+            return None
+
+    raise MetadataGenerationError(
+        f"All {retries} attempts failed for image: {image_context['image_url']}"
+    ) from last_error
 
 def generate_embedding_sync(metadata):
     try:
-        response = client.embeddings.create(
-            input=json.dumps(metadata),
-            model="text-embedding-ada-002"
-        )
-        embedding_vector = response.data[0].embedding
+        embedding_vector = get_embedding_batcher(client, "text-embedding-ada-002").embed(json.dumps(metadata))
         logger.info("Embedding generated successfully.")
         return embedding_vector
     except Exception as e:
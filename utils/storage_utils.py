@@ -4,10 +4,11 @@ from utils.supabase_client import supabase_client
 
 
 
-import requests
 import logging
 import re
 from datetime import datetime
+from scraper.canonical import canonicalize
+from scraper.http_client import fetch
 
 logger = logging.getLogger(__name__)
 
@@ -16,7 +17,7 @@ def store_image(image_url: str, existing_images=None) -> str:
         # Check both original URL and processed URL for duplicates
         if existing_images:
             # Check original URL
-            if image_url in existing_images:
+            if canonicalize(image_url) in existing_images:
                 logger.info(f"Image exists in DB: {image_url}")
                 return image_url
                 
@@ -25,7 +26,7 @@ def store_image(image_url: str, existing_images=None) -> str:
             safe_name = re.sub(r'[^a-zA-Z0-9.-]', '_', base_name)
             processed_url = f"https://kepdfmsdvrlsloyilqsw.supabase.co/storage/v1/object/sheerluxe-images/{safe_name}"
             
-            if processed_url in existing_images:
+            if canonicalize(processed_url) in existing_images:
                 logger.info(f"Image exists in DB with processed URL: {processed_url}")
                 return processed_url
         
@@ -43,7 +44,7 @@ def store_image(image_url: str, existing_images=None) -> str:
             logger.info(f"Image exists in storage: {image_url}")
             return f"https://kepdfmsdvrlsloyilqsw.supabase.co/storage/v1/object/sheerluxe-images/{safe_name}"
             
-        response = requests.get(image_url)
+        response = fetch(image_url)
         if response.status_code != 200:
             logger.error(f"Failed to fetch image {image_url}: HTTP {response.status_code}")
             return None
@@ -0,0 +1,113 @@
+import os
+import struct
+import logging
+from array import array
+from bisect import bisect_left
+from hashlib import blake2b
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+logger = logging.getLogger(__name__)
+
+_MAGIC = b"URLHSET1"
+
+
+def hash_url(url: str) -> int:
+    return int.from_bytes(blake2b(url.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def _sort_in_place(hashes: array) -> None:
+    if numpy is not None:
+        numpy.frombuffer(hashes, dtype=numpy.uint64).sort()  # Sorts the array's own buffer
+    else:
+        hashes[:] = array("Q", sorted(hashes))
+
+
+def _dedupe_sorted(hashes: array) -> None:
+    """Drop repeats from a sorted array in one pass, compacting it in place."""
+    kept = 0
+    for h in hashes:
+        if kept == 0 or hashes[kept - 1] != h:
+            hashes[kept] = h
+            kept += 1
+    del hashes[kept:]
+
+
+class UrlHashSet:
+    """Membership set of URLs stored as a sorted array of 64-bit hashes.
+
+    Uses 8 bytes per URL instead of a full Python string, at the cost of a
+    ~n/2^64 false-positive rate. URLs added after construction go into a
+    small overflow set until the next rebuild.
+    """
+
+    def __init__(self, hashes=()):
+        """``hashes`` may be any iterable; an ``array("Q")`` is sorted and de-duplicated in place."""
+        if not (isinstance(hashes, array) and hashes.typecode == "Q"):
+            hashes = array("Q", hashes)
+        _sort_in_place(hashes)
+        _dedupe_sorted(hashes)
+        self._hashes = hashes
+        self._added = set()
+
+    @classmethod
+    def from_urls(cls, urls):
+        return cls(hash_url(url) for url in urls if url)
+
+    def __contains__(self, url) -> bool:
+        h = hash_url(url)
+        if h in self._added:
+            return True
+        i = bisect_left(self._hashes, h)
+        return i < len(self._hashes) and self._hashes[i] == h
+
+    def __len__(self) -> int:
+        return len(self._hashes) + len(self._added)
+
+    def add(self, url: str) -> None:
+        if url not in self:
+            self._added.add(hash_url(url))
+
+    def _merged(self) -> array:
+        """The sorted array with the overflow set merged in, built without a set of every hash."""
+        hashes = self._hashes
+        merged = array("Q")
+        start = 0
+        for h in sorted(self._added):
+            i = bisect_left(hashes, h, start)
+            merged.extend(hashes[start:i])
+            if i == len(hashes) or hashes[i] != h:
+                merged.append(h)
+            start = i
+        merged.extend(hashes[start:])
+        return merged
+
+    def save(self, path: str) -> None:
+        """Write a snapshot atomically so a crash never leaves a torn file.
+
+        Also folds the overflow set into the sorted array.
+        """
+        hashes = self._merged() if self._added else self._hashes
+        self._hashes, self._added = hashes, set()
+        tmp_path = f"{path}.tmp"
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(tmp_path, "wb") as f:
+            f.write(_MAGIC)
+            f.write(struct.pack("<Q", len(hashes)))
+            hashes.tofile(f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "UrlHashSet":
+        with open(path, "rb") as f:
+            if f.read(len(_MAGIC)) != _MAGIC:
+                raise ValueError(f"Not a URL hash snapshot: {path}")
+            (count,) = struct.unpack("<Q", f.read(8))
+            hashes = array("Q")
+            hashes.fromfile(f, count)
+        instance = cls()
+        instance._hashes = hashes
+        return instance